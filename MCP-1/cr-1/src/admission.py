@@ -0,0 +1,201 @@
+"""Admission control for /mcp: bounded concurrency, a short wait queue, fast shedding.
+
+`AdmissionController.acquire()` admits a request into one of two lanes:
+
+- the general lane holds up to MCP_MAX_IN_FLIGHT requests per worker
+  process (an instance running N gunicorn workers admits up to N times as
+  many; size the limit for one worker's event loop). When it is full,
+  up to MCP_ADMISSION_QUEUE requests wait (first come, first served) for at
+  most MCP_ADMISSION_WAIT_MS for a slot. Anything beyond that is rejected
+  immediately, so under overload latency stays flat for admitted requests
+  instead of growing for everyone until Cloud Run times them out.
+- the reserved lane (MCP_RESERVED_SLOTS slots) is only for the methods in
+  MCP_PRIORITY_METHODS (`initialize` and `ping`), so handshakes and health
+  checks never queue behind `tools/call` traffic. A priority request that
+  finds the reserved lane full may take a free general slot, but never waits.
+
+Rejected requests are answered with HTTP 503, a `Retry-After` header and
+`overload_body()`, a JSON-RPC error with code OVERLOADED. Rejections are
+counted by reason and rendered on /metrics.
+
+Each worker has its own controller, and MCP_RESERVED_SLOTS and
+MCP_ADMISSION_QUEUE are per worker as well. The controller is not
+thread-safe; use it from the event loop only.
+"""
+import asyncio
+import os
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, FrozenSet, Optional
+
+from registry import encode_error
+
+# JSON-RPC error code for requests shed by admission control (server error range)
+OVERLOADED = -32003
+
+GENERAL = "general"
+RESERVED = "reserved"
+
+# Rejection reasons: general lane and queue full, waited too long, priority lanes full
+QUEUE_FULL = "queue_full"
+QUEUE_TIMEOUT = "queue_timeout"
+RESERVED_FULL = "reserved_full"
+
+
+class AdmissionController:
+    """In-flight limit with a bounded FIFO wait queue and a reserved lane for priority methods."""
+
+    def __init__(
+        self,
+        limit: int = 80,
+        queue_size: int = 32,
+        wait: float = 0.1,
+        reserved: int = 4,
+        priority_methods: FrozenSet[str] = frozenset({"initialize", "ping"}),
+        retry_after: int = 1,
+    ):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.wait = wait
+        self.reserved = reserved
+        self.priority_methods = priority_methods
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.reserved_in_flight = 0
+        self.rejected: Dict[str, int] = {QUEUE_FULL: 0, QUEUE_TIMEOUT: 0, RESERVED_FULL: 0}
+        self._waiters: Deque["asyncio.Future[None]"] = deque()
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            # Per worker process, not per instance
+            limit=int(os.getenv("MCP_MAX_IN_FLIGHT", "80")),
+            queue_size=int(os.getenv("MCP_ADMISSION_QUEUE", "32")),
+            wait=float(os.getenv("MCP_ADMISSION_WAIT_MS", "100")) / 1000,
+            reserved=int(os.getenv("MCP_RESERVED_SLOTS", "4")),
+            priority_methods=frozenset(
+                m.strip() for m in os.getenv("MCP_PRIORITY_METHODS", "initialize,ping").split(",") if m.strip()
+            ),
+            retry_after=int(os.getenv("MCP_RETRY_AFTER", "1")),
+        )
+
+    def is_priority(self, body: Any) -> bool:
+        """Whether a parsed JSON-RPC message goes to the reserved lane (batches never do)."""
+        return isinstance(body, dict) and body.get("method") in self.priority_methods
+
+    async def acquire(self, priority: bool = False) -> Optional[str]:
+        """Admit a request; returns its lane (pass it to `release`), or None if it is rejected."""
+        if priority:
+            if self.reserved_in_flight < self.reserved:
+                self.reserved_in_flight += 1
+                return RESERVED
+            if self.in_flight < self.limit and not self._waiters:
+                self.in_flight += 1
+                return GENERAL
+            self.rejected[RESERVED_FULL] += 1
+            return None
+
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return GENERAL
+        if len(self._waiters) >= self.queue_size:
+            self.rejected[QUEUE_FULL] += 1
+            return None
+
+        waiter: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # `release` hands its slot over by resolving the waiter (in_flight stays counted)
+            await asyncio.wait_for(waiter, self.wait)
+            return GENERAL
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            if waiter.done() and not waiter.cancelled():
+                # Handed a slot just as the wait ran out
+                return GENERAL
+            self.rejected[QUEUE_TIMEOUT] += 1
+            return None
+        except asyncio.CancelledError:
+            self._discard(waiter)
+            if waiter.done() and not waiter.cancelled():
+                self.release(GENERAL)
+            raise
+
+    def release(self, lane: str) -> None:
+        if lane == RESERVED:
+            self.reserved_in_flight -= 1
+            return
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _discard(self, waiter: "asyncio.Future[None]") -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def hold(self, lane: str, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Keep `lane`'s slot until a streamed response finishes (or is dropped unsent)."""
+        return _HeldStream(self, lane, chunks)
+
+    def overload_body(self, body: Any) -> bytes:
+        """JSON-RPC error for a rejected message (id null for batches)."""
+        msg_id = body.get("id") if isinstance(body, dict) else None
+        return encode_error(msg_id, OVERLOADED, "Server overloaded", {"retryAfter": self.retry_after})
+
+    def render(self) -> str:
+        """Prometheus text for the admission gauges and rejection counters."""
+        lines = [
+            "# HELP mcp_admission_in_flight Requests admitted and not yet finished, by lane.",
+            "# TYPE mcp_admission_in_flight gauge",
+            f'mcp_admission_in_flight{{lane="{GENERAL}"}} {self.in_flight}',
+            f'mcp_admission_in_flight{{lane="{RESERVED}"}} {self.reserved_in_flight}',
+            "# HELP mcp_admission_queued Requests waiting for a general slot.",
+            "# TYPE mcp_admission_queued gauge",
+            f"mcp_admission_queued {len(self._waiters)}",
+            "# HELP mcp_admission_rejected_total Requests shed with 503, by reason.",
+            "# TYPE mcp_admission_rejected_total counter",
+        ]
+        lines += [f'mcp_admission_rejected_total{{reason="{r}"}} {n}' for r, n in self.rejected.items()]
+        return "\n".join(lines) + "\n"
+
+
+class _HeldStream:
+    """Async iterator that releases an admission slot when the stream ends.
+
+    A class rather than an async generator: a generator that is never
+    iterated (client gone before the body starts) never runs its `finally`,
+    and the slot would leak.
+    """
+
+    def __init__(self, controller: AdmissionController, lane: str, chunks: AsyncIterator[bytes]):
+        self.controller = controller
+        self.lane: Optional[str] = lane
+        self.chunks = chunks
+
+    def __aiter__(self) -> "_HeldStream":
+        return self
+
+    async def __anext__(self) -> bytes:
+        try:
+            return await self.chunks.__anext__()
+        except BaseException:
+            self.release()
+            raise
+
+    async def aclose(self) -> None:
+        self.release()
+        aclose = getattr(self.chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    def release(self) -> None:
+        if self.lane is not None:
+            lane, self.lane = self.lane, None
+            self.controller.release(lane)
+
+    def __del__(self) -> None:
+        self.release()
@@ -0,0 +1,111 @@
+"""Production launcher settings: one uvicorn worker process per available CPU.
+
+The Dockerfile runs `gunicorn <module>:app`, which reads this file from the
+working directory. Each worker is a uvicorn event loop (UvicornWorker), so an
+instance with N vCPUs serves on N cores instead of one.
+
+- workers: WEB_CONCURRENCY if set, else the CPUs the container may use (its
+  cgroup CPU quota rounded up, capped by the affinity mask).
+- preload_app: the master imports the app once, then forks. Workers share
+  those pages copy-on-write, and caches created at import time
+  (shared_cache.py) are shared by all of them. Before forking, the master
+  also imports PRELOAD_MODULES (libraries the app otherwise loads lazily,
+  skipped if not installed) and freezes the garbage collector, so
+  collections in the workers don't write to (and copy) the preloaded objects.
+- State that is only correct within one process forces a single worker:
+  MCP_SESSIONS without SESSION_REDIS_URL (a session opened on one worker
+  would be unknown to the others) and RATE_LIMIT/RATE_LIMITS without
+  RATE_LIMIT_REDIS_URL (every worker would grant the full limit).
+- timeout = 0: Cloud Run enforces the request timeout, and gunicorn must not
+  kill a worker busy with a long SSE stream. graceful_timeout stays below
+  the 10 s Cloud Run allows between SIGTERM and SIGKILL.
+
+Everything else in a worker (admission limits, breakers, retry budgets,
+upstream sessions) is per process: an instance admits up to workers x
+MCP_MAX_IN_FLIGHT requests, and each worker opens its own breakers. Metrics
+are per process too, but /metrics answers for every worker, labelled
+worker="<pid>" (see worker_metrics.py). `uvicorn <module>:app` still runs a
+single process for local development.
+"""
+import gc
+import importlib
+import math
+import os
+from typing import Optional
+
+# Libraries imported in the master before forking, comma-separated
+PRELOAD_MODULES = os.getenv(
+    "PRELOAD_MODULES", "httpx,google.auth.jwt,google.auth.transport.requests,google.oauth2.id_token,jsonrpcserver"
+)
+
+
+def _cgroup_cpus() -> Optional[float]:
+    """The container's CPU quota in CPUs (cgroup v2, then v1), or None if unlimited."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota_us = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period_us = int(f.read())
+        return quota_us / period_us if quota_us > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on: the affinity mask, capped by the cgroup quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_cpus()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+
+def single_process_reason() -> Optional[str]:
+    """Why the app must run in one process, or None if workers are safe."""
+    if os.getenv("MCP_SESSIONS", "false").lower() in {"1", "true", "yes"} and not os.getenv("SESSION_REDIS_URL"):
+        return "MCP_SESSIONS is on without SESSION_REDIS_URL"
+    if (os.getenv("RATE_LIMIT") or os.getenv("RATE_LIMITS")) and not os.getenv("RATE_LIMIT_REDIS_URL"):
+        return "rate limits are set without RATE_LIMIT_REDIS_URL"
+    return None
+
+
+_single_reason = single_process_reason()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = 1 if _single_reason else int(os.getenv("WEB_CONCURRENCY", "0")) or available_cpus()
+preload_app = True
+timeout = 0
+graceful_timeout = 8
+
+# gunicorn's own messages go to the root logger, so the JSON writer installed by logs.setup() formats them too
+logconfig_dict = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "loggers": {
+        "gunicorn.error": {"level": "INFO", "handlers": [], "propagate": True},
+        "gunicorn.access": {"level": "INFO", "handlers": [], "propagate": True},
+    },
+}
+
+
+def when_ready(server) -> None:
+    """Runs in the master after the app is loaded and before the workers are forked."""
+    if _single_reason:
+        server.log.warning("Running a single worker: %s", _single_reason)
+    for name in PRELOAD_MODULES.split(","):
+        try:
+            importlib.import_module(name.strip())
+        except ImportError:
+            pass
+    gc.collect()
+    gc.freeze()
@@ -0,0 +1,343 @@
+"""Latency histograms and counters for the MCP JSON-RPC handlers.
+
+Every JSON-RPC call is recorded under its method and, for `tools/call`, its
+tool. Each series tracks:
+
+- calls and a latency histogram;
+- errors by JSON-RPC code;
+- calls currently in flight.
+
+Token verification gets its own histogram and failure counter.
+
+The histograms record into fixed log-linear buckets, HDR style: 4
+sub-buckets per power of two from about 15 us to 56 s, so any value lands in
+a bucket within about 19% of it. Recording a call is a `bisect` over the
+bucket bounds plus a few integer increments under a lock, taken once in
+`begin` and once in `end`; benchmarks/bench_metrics.py measures about 1.5 us
+for the pair and 0.3 us for `call_labels`, mostly lock and call overhead.
+
+`render()` produces the Prometheus text format served on /metrics. When
+OTEL_EXPORTER_OTLP_ENDPOINT (or OTEL_EXPORTER_OTLP_METRICS_ENDPOINT) is set,
+`OtlpExporter` also pushes the same data as cumulative OTLP/HTTP JSON every
+OTEL_METRIC_EXPORT_INTERVAL ms. Both export coarser buckets (EXPORT_BOUNDS,
+one per power of two) so a scrape stays small: each exported bucket is the
+sum of the 4 recorded ones below it.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from registry import Method, Registry
+
+logger = logging.getLogger(__name__)
+
+# Histogram upper bounds in seconds: 2**e * (1 + k/4) for e in [-16, 6)
+BOUNDS: Tuple[float, ...] = tuple(2.0**e * (1 + k / 4) for e in range(-16, 6) for k in range(4))
+
+# Indexes into BOUNDS of the exported bucket bounds: the powers of two, plus the last bound
+_EXPORTED: Tuple[int, ...] = tuple(range(0, len(BOUNDS), 4)) + (len(BOUNDS) - 1,)
+
+# Exported histogram upper bounds in seconds: 2**e for e in [-16, 6), then 56
+EXPORT_BOUNDS: Tuple[float, ...] = tuple(BOUNDS[i] for i in _EXPORTED)
+
+# `le` label values, ending with the +Inf bucket
+_LE: Tuple[str, ...] = tuple(repr(b) for b in EXPORT_BOUNDS) + ("+Inf",)
+
+# Label used for methods and tools that are not registered (keeps label cardinality bounded)
+UNKNOWN = "unknown"
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Series:
+    __slots__ = ("labels", "counts", "total", "errors", "in_flight")
+
+    def __init__(self, labels: Tuple[Tuple[str, str], ...]):
+        self.labels = labels
+        # counts[i] holds values <= BOUNDS[i] (and > BOUNDS[i-1]); the last slot is +Inf
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.total = 0.0
+        self.errors: Dict[int, int] = {}
+        self.in_flight = 0
+
+
+class Metrics:
+    """Per-method/per-tool call metrics plus token verification timings."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Tuple[str, str], Series] = {}
+        self.auth = Series(())
+        self.start_time_ns = time.time_ns()
+
+    def begin(self, method: str, tool: str = "") -> Series:
+        """Mark a call as in flight; pass the result to `end`."""
+        series = self._calls.get((method, tool))
+        if series is None:
+            series = self._calls.setdefault((method, tool), Series((("method", method), ("tool", tool))))
+        with self._lock:
+            series.in_flight += 1
+        return series
+
+    def end(self, series: Series, started: float, code: int = 0) -> None:
+        """Record a call that began at `started` (time.perf_counter()); code 0 means success."""
+        elapsed = time.perf_counter() - started
+        index = bisect_left(BOUNDS, elapsed)
+        with self._lock:
+            series.counts[index] += 1
+            series.total += elapsed
+            series.in_flight -= 1
+            if code:
+                series.errors[code] = series.errors.get(code, 0) + 1
+
+    def observe_auth(self, started: float, ok: bool) -> None:
+        elapsed = time.perf_counter() - started
+        index = bisect_left(BOUNDS, elapsed)
+        with self._lock:
+            self.auth.counts[index] += 1
+            self.auth.total += elapsed
+            if not ok:
+                # Rejected tokens are kept under the HTTP status they produce
+                self.auth.errors[401] = self.auth.errors.get(401, 0) + 1
+
+    async def track_stream(self, series: Series, started: float, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Pass a streamed response through, recording the call when it finishes."""
+        code = 0
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except Exception:
+            code = -32603
+            raise
+        finally:
+            self.end(series, started, code)
+
+    def snapshot(self) -> List[Tuple[Tuple[Tuple[str, str], ...], List[int], float, Dict[int, int], int]]:
+        """(labels, bucket counts, sum, errors, in flight) per call series, then the auth series."""
+        with self._lock:
+            return [
+                (s.labels, list(s.counts), s.total, dict(s.errors), s.in_flight)
+                for s in (*self._calls.values(), self.auth)
+            ]
+
+    def render(self) -> str:
+        """Prometheus text exposition of every series."""
+        *calls, auth = self.snapshot()
+        lines: List[str] = []
+
+        lines += [
+            "# HELP mcp_request_duration_seconds JSON-RPC call latency by method and tool.",
+            "# TYPE mcp_request_duration_seconds histogram",
+        ]
+        for labels, counts, total, _errors, _in_flight in calls:
+            _histogram_lines(lines, "mcp_request_duration_seconds", labels, counts, total)
+
+        lines += ["# HELP mcp_requests_total JSON-RPC calls by method and tool.", "# TYPE mcp_requests_total counter"]
+        for labels, counts, _total, _errors, _in_flight in calls:
+            lines.append(f"mcp_requests_total{_labels(labels)} {sum(counts)}")
+
+        lines += [
+            "# HELP mcp_errors_total JSON-RPC error responses by method, tool and error code.",
+            "# TYPE mcp_errors_total counter",
+        ]
+        for labels, _counts, _total, errors, _in_flight in calls:
+            for code, count in sorted(errors.items()):
+                lines.append(f"mcp_errors_total{_labels(labels + (('code', str(code)),))} {count}")
+
+        lines += ["# HELP mcp_in_flight JSON-RPC calls currently running.", "# TYPE mcp_in_flight gauge"]
+        for labels, _counts, _total, _errors, in_flight in calls:
+            lines.append(f"mcp_in_flight{_labels(labels)} {in_flight}")
+
+        labels, counts, total, errors, _in_flight = auth
+        lines += [
+            "# HELP mcp_auth_duration_seconds ID token verification latency.",
+            "# TYPE mcp_auth_duration_seconds histogram",
+        ]
+        _histogram_lines(lines, "mcp_auth_duration_seconds", labels, counts, total)
+        lines += [
+            "# HELP mcp_auth_failures_total Rejected ID tokens.",
+            "# TYPE mcp_auth_failures_total counter",
+            f"mcp_auth_failures_total {errors.get(401, 0)}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+# Label sets are bounded (unregistered names are folded into UNKNOWN), so each is formatted once
+@lru_cache(maxsize=None)
+def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _export_counts(counts: List[int]) -> List[int]:
+    """Bucket counts for EXPORT_BOUNDS and +Inf, each the sum of the recorded buckets it covers."""
+    exported = []
+    start = 0
+    for end in _EXPORTED:
+        exported.append(sum(counts[start : end + 1]))
+        start = end + 1
+    exported.append(sum(counts[start:]))
+    return exported
+
+
+def _histogram_lines(
+    lines: List[str], name: str, labels: Tuple[Tuple[str, str], ...], counts: List[int], total: float
+) -> None:
+    prefix = _labels(labels)[1:-1] + "," if labels else ""
+    cumulative = 0
+    for le, count in zip(_LE, _export_counts(counts)):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+    lines.append(f"{name}_sum{_labels(labels)} {total!r}")
+    lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+
+
+def call_labels(registry: Registry, entry: Optional[Method], params: Any) -> Tuple[str, str]:
+    """(method, tool) labels for a call, with unregistered names folded into UNKNOWN."""
+    if entry is None:
+        return UNKNOWN, ""
+    if entry.name != "tools/call":
+        return entry.name, ""
+    if not isinstance(params, dict):
+        return entry.name, UNKNOWN
+    # The tool name as tool_call_args finds it, without building the arguments
+    tool_name = params["tool"] if "tool" in params else params.get("name")
+    return entry.name, tool_name if registry.get_tool(tool_name) is not None else UNKNOWN
+
+
+class OtlpExporter:
+    """Pushes `Metrics` to an OTLP/HTTP collector from a daemon thread."""
+
+    def __init__(self, metrics: Metrics, endpoint: str, service: str, interval: float = 60.0):
+        self.metrics = metrics
+        self.endpoint = endpoint
+        self.service = service
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls, metrics: Metrics, service: str) -> Optional["OtlpExporter"]:
+        endpoint = os.getenv("OTEL_EXPORTER_OTLP_METRICS_ENDPOINT")
+        if not endpoint:
+            base = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+            if not base:
+                return None
+            endpoint = base.rstrip("/") + "/v1/metrics"
+        interval = float(os.getenv("OTEL_METRIC_EXPORT_INTERVAL", "60000")) / 1000
+        return cls(metrics, endpoint, os.getenv("OTEL_SERVICE_NAME", service), interval)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="otlp-metrics", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.export()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.export()
+
+    def export(self) -> None:
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(self.payload()).encode(), headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                response.read()
+        except Exception as e:
+            logger.warning("otlp metrics export failed", extra={"endpoint": self.endpoint, "error": str(e)})
+
+    def payload(self) -> Dict[str, Any]:
+        start, now = str(self.metrics.start_time_ns), str(time.time_ns())
+        *calls, (_auth_labels, auth_counts, auth_total, auth_errors, _in_flight) = self.metrics.snapshot()
+
+        def attributes(labels: Tuple[Tuple[str, str], ...]) -> List[Dict[str, Any]]:
+            return [{"key": f"mcp.{k}", "value": {"stringValue": v}} for k, v in labels]
+
+        def histogram(labels: Tuple[Tuple[str, str], ...], counts: List[int], total: float) -> Dict[str, Any]:
+            return {
+                "attributes": attributes(labels),
+                "startTimeUnixNano": start,
+                "timeUnixNano": now,
+                "count": str(sum(counts)),
+                "sum": total,
+                "bucketCounts": [str(c) for c in _export_counts(counts)],
+                "explicitBounds": list(EXPORT_BOUNDS),
+            }
+
+        def number(labels: Tuple[Tuple[str, str], ...], value: int) -> Dict[str, Any]:
+            return {
+                "attributes": attributes(labels),
+                "startTimeUnixNano": start,
+                "timeUnixNano": now,
+                "asInt": str(value),
+            }
+
+        cumulative = 2  # AGGREGATION_TEMPORALITY_CUMULATIVE
+        metrics = [
+            {
+                "name": "mcp.request.duration",
+                "unit": "s",
+                "histogram": {
+                    "aggregationTemporality": cumulative,
+                    "dataPoints": [histogram(labels, counts, total) for labels, counts, total, _e, _f in calls],
+                },
+            },
+            {
+                "name": "mcp.errors",
+                "sum": {
+                    "aggregationTemporality": cumulative,
+                    "isMonotonic": True,
+                    "dataPoints": [
+                        number(labels + (("code", str(code)),), count)
+                        for labels, _c, _t, errors, _f in calls
+                        for code, count in errors.items()
+                    ],
+                },
+            },
+            {
+                "name": "mcp.in_flight",
+                "gauge": {"dataPoints": [number(labels, in_flight) for labels, _c, _t, _e, in_flight in calls]},
+            },
+            {
+                "name": "mcp.auth.duration",
+                "unit": "s",
+                "histogram": {
+                    "aggregationTemporality": cumulative,
+                    "dataPoints": [histogram((), auth_counts, auth_total)],
+                },
+            },
+            {
+                "name": "mcp.auth.failures",
+                "sum": {
+                    "aggregationTemporality": cumulative,
+                    "isMonotonic": True,
+                    "dataPoints": [number((), auth_errors.get(401, 0))],
+                },
+            },
+        ]
+        return {
+            "resourceMetrics": [
+                {
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service}}]},
+                    "scopeMetrics": [{"scope": {"name": "mcp"}, "metrics": metrics}],
+                }
+            ]
+        }
@@ -0,0 +1,70 @@
+"""JSON encode/decode for MCP request and response bodies.
+
+Request bodies are decoded straight from bytes and responses are encoded
+straight to bytes, with no intermediate `str`. The fastest available backend
+is used (orjson, then msgspec, then the stdlib); set MCP_JSON_BACKEND to force
+one of "orjson", "msgspec" or "json".
+"""
+import json
+import os
+from types import SimpleNamespace
+from typing import Any, Callable, Tuple, Type
+
+
+def _stdlib() -> SimpleNamespace:
+    encoder = json.JSONEncoder(separators=(",", ":"))
+
+    def dumps(obj: Any) -> bytes:
+        return encoder.encode(obj).encode("utf-8")
+
+    return SimpleNamespace(name="json", loads=json.loads, dumps=dumps, errors=(ValueError,))
+
+
+def _orjson() -> SimpleNamespace:
+    import orjson
+
+    return SimpleNamespace(name="orjson", loads=orjson.loads, dumps=orjson.dumps, errors=(orjson.JSONDecodeError,))
+
+
+def _msgspec() -> SimpleNamespace:
+    import msgspec
+
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+    return SimpleNamespace(
+        name="msgspec", loads=decoder.decode, dumps=encoder.encode, errors=(msgspec.DecodeError, ValueError)
+    )
+
+
+_BACKENDS = {"orjson": _orjson, "msgspec": _msgspec, "json": _stdlib}
+
+
+def backend(name: str) -> SimpleNamespace:
+    """Return the named backend (raises ImportError if it is not installed)."""
+    return _BACKENDS[name]()
+
+
+def _select() -> SimpleNamespace:
+    forced = os.getenv("MCP_JSON_BACKEND")
+    if forced:
+        return backend(forced)
+    for name in ("orjson", "msgspec"):
+        try:
+            return backend(name)
+        except ImportError:
+            continue
+    return _stdlib()
+
+
+_backend = _select()
+
+BACKEND: str = _backend.name
+
+# loads(bytes | str) -> object
+loads: Callable[[Any], Any] = _backend.loads
+
+# dumps(object) -> bytes (compact, UTF-8)
+dumps: Callable[[Any], bytes] = _backend.dumps
+
+# Exceptions raised by `loads` for malformed input
+DecodeError: Tuple[Type[BaseException], ...] = _backend.errors
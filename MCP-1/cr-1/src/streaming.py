@@ -0,0 +1,125 @@
+"""MCP streamable-HTTP transport: SSE responses for streaming tool calls.
+
+When a client POSTs a `tools/call` for a streaming (async generator) tool and
+its Accept header includes `text/event-stream`, the response is an SSE stream
+instead of one buffered JSON body:
+
+- `Progress` items become `notifications/progress` events, sent only if the
+  request carried `params._meta.progressToken`;
+- the JSON-RPC response is one `message` event whose `data:` lines are written
+  as the tool yields content items. SSE joins data lines with "\\n", which is
+  valid JSON whitespace, so clients parse the event as a normal response while
+  the server flushes each item as soon as it exists and holds none of them.
+
+Arguments that fail the tool's input schema get the -32602 error as the only
+event, before the tool runs. Progress yielded after the first content item is
+not sent, since the response event is already open. Everything else (batches,
+non-streaming tools, clients that only accept JSON) keeps the plain JSON path.
+"""
+import logging
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from registry import Progress, Registry, RpcError, Tool, encode_error, tool_call_args
+from serializer import dumps
+from tracing import Span
+
+logger = logging.getLogger(__name__)
+
+SSE_MEDIA_TYPE = "text/event-stream"
+
+# Headers that stop proxies (and Cloud Run's front end) from buffering the stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def accepts_sse(accept_header: Optional[str]) -> bool:
+    return bool(accept_header) and SSE_MEDIA_TYPE in accept_header
+
+
+def sse_event(data: bytes) -> bytes:
+    return b"event: message\ndata: " + data + b"\n\n"
+
+
+def progress_event(token: Any, progress: Progress) -> bytes:
+    params: Dict[str, Any] = {"progressToken": token, "progress": progress.progress}
+    if progress.total is not None:
+        params["total"] = progress.total
+    if progress.message is not None:
+        params["message"] = progress.message
+    return sse_event(dumps({"jsonrpc": "2.0", "method": "notifications/progress", "params": params}))
+
+
+def streaming_tool_call(registry: Registry, body: Dict[str, Any]) -> Optional[Tuple[Tool, Dict[str, Any]]]:
+    """Return (tool, arguments) if `body` is a tools/call of a streaming tool."""
+    if body.get("method") != "tools/call" or "id" not in body:
+        return None
+    params = body.get("params") or {}
+    if not isinstance(params, dict):
+        return None
+    tool_name, arguments = tool_call_args(params)
+    tool = registry.get_tool(tool_name)
+    if tool is None or not tool.is_stream:
+        return None
+    return tool, arguments
+
+
+async def stream_tool_call(
+    tool: Tool, arguments: Dict[str, Any], msg_id: Any, progress_token: Any = None, span: Optional[Span] = None
+) -> AsyncIterator[bytes]:
+    """Run a streaming tool and yield the SSE byte stream for its response.
+
+    `span` is ended when the stream does, marked failed if the arguments were
+    rejected or the tool raised.
+    """
+    try:
+        async for chunk in _tool_events(tool, arguments, msg_id, progress_token, span):
+            yield chunk
+    finally:
+        if span is not None:
+            # No-op if an error already ended it
+            span.end()
+
+
+def _fail(span: Optional[Span], code: int, error: str) -> None:
+    if span is not None:
+        span.set("rpc.jsonrpc.error_code", code)
+        span.end(error)
+
+
+async def _tool_events(
+    tool: Tool, arguments: Dict[str, Any], msg_id: Any, progress_token: Any, span: Optional[Span]
+) -> AsyncIterator[bytes]:
+    try:
+        tool.check(arguments)
+    except RpcError as e:
+        _fail(span, e.code, e.message)
+        yield sse_event(encode_error(msg_id, e.code, e.message, e.data))
+        return
+    head = b'event: message\ndata: {"jsonrpc":"2.0","id":' + dumps(msg_id) + b',"result":{"content":['
+    opened = False
+    count = 0
+    try:
+        async for item in tool.handler(arguments):
+            if isinstance(item, Progress):
+                if progress_token is not None and not opened:
+                    yield progress_event(progress_token, item)
+                continue
+            if not opened:
+                yield head + b"\n"
+                opened = True
+            yield b"data: " + (b"," if count else b"") + dumps(item) + b"\n"
+            count += 1
+    except Exception as e:
+        logger.exception("streaming tool failed", extra={"route": "/mcp", "tool": tool.name})
+        _fail(span, -32603, str(e))
+        if not opened:
+            yield sse_event(encode_error(msg_id, -32603, "Internal error", str(e)))
+            return
+        # The result is already partly sent; finish it as an MCP tool error
+        error_item = dumps({"type": "text", "text": f"Tool execution failed: {e}"})
+        yield b"data: " + (b"," if count else b"") + error_item + b"\n"
+        yield b'data: ],"isError":true}}\n\n'
+        return
+
+    if not opened:
+        yield head + b"\n"
+    yield b"data: ]}}\n\n"
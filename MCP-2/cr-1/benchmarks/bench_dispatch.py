@@ -0,0 +1,70 @@
+"""CPU per /mcp request: previous jsonrpcserver round trip vs raw pass-through.
+
+  before - parse body, json.dumps it back for async_dispatch, json.loads the
+           dispatcher's string, then re-encode it for JSONResponse (4 passes)
+  after  - server.dispatch_raw: bytes in, dispatcher output bytes out (2 passes),
+           with the request checked by server._validate instead of
+           jsonrpcserver's jsonschema validator
+
+CPU time is measured with time.process_time around N sequential dispatches of
+the same request, so it excludes HTTP and auth. Logging is off for both paths
+(LOG_LEVEL=WARNING unless set), so only the dispatch work is compared.
+
+Usage:
+    python benchmarks/bench_dispatch.py [--requests 5000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from jsonrpcserver import async_dispatch
+from starlette.responses import JSONResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+# Read by logs.py when server is imported: the "mcp request" log is skipped
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import server  # noqa: E402
+
+REQUESTS = {
+    "tools/call": {"jsonrpc": "2.0", "id": "4f1c", "method": "tools/call", "params": {"tool": "hello", "name": "World"}},
+    "tools/list": {"jsonrpc": "2.0", "id": 2, "method": "tools/list"},
+}
+
+
+async def before(raw: bytes) -> bytes:
+    body = json.loads(raw)
+    response = await async_dispatch(json.dumps(body))
+    return JSONResponse(content=json.loads(response)).body
+
+
+async def after(raw: bytes) -> bytes:
+    return await server.dispatch_raw(raw)
+
+
+async def cpu_per_request(fn, raw: bytes, count: int) -> float:
+    await fn(raw)
+    start = time.process_time()
+    for _ in range(count):
+        await fn(raw)
+    return (time.process_time() - start) / count * 1e6
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    print(f"{'method':<11} {'before us':>10} {'after us':>9} {'saved':>6}")
+    for label, request in REQUESTS.items():
+        raw = json.dumps(request).encode()
+        old = await cpu_per_request(before, raw, args.requests)
+        new = await cpu_per_request(after, raw, args.requests)
+        print(f"{label:<11} {old:>10.1f} {new:>9.1f} {1 - new / old:>6.0%}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,13 +1,44 @@
+from contextlib import asynccontextmanager
 from typing import Any, Dict
+import os
 from fastapi import FastAPI, HTTPException, Request, Depends
 from fastapi.responses import Response
 import uvicorn
-from google.auth.transport import requests
-import google.oauth2.id_token
 import json
 
+import logs
+from auth import CertCache, ClaimsCache, TokenVerifier
+from shared_cache import SharedCache
+from warmup import warm_up
+
+# JSON logs to stdout through a background writer (see logs.py)
+logger = logs.setup("mcp-server")
+
+# Expected ID token audience (this service's URL)
+AUTH_AUDIENCE = os.getenv("AUTH_AUDIENCE", "https://mcp-hello-456052106337.us-central1.run.app")
+
+# Certs are kept until their Cache-Control max-age expires, verified claims until token exp.
+# Both are shared by the gunicorn workers of an instance (see shared_cache.py)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+shared_certs = SharedCache("certs", slots=1, slot_size=16384)
+shared_claims = SharedCache("claims", slots=TOKEN_CACHE_SIZE)
+token_verifier = TokenVerifier(
+    AUTH_AUDIENCE,
+    certs=CertCache(shared=shared_certs),
+    claims=ClaimsCache(maxsize=TOKEN_CACHE_SIZE, shared=shared_claims),
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Google certs and the JWT/RSA code are loaded before the first request needs them
+    await warm_up({"certs": token_verifier.warm})
+    yield
+    await token_verifier.aclose()
+
+
 # Initialize FastAPI server
-app = FastAPI(title="hello-server")
+app = FastAPI(title="hello-server", lifespan=lifespan)
 
 async def verify_token(request: Request):
     """Verify the incoming ID token."""
@@ -17,29 +48,21 @@ async def verify_token(request: Request):
     
     token = auth_header.split("Bearer ")[1]
     try:
-        # Initialize the Requests object
-        request = requests.Request()
-        
-        # Verify the ID token
-        decoded_token = google.oauth2.id_token.verify_oauth2_token(
-            token, request)
-        
-        # Verify the token's audience matches our service
-        if decoded_token.get("aud") != "https://mcp-hello-456052106337.us-central1.run.app":
-            raise ValueError("Invalid token audience")
+        # Verify the ID token (signature, issuer, expiry and audience) off the event loop
+        decoded_token = await token_verifier.averify(token)
         
         # Log caller identity details for diagnostics
-        try:
-            caller_email = decoded_token.get("email")
-            caller_sub = decoded_token.get("sub")
-            caller_iss = decoded_token.get("iss")
-            caller_aud = decoded_token.get("aud")
-            print(
-                f"[MCP-SERVER] Caller email={caller_email} sub={caller_sub} iss={caller_iss} aud={caller_aud}"
-            )
-        except Exception as log_e:
-            print(f"[MCP-SERVER] Failed to log token claims: {log_e}")
-            
+        logger.info(
+            "caller verified",
+            extra={
+                "route": request.url.path,
+                "caller_email": decoded_token.get("email"),
+                "caller_sub": decoded_token.get("sub"),
+                "caller_iss": decoded_token.get("iss"),
+                "caller_aud": decoded_token.get("aud"),
+            },
+        )
+
         return decoded_token
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Invalid token: {str(e)}")
@@ -67,7 +90,11 @@ async def mcp_endpoint(request: Request):
     """MCP endpoint with authentication - handles JSON-RPC 2.0 requests."""
     try:
         body = await request.json()
-        print(f"[MCP-SERVER] Received MCP method={body.get('method')} id={body.get('id')} params={body.get('params')}")
+        # params are redacted by the log formatter
+        logger.info(
+            "mcp request",
+            extra={"route": "/mcp", "method": body.get("method"), "id": body.get("id"), "params": body.get("params")},
+        )
         
         # Handle different MCP methods
         method = body.get("method")
@@ -143,7 +170,7 @@ async def mcp_endpoint(request: Request):
         return Response(content=json.dumps(response), media_type="application/json")
         
     except Exception as e:
-        print(f"[MCP-SERVER] Error: {e}")
+        logger.exception("mcp request failed", extra={"route": "/mcp"})
         return Response(
             content=json.dumps({
                 "jsonrpc": "2.0",
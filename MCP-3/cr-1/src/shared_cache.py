@@ -0,0 +1,136 @@
+"""Fixed-size cache in shared memory, so worker processes share what they fetch.
+
+Under gunicorn (see gunicorn.conf.py) every worker is a separate process. A
+dict cache is then filled once per worker: each worker fetches Google's
+certs, verifies the same bearer tokens and mints its own ID tokens.
+`SharedCache` keeps such entries in a shared mmap of an in-memory file
+(memfd). The app is imported in the gunicorn master before it forks
+(preload_app), so a cache created at import time is mapped by every worker,
+and each worker sees what the others stored. Without gunicorn it is an
+ordinary per-process cache.
+
+The table has `slots` slots of `slot_size` bytes. A key (any bytes) hashes to
+a slot and may sit in any of PROBES consecutive slots; when all of them are
+live, the entry that expires soonest is replaced. A slot holds the key's
+SHA-256, an expiry (Unix time) and the value. Values that do not fit in a slot
+are not stored.
+
+An entry is copied in or out under a POSIX record lock on the file (plus a
+thread lock within the process). The kernel drops a record lock when its
+holder exits, so a worker killed mid-copy cannot leave the table locked.
+Callers keep a per-process cache in front, so the shared one is only read on
+a local miss.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Slot header: key digest, expiry (Unix seconds), value length
+_HEADER = struct.Struct("<32sdI")
+
+# Consecutive slots a key may occupy
+PROBES = 4
+
+
+class SharedCache:
+    """Expiring byte values in a shared mmap, visible to every forked worker."""
+
+    def __init__(self, name: str, slots: int = 1024, slot_size: int = 2048):
+        if slot_size <= _HEADER.size:
+            raise ValueError(f"slot_size must exceed the {_HEADER.size}-byte slot header")
+        self.name = name
+        self.slots = slots
+        self.slot_size = slot_size
+        if hasattr(os, "memfd_create"):
+            self._fd = os.memfd_create(f"shared-cache-{name}")
+        else:
+            import tempfile
+
+            self._fd = os.dup(tempfile.TemporaryFile().fileno())
+        os.ftruncate(self._fd, slots * slot_size)
+        # MAP_SHARED: forked children read and write the same pages
+        self._map = mmap.mmap(self._fd, slots * slot_size)
+        self._thread_lock = threading.Lock()
+        self.counts: Dict[str, int] = {"hits": 0, "misses": 0, "stores": 0, "too_large": 0}
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _offsets(self, digest: bytes) -> List[int]:
+        start = int.from_bytes(digest[:8], "little")
+        return [((start + i) % self.slots) * self.slot_size for i in range(PROBES)]
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        """The value stored under `key`, or None if it is absent or expired."""
+        digest = hashlib.sha256(key).digest()
+        now = time.time()
+        with self._locked():
+            for offset in self._offsets(digest):
+                stored, expires, length = _HEADER.unpack_from(self._map, offset)
+                if stored == digest:
+                    if expires <= now:
+                        break
+                    self.counts["hits"] += 1
+                    start = offset + _HEADER.size
+                    return self._map[start : start + length]
+        self.counts["misses"] += 1
+        return None
+
+    def put(self, key: bytes, value: bytes, expires: float) -> bool:
+        """Store `value` under `key` until `expires` (Unix time); False if it was not stored."""
+        if _HEADER.size + len(value) > self.slot_size:
+            self.counts["too_large"] += 1
+            return False
+        digest = hashlib.sha256(key).digest()
+        now = time.time()
+        with self._locked():
+            target, soonest = None, None
+            for offset in self._offsets(digest):
+                stored, stored_expires, _length = _HEADER.unpack_from(self._map, offset)
+                # An empty slot is all zeros, so it reads as long expired
+                if stored == digest or stored_expires <= now:
+                    target = offset
+                    break
+                if soonest is None or stored_expires < soonest[0]:
+                    soonest = (stored_expires, offset)
+            if target is None:
+                assert soonest is not None
+                target = soonest[1]
+            start = target + _HEADER.size
+            self._map[start : start + len(value)] = value
+            _HEADER.pack_into(self._map, target, digest, expires, len(value))
+        self.counts["stores"] += 1
+        return True
+
+    def delete(self, key: bytes) -> None:
+        """Drop `key` for every worker."""
+        digest = hashlib.sha256(key).digest()
+        with self._locked():
+            for offset in self._offsets(digest):
+                stored, _expires, length = _HEADER.unpack_from(self._map, offset)
+                if stored == digest:
+                    _HEADER.pack_into(self._map, offset, digest, 0.0, length)
+
+
+def render_caches(caches: Iterable[SharedCache]) -> str:
+    """Prometheus text for each cache's lookups and stores in this worker."""
+    lines = [
+        "# HELP mcp_shared_cache_events_total Shared-memory cache lookups and stores in this worker, by event.",
+        "# TYPE mcp_shared_cache_events_total counter",
+    ]
+    for cache in caches:
+        label = f'cache="{cache.name}"'
+        lines += [f'mcp_shared_cache_events_total{{{label},event="{k}"}} {n}' for k, n in cache.counts.items()]
+    return "\n".join(lines) + "\n"
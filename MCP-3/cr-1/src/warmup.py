@@ -0,0 +1,54 @@
+"""Startup warmup: build first-request caches before the instance takes traffic.
+
+Each service lists what its first request would otherwise build on the spot,
+such as Google's certs, a minted ID token, an upstream MCP session or a lazily
+imported library. It passes those steps to `warm_up` from its lifespan.
+uvicorn accepts connections only after the lifespan startup finishes, so on
+Cloud Run the steps run while the startup probe waits, not during a user's
+request.
+
+The steps run concurrently, and WARMUP_TIMEOUT (seconds) bounds them all. A
+step that fails or runs out of time is logged and skipped, and the request
+that needs it later builds it as before. Warmup never keeps an instance from
+starting. WARMUP=false turns it off.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+Step = Callable[[], Awaitable[Any]]
+
+
+async def warm_up(steps: Dict[str, Step]) -> Dict[str, float]:
+    """Run the named steps concurrently; returns the seconds each successful step took."""
+    if os.getenv("WARMUP", "true").lower() not in {"1", "true", "yes"}:
+        return {}
+    timeout = float(os.getenv("WARMUP_TIMEOUT", "5"))
+    took: Dict[str, float] = {}
+
+    async def run(name: str, step: Step) -> None:
+        started = time.perf_counter()
+        try:
+            await step()
+        except Exception as e:
+            logger.warning("warmup step failed", extra={"step": name, "error": str(e)})
+            return
+        took[name] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    tasks = {asyncio.ensure_future(run(name, step)): name for name, step in steps.items()}
+    if tasks:
+        _done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning("warmup timed out", extra={"steps": sorted(tasks[t] for t in pending), "timeout": timeout})
+    logger.info(
+        "warmup done",
+        extra={"seconds": round(time.perf_counter() - started, 4), "steps": {k: round(v, 4) for k, v in took.items()}},
+    )
+    return took
@@ -0,0 +1,141 @@
+"""Per-request logging cost on the request thread: print vs logs.setup().
+
+Each simulated request logs what the /mcp handler logs: the verified caller
+and the received method with its params.
+
+  print      - previous path: two f-string prints, flushed per line as with
+               PYTHONUNBUFFERED=1 (the usual container setting)
+  logs 1.0   - logs.py queue handler, every record kept
+  logs 0.05  - logs.py with LOG_SAMPLE_RATES="/mcp=0.05"
+
+stdout is a pipe drained by a reader thread that stands in for the log agent.
+With --slow-reader it drains about 2 MB/s (4 KiB every 2 ms), so the pipe
+fills up the way it does when the agent falls behind. A print then blocks the
+request, while the queue handler keeps queueing (and drops records once
+LOG_QUEUE_SIZE is reached). Times are wall time on the request thread.
+
+Usage:
+    python benchmarks/bench_logging.py [--requests 20000] [--slow-reader]
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import logs  # noqa: E402
+
+CLAIMS = {
+    "email": "mcp-client-sa@ai-10292025.iam.gserviceaccount.com",
+    "sub": "112233445566778899",
+    "iss": "https://accounts.google.com",
+    "aud": "https://mcp-hello-456052106337.us-central1.run.app",
+}
+BODY = {"jsonrpc": "2.0", "id": "4f1c", "method": "tools/call", "params": {"tool": "hello", "name": "World"}}
+
+
+def pipe_stdout(slow: bool):
+    read_fd, write_fd = os.pipe()
+    stop = threading.Event()
+
+    def drain() -> None:
+        while not stop.is_set():
+            if not os.read(read_fd, 4096 if slow else 65536):
+                return
+            if slow:
+                time.sleep(0.002)
+
+    reader = threading.Thread(target=drain, daemon=True)
+    reader.start()
+    stream = io.TextIOWrapper(os.fdopen(write_fd, "wb"), write_through=True)
+
+    def close() -> None:
+        stop.set()
+        stream.close()
+        reader.join(timeout=5)
+        os.close(read_fd)
+
+    return stream, close
+
+
+def print_request(out) -> None:
+    print(
+        f"[MCP-SERVER] Caller email={CLAIMS['email']} sub={CLAIMS['sub']} iss={CLAIMS['iss']} aud={CLAIMS['aud']}",
+        file=out,
+        flush=True,
+    )
+    print(
+        f"[MCP-SERVER] Received MCP method={BODY.get('method')} id={BODY.get('id')} params={BODY.get('params')}",
+        file=out,
+        flush=True,
+    )
+
+
+def logs_request(logger: logs.SampledLogger) -> None:
+    logger.info(
+        "caller verified",
+        extra={
+            "route": "/mcp",
+            "caller_email": CLAIMS["email"],
+            "caller_sub": CLAIMS["sub"],
+            "caller_iss": CLAIMS["iss"],
+            "caller_aud": CLAIMS["aud"],
+        },
+    )
+    logger.info(
+        "mcp request",
+        extra={"route": "/mcp", "method": BODY["method"], "id": BODY["id"], "params": BODY["params"]},
+    )
+
+
+def measure(fn, count: int):
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.fmean(samples) * 1e6, samples[int(len(samples) * 0.99)] * 1e6
+
+
+def run_print(count: int, slow: bool):
+    out, close = pipe_stdout(slow)
+    try:
+        return measure(lambda: print_request(out), count), 0
+    finally:
+        close()
+
+
+def run_logs(count: int, slow: bool, rate: float):
+    out, close = pipe_stdout(slow)
+    logs.LOG_SAMPLE_RATES = f"/mcp={rate}"
+    logger = logs.setup("bench", stream=out)
+    try:
+        return measure(lambda: logs_request(logger), count), logs.dropped()
+    finally:
+        logs.shutdown()
+        close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--slow-reader", action="store_true", help="reader drains 4 KiB every 2 ms")
+    args = parser.parse_args()
+
+    print(f"{'variant':<10} {'mean us':>8} {'p99 us':>8} {'dropped':>8}")
+    for label, run in (
+        ("print", lambda: run_print(args.requests, args.slow_reader)),
+        ("logs 1.0", lambda: run_logs(args.requests, args.slow_reader, 1.0)),
+        ("logs 0.05", lambda: run_logs(args.requests, args.slow_reader, 0.05)),
+    ):
+        (mean, p99), dropped = run()
+        print(f"{label:<10} {mean:>8.1f} {p99:>8.1f} {dropped:>8}")
+
+
+if __name__ == "__main__":
+    main()
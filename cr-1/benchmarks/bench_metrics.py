@@ -0,0 +1,61 @@
+"""Cost of recording one call in metrics.Metrics, and of rendering /metrics.
+
+  timer only    - the two perf_counter() reads any timing needs
+  begin + end   - Metrics.begin + Metrics.end (in-flight gauge, histogram, sum)
+  call_labels   - resolving the (method, tool) labels for a tools/call
+  render        - Prometheus text for --series series, per scrape
+
+Usage:
+    python benchmarks/bench_metrics.py [--number 200000] [--series 20]
+"""
+import argparse
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from metrics import Metrics, call_labels  # noqa: E402
+from registry import Registry  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=200000)
+    parser.add_argument("--series", type=int, default=20, help="method/tool series present when rendering")
+    args = parser.parse_args()
+
+    metrics = Metrics()
+    registry = Registry()
+    registry.method("tools/call")(lambda params: None)
+    registry.tool("hello", "Greets a name")(lambda arguments: None)
+    entry = registry.get("tools/call")
+    params = {"name": "hello", "arguments": {"name": "World"}}
+
+    def timer_only() -> None:
+        started = time.perf_counter()
+        time.perf_counter() - started
+
+    def begin_end() -> None:
+        series = metrics.begin("tools/call", "hello")
+        metrics.end(series, time.perf_counter())
+
+    def labels() -> None:
+        call_labels(registry, entry, params)
+
+    print(f"{'operation':<14} {'us/op':>8}")
+    for label, fn in (("timer only", timer_only), ("begin + end", begin_end), ("call_labels", labels)):
+        best = min(timeit.repeat(fn, number=args.number, repeat=5)) / args.number * 1e6
+        print(f"{label:<14} {best:>8.3f}")
+
+    for i in range(args.series):
+        series = metrics.begin("tools/call", f"tool_{i}")
+        metrics.end(series, time.perf_counter() - i * 1e-3, -32603 if i % 5 == 0 else 0)
+    number = max(1, args.number // 1000)
+    best = min(timeit.repeat(metrics.render, number=number, repeat=5)) / number * 1e6
+    print(f"{'render':<14} {best:>8.1f}  ({args.series + 1} series, {len(metrics.render())} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Microbenchmark of tool argument validation: compiled validators vs jsonschema.
+
+  compiled  - schema.compile_schema: the schema is turned into Python code once,
+              at registration, as Registry.tool does
+  jsonschema - the schema's jsonschema validator class, built once and reused;
+              `is_valid` for valid arguments, `iter_errors` (all errors, as a
+              -32602 response lists them) for invalid ones
+
+Schemas:
+  hello  - the hello tool's inputSchema, arguments {"name": "World"}
+  search - a nested schema (enums, bounds, pattern, arrays of objects, $ref)
+           with ~40 filter items
+
+Each row reports microseconds per validation for valid and invalid arguments.
+jsonschema is optional; without it only the compiled timings are printed.
+
+Usage:
+    python benchmarks/bench_schema.py [--number 20000]
+"""
+import argparse
+import copy
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from schema import compile_schema  # noqa: E402
+
+
+def cases():
+    hello = {
+        "type": "object",
+        "properties": {"name": {"type": "string", "description": "Name to greet"}},
+        "additionalProperties": False,
+    }
+
+    search = {
+        "type": "object",
+        "properties": {
+            "query": {"type": "string", "minLength": 1, "maxLength": 512},
+            "limit": {"type": "integer", "minimum": 1, "maximum": 100},
+            "sort": {"enum": ["relevance", "date", "name"]},
+            "cursor": {"type": ["string", "null"], "pattern": "^[A-Za-z0-9_-]*$"},
+            "filters": {"type": "array", "maxItems": 64, "items": {"$ref": "#/$defs/filter"}},
+        },
+        "required": ["query"],
+        "additionalProperties": False,
+        "$defs": {
+            "filter": {
+                "type": "object",
+                "properties": {
+                    "field": {"type": "string"},
+                    "op": {"enum": ["eq", "ne", "lt", "gt", "in"]},
+                    "value": {"anyOf": [{"type": "string"}, {"type": "number"}, {"type": "array", "items": {"type": "string"}}]},
+                },
+                "required": ["field", "op", "value"],
+                "additionalProperties": False,
+            }
+        },
+    }
+    search_args = {
+        "query": "quarterly revenue by region",
+        "limit": 25,
+        "sort": "date",
+        "cursor": "abc_123",
+        "filters": [
+            {"field": f"f{i}", "op": ["eq", "lt", "in"][i % 3], "value": [i, f"v{i}", ["a", "b"]][i % 3]}
+            for i in range(40)
+        ],
+    }
+    search_bad = copy.deepcopy(search_args)
+    search_bad["limit"] = 0
+    search_bad["filters"][7]["op"] = "like"
+    search_bad["filters"][30]["value"] = None
+
+    return {
+        "hello": (hello, {"name": "World"}, {"name": 42}),
+        "search": (search, search_args, search_bad),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000, help="validations per measurement (hello schema)")
+    args = parser.parse_args()
+
+    try:
+        import jsonschema
+    except ImportError:
+        jsonschema = None
+        print("(jsonschema not installed, skipped)")
+
+    def best(fn, number: int) -> float:
+        return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+    print(f"{'schema':<7} {'validator':<10} {'valid us':>9} {'invalid us':>10} {'errors':>6} {'speedup':>8}")
+    for label, (schema, good, bad) in cases().items():
+        number = args.number if label == "hello" else max(1, args.number // 20)
+        validator = compile_schema(schema, label)
+        assert not validator(good)
+        errors = validator(bad)
+        compiled = (best(lambda: validator(good), number), best(lambda: validator(bad), number))
+
+        if jsonschema is not None:
+            reference = jsonschema.validators.validator_for(schema)(schema)
+            assert reference.is_valid(good) and len(list(reference.iter_errors(bad))) == len(errors)
+            interpreted = (
+                best(lambda: reference.is_valid(good), number),
+                best(lambda: list(reference.iter_errors(bad)), number),
+            )
+            print(f"{label:<7} {'jsonschema':<10} {interpreted[0]:>9.2f} {interpreted[1]:>10.2f} {len(errors):>6} {'1.0x':>8}")
+        print(f"{label:<7} {'compiled':<10} {compiled[0]:>9.2f} {compiled[1]:>10.2f} {len(errors):>6}", end="")
+        print(f" {interpreted[0] / compiled[0]:>7.1f}x" if jsonschema is not None else "")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Microbenchmark of the /mcp JSON decode + encode cycle per serializer backend.
+
+One cycle = decode the request body bytes, then encode the JSON-RPC response
+to bytes, which is what `mcp_endpoint` does around dispatch.
+
+  legacy  - previous path: json.loads(body.decode()) ... json.dumps(resp).encode()
+  json    - serializer stdlib backend (bytes in, bytes out)
+  orjson / msgspec - when installed
+
+Payloads:
+  small - tools/call hello and its greeting result
+  large - tools/call with ~64 KiB of arguments, answered with a 500-tool tools/list
+
+Usage:
+    python benchmarks/bench_serializer.py [--number 2000]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import serializer  # noqa: E402
+
+
+def payloads():
+    small_request = {"jsonrpc": "2.0", "id": "4f1c", "method": "tools/call", "params": {"tool": "hello", "name": "World"}}
+    small_response = {"jsonrpc": "2.0", "id": "4f1c", "result": {"message": "Hello, World!", "type": "greeting"}}
+
+    large_request = {
+        "jsonrpc": "2.0",
+        "id": 7,
+        "method": "tools/call",
+        "params": {
+            "name": "summarize",
+            "arguments": {"documents": [{"id": i, "text": "lorem ipsum dolor sit amet " * 8} for i in range(300)]},
+        },
+    }
+    large_response = {
+        "jsonrpc": "2.0",
+        "id": 7,
+        "result": {
+            "tools": [
+                {
+                    "name": f"tool_{i}",
+                    "description": f"Tool number {i} with a reasonably long human readable description",
+                    "inputSchema": {
+                        "type": "object",
+                        "properties": {
+                            "name": {"type": "string", "description": "Name"},
+                            "count": {"type": "integer", "minimum": 0},
+                            "tags": {"type": "array", "items": {"type": "string"}},
+                        },
+                        "required": ["name"],
+                    },
+                }
+                for i in range(500)
+            ]
+        },
+    }
+    return {
+        "small": (json.dumps(small_request).encode(), small_response),
+        "large": (json.dumps(large_request).encode(), large_response),
+    }
+
+
+def legacy_cycle(body: bytes, response) -> bytes:
+    json.loads(body.decode("utf-8"))
+    return json.dumps(response).encode("utf-8")
+
+
+def backend_cycle(impl):
+    def cycle(body: bytes, response) -> bytes:
+        impl.loads(body)
+        return impl.dumps(response)
+
+    return cycle
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=2000, help="cycles per measurement (small payload)")
+    args = parser.parse_args()
+
+    cycles = {"legacy": legacy_cycle}
+    for name in ("json", "orjson", "msgspec"):
+        try:
+            cycles[name] = backend_cycle(serializer.backend(name))
+        except ImportError:
+            print(f"({name} not installed, skipped)")
+
+    print(f"default backend: {serializer.BACKEND}")
+    print(f"{'payload':<7} {'bytes in':>9} {'backend':<8} {'us/cycle':>10} {'vs legacy':>9}")
+    for label, (body, response) in payloads().items():
+        number = args.number if label == "small" else max(1, args.number // 100)
+        baseline = None
+        for name, cycle in cycles.items():
+            best = min(timeit.repeat(lambda: cycle(body, response), number=number, repeat=5)) / number * 1e6
+            baseline = baseline or best
+            print(f"{label:<7} {len(body):>9} {name:<8} {best:>10.2f} {baseline / best:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
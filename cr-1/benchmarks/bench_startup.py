@@ -0,0 +1,186 @@
+"""Benchmark cold start for every service: import time and time to first response.
+
+For each service (a `src/` directory with server.py or client.py, plus cr-4's
+main.py) this reports:
+
+  import ms   - cumulative import time of the app module, from
+                `python -X importtime -c "import <module>"` (median of --runs)
+  top imports - the app module's direct imports that took longest
+  first resp  - from starting `uvicorn <module>:app` to the first HTTP
+                response on --path (median of --runs; any status counts)
+
+cr-4 is a Cloud Function, so only its import time is measured.
+
+Warmup (warmup.py) is off by default (WARMUP=false): without Google
+credentials and network access its steps only fail or time out. Pass
+--env WARMUP=true to include it. --env sets any other variable the same way.
+
+Pass --baseline-rev to also measure each service as it was at a git
+revision, for example the commit before imports were made lazy:
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --services cr-1 MCP-2/cr-1 --baseline-rev HEAD~1
+"""
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOP = os.path.abspath(os.path.join(HERE, "..", ".."))
+
+# "import time: <self us> | <cumulative us> | <indent><module>"
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+
+def discover() -> List[Tuple[str, str, str]]:
+    """(service, source directory, app module) for every service in the repo."""
+    services = []
+    for parent in ["", "MCP-1", "MCP-2", "MCP-3"]:
+        for name in ["cr-1", "cr-2", "cr-3"]:
+            src = os.path.join(TOP, parent, name, "src")
+            for module in ["server", "client"]:
+                if os.path.exists(os.path.join(src, f"{module}.py")):
+                    services.append((os.path.join(parent, name) if parent else name, src, module))
+    if os.path.exists(os.path.join(TOP, "cr-4", "main.py")):
+        services.append(("cr-4", os.path.join(TOP, "cr-4"), "main"))
+    return services
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def import_times(src: str, module: str, env: Dict[str, str]) -> Tuple[float, List[Tuple[str, float]]]:
+    """Cumulative import ms of `module`, and its direct imports by cumulative ms."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=src,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    total = 0.0
+    children: List[Tuple[str, float]] = []
+    nested: List[Tuple[str, float]] = []
+    # A module's line follows those of the modules it imported, one level deeper
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match is None:
+            continue
+        _self_us, cumulative_us, indent, name = match.groups()
+        if not indent:
+            if name == module:
+                total, children = int(cumulative_us) / 1000, nested
+            nested = []
+        elif len(indent) == 2:
+            nested.append((name, int(cumulative_us) / 1000))
+    if not total:
+        raise RuntimeError(f"importing {module} from {src} failed:\n{result.stderr[-2000:]}")
+    return total, sorted(children, key=lambda c: -c[1])
+
+
+def first_response(src: str, module: str, path: str, env: Dict[str, str], timeout: float = 30.0) -> float:
+    """Seconds from starting uvicorn to the first HTTP response on `path`."""
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{module}:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=src,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(timeout=1.0) as client:
+            while time.perf_counter() - started < timeout:
+                try:
+                    client.get(f"http://127.0.0.1:{port}{path}")
+                    return time.perf_counter() - started
+                except httpx.TransportError:
+                    if process.poll() is not None:
+                        raise RuntimeError(f"{module} in {src} exited with {process.returncode}")
+                    time.sleep(0.005)
+        raise RuntimeError(f"{module} in {src} did not answer within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def checkout(rev: str, src: str) -> Optional[str]:
+    """Write `src` as of `rev` into a temp dir and return its path (None if it did not exist then)."""
+    rel = os.path.relpath(src, TOP).replace(os.sep, "/")
+    try:
+        names = subprocess.check_output(["git", "ls-tree", "--name-only", rev, f"{rel}/"], cwd=TOP, text=True)
+    except subprocess.CalledProcessError:
+        return None
+    if not names.split():
+        return None
+    out = tempfile.mkdtemp(prefix="startup-baseline-")
+    for path in names.split():
+        if not path.endswith(".py"):
+            continue
+        data = subprocess.check_output(["git", "show", f"{rev}:{path}"], cwd=TOP)
+        with open(os.path.join(out, os.path.basename(path)), "wb") as f:
+            f.write(data)
+    return out
+
+
+def measure(src: str, module: str, args: argparse.Namespace, env: Dict[str, str]) -> Dict[str, object]:
+    totals, top = [], []
+    for _ in range(args.runs):
+        total, top = import_times(src, module, env)
+        totals.append(total)
+    firsts = []
+    if module != "main":
+        firsts = [first_response(src, module, args.path, env) * 1000 for _ in range(args.runs)]
+    return {
+        "import": statistics.median(totals),
+        "top": ", ".join(f"{name} {ms:.0f}" for name, ms in top[: args.top]),
+        "first": statistics.median(firsts) if firsts else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", nargs="+", help="services to measure, e.g. cr-1 MCP-2/cr-1 (default: all)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/metrics", help="path requested to detect the first response")
+    parser.add_argument("--top", type=int, default=3, help="direct imports listed per service")
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE")
+    parser.add_argument("--baseline-rev", help="git revision to compare against")
+    args = parser.parse_args()
+
+    env = {**os.environ, "WARMUP": "false"}
+    env.update(item.split("=", 1) for item in args.env)
+
+    services = discover()
+    if args.services:
+        services = [s for s in services if s[0] in args.services]
+
+    print(f"{'service':<12} {'version':<16} {'import ms':>9} {'first resp ms':>13}  top imports (ms)")
+    for service, src, module in services:
+        runs = {}
+        if args.baseline_rev:
+            baseline = checkout(args.baseline_rev, src)
+            if baseline is not None:
+                runs[args.baseline_rev] = measure(baseline, module, args, env)
+        runs["current"] = measure(src, module, args, env)
+        for label, r in runs.items():
+            first = f"{r['first']:>13.0f}" if r["first"] is not None else f"{'-':>13}"
+            print(f"{service:<12} {label:<16} {r['import']:>9.0f} {first}  {r['top']}")
+
+
+if __name__ == "__main__":
+    main()
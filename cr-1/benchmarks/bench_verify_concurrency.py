@@ -0,0 +1,113 @@
+"""Benchmark token verification throughput against in-flight requests.
+
+Drives the real `verify_token` dependency of `server.py` through an in-process
+ASGI transport. Each request carries a fresh token (so the claims cache
+misses) and the cert bundle is served with max-age=0 by a stand-in fetcher
+that waits --fetch-ms, so every request would need a cert fetch.
+
+  blocking - the previous path: sync `verify` called from the async dependency
+  async    - `averify`: async fetch with single-flight + executor RSA check
+
+With the blocking path, throughput stays flat as concurrency grows because
+each fetch stalls the event loop; the async path scales with in-flight calls.
+
+Usage:
+    python benchmarks/bench_verify_concurrency.py [--requests 256] [--fetch-ms 20]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+
+import httpx
+import rsa
+from google.auth import crypt, jwt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import server  # noqa: E402
+from auth import CertCache, ClaimsCache  # noqa: E402
+
+KID = "bench-key"
+
+
+def make_tokens(count: int):
+    public_key, private_key = rsa.newkeys(2048)
+    signer = crypt.RSASigner.from_string(private_key.save_pkcs1(), key_id=KID)
+    certs = {KID: public_key.save_pkcs1().decode("utf-8")}
+    now = int(time.time())
+    tokens = [
+        jwt.encode(
+            signer,
+            {
+                "iss": "https://accounts.google.com",
+                "aud": server.AUTH_AUDIENCE,
+                "sub": f"caller-{i}",
+                "iat": now,
+                "exp": now + 3600,
+            },
+        ).decode("utf-8")
+        for i in range(count)
+    ]
+    return certs, tokens
+
+
+async def run(mode: str, tokens, concurrency: int, fetch_ms: float, certs) -> float:
+    verifier = server.token_verifier
+    verifier.claims = ClaimsCache()
+
+    def fetch():
+        time.sleep(fetch_ms / 1000)
+        return certs, 0
+
+    async def afetch():
+        await asyncio.sleep(fetch_ms / 1000)
+        return certs, 0
+
+    verifier.certs = CertCache(fetch=fetch, afetch=afetch)
+    if mode == "blocking":
+
+        async def blocking_verify(token):
+            return verifier.verify(token)
+
+        verifier.averify = blocking_verify  # type: ignore[method-assign]
+
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=server.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+            async def one(token: str) -> None:
+                async with semaphore:
+                    response = await client.get("/hello", headers={"Authorization": f"Bearer {token}"})
+                    response.raise_for_status()
+
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                await asyncio.gather(*(one(t) for t in tokens))
+            elapsed = time.perf_counter() - start
+    finally:
+        verifier.__dict__.pop("averify", None)
+    return len(tokens) / elapsed
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--fetch-ms", type=float, default=20.0)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    certs, tokens = make_tokens(args.requests)
+    print(f"{'in-flight':>9}  {'blocking rps':>12}  {'async rps':>10}")
+    for concurrency in args.concurrency:
+        blocking = await run("blocking", tokens, concurrency, args.fetch_ms, certs)
+        non_blocking = await run("async", tokens, concurrency, args.fetch_ms, certs)
+        print(f"{concurrency:>9}  {blocking:>12.1f}  {non_blocking:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""Benchmark ID token verification with cold and warm caches.
+
+Signs tokens with a throwaway RSA key and serves the matching "cert" from an
+in-process fetcher that sleeps for --fetch-ms to stand in for the HTTPS round
+trip to googleapis.com. Reports p50/p99 for:
+
+  cold       - new verifier per call: cert fetch + RSA verify
+  certs-warm - certs cached, new token each call: RSA verify only
+  warm       - same token repeated: claims cache hit
+
+Usage:
+    python benchmarks/bench_verify_token.py [--iterations 200] [--fetch-ms 40]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import rsa
+from google.auth import crypt, jwt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from auth import CertCache, ClaimsCache, TokenVerifier  # noqa: E402
+
+AUDIENCE = "https://mcp-hello.example.run.app"
+KID = "bench-key"
+
+
+def make_signer():
+    public_key, private_key = rsa.newkeys(2048)
+    signer = crypt.RSASigner.from_string(private_key.save_pkcs1(), key_id=KID)
+    certs = {KID: public_key.save_pkcs1().decode("utf-8")}
+    return signer, certs
+
+
+def make_token(signer, subject: str) -> str:
+    now = int(time.time())
+    payload = {
+        "iss": "https://accounts.google.com",
+        "aud": AUDIENCE,
+        "sub": subject,
+        "email": f"{subject}@example.iam.gserviceaccount.com",
+        "iat": now,
+        "exp": now + 3600,
+    }
+    return jwt.encode(signer, payload).decode("utf-8")
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    p99_index = min(len(ordered) - 1, int(len(ordered) * 0.99))
+    return statistics.median(ordered), ordered[p99_index]
+
+
+def run(label, fn, iterations):
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - start) * 1e6)
+    p50, p99 = percentiles(samples)
+    print(f"{label:<11} p50={p50:>10.1f}us  p99={p99:>10.1f}us  (n={iterations})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--fetch-ms", type=float, default=40.0, help="simulated cert fetch latency")
+    args = parser.parse_args()
+
+    signer, certs = make_signer()
+
+    def fetch():
+        time.sleep(args.fetch_ms / 1000)
+        return certs, 3600
+
+    tokens = [make_token(signer, f"caller-{i}") for i in range(args.iterations)]
+
+    def cold(i):
+        TokenVerifier(AUDIENCE, certs=CertCache(fetch), claims=ClaimsCache()).verify(tokens[i])
+
+    shared_certs = CertCache(fetch)
+    shared_certs.get()
+
+    def certs_warm(i):
+        TokenVerifier(AUDIENCE, certs=shared_certs, claims=ClaimsCache()).verify(tokens[i])
+
+    warm_verifier = TokenVerifier(AUDIENCE, certs=shared_certs)
+    warm_verifier.verify(tokens[0])
+
+    def warm(i):
+        warm_verifier.verify(tokens[0])
+
+    run("cold", cold, args.iterations)
+    run("certs-warm", certs_warm, args.iterations)
+    run("warm", warm, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""Google ID token verification with cached certs and verified claims.
+
+`google.oauth2.id_token.verify_oauth2_token` downloads Google's cert bundle on
+every call. `TokenVerifier` keeps the bundle until its Cache-Control max-age
+expires and remembers verified claims (keyed by token hash) until the token's
+`exp`, so a repeated bearer token is checked without any network or RSA work.
+
+Both caches can be backed by a `SharedCache` (shared_cache.py), so the
+gunicorn workers of one instance share the certs and the verified tokens. A
+local miss then checks the shared table before fetching or verifying.
+
+`TokenVerifier.averify` is the event-loop friendly path: certs are fetched with
+httpx, concurrent fetches for the same key ID share one request, and the RSA
+signature check runs in a small bounded thread pool.
+
+httpx, google.auth.jwt (with its RSA backend) and the requests transport are
+imported on first use, not at import time, so they stay off a cold start's
+import path. `TokenVerifier.warm()` loads them and fetches the certs ahead of
+the first request.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from google.auth import exceptions
+
+from shared_cache import SharedCache
+
+if TYPE_CHECKING:
+    import httpx
+
+GOOGLE_OAUTH2_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+# Key of the cert bundle in a shared cache
+CERTS_KEY = b"google-certs"
+
+# Used when the cert response carries no usable Cache-Control header
+DEFAULT_CERTS_MAX_AGE = 300
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+# Threads available for CPU-bound signature checks
+VERIFY_WORKERS = int(os.getenv("TOKEN_VERIFY_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# fetch() -> (certs, max_age_seconds or None)
+CertFetcher = Callable[[], Tuple[Dict[str, str], Optional[int]]]
+AsyncCertFetcher = Callable[[], Awaitable[Tuple[Dict[str, str], Optional[int]]]]
+
+
+def parse_max_age(cache_control: Optional[str]) -> Optional[int]:
+    """Return the max-age (seconds) from a Cache-Control header, if any."""
+    if not cache_control:
+        return None
+    match = _MAX_AGE_RE.search(cache_control)
+    return int(match.group(1)) if match else None
+
+
+def token_key(token: str) -> bytes:
+    """Cache key for a bearer token; the raw token is never stored."""
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+def google_cert_fetcher(certs_url: str = GOOGLE_OAUTH2_CERTS_URL) -> CertFetcher:
+    """Build a fetcher that reuses one google-auth transport (and its session)."""
+    from google.auth.transport import requests
+
+    transport = requests.Request()
+
+    def fetch() -> Tuple[Dict[str, str], Optional[int]]:
+        response = transport(certs_url, method="GET")
+        if response.status != 200:
+            raise exceptions.TransportError(f"Could not fetch certificates at {certs_url}")
+        certs = json.loads(response.data.decode("utf-8"))
+        return certs, parse_max_age(response.headers.get("Cache-Control"))
+
+    return fetch
+
+
+class HttpxCertFetcher:
+    """Async cert fetcher backed by a lazily created, reused httpx.AsyncClient."""
+
+    def __init__(self, certs_url: str = GOOGLE_OAUTH2_CERTS_URL, timeout: float = 10.0):
+        self.certs_url = certs_url
+        self.timeout = timeout
+        self._client: Optional["httpx.AsyncClient"] = None
+
+    async def __call__(self) -> Tuple[Dict[str, str], Optional[int]]:
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        response = await self._client.get(self.certs_url)
+        if response.status_code != 200:
+            raise exceptions.TransportError(f"Could not fetch certificates at {self.certs_url}")
+        return response.json(), parse_max_age(response.headers.get("Cache-Control"))
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one in-flight awaitable."""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, "asyncio.Future[Any]"] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._finish(key, f))
+        # A cancelled waiter must not cancel the call other waiters depend on
+        return await asyncio.shield(future)
+
+    def _finish(self, key: Hashable, future: "asyncio.Future[Any]") -> None:
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.cancelled():
+            future.exception()  # mark retrieved even if every waiter went away
+
+
+class CertCache:
+    """Google public certs, refetched only once their max-age has passed."""
+
+    def __init__(
+        self,
+        fetch: Optional[CertFetcher] = None,
+        afetch: Optional[AsyncCertFetcher] = None,
+        shared: Optional[SharedCache] = None,
+    ):
+        self._fetch = fetch
+        self._afetch = afetch
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._inflight = SingleFlight()
+        self._certs: Dict[str, str] = {}
+        self._expires_at = 0.0
+
+    def _fresh(self, kid: Optional[str]) -> bool:
+        return time.monotonic() < self._expires_at and (kid is None or kid in self._certs)
+
+    def get(self, kid: Optional[str] = None) -> Dict[str, str]:
+        """Return the cached certs, refreshing when stale or when `kid` is unknown."""
+        if self._fresh(kid) or self._from_shared(kid):
+            return self._certs
+        if self._fetch is None:
+            self._fetch = google_cert_fetcher()
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            if self._fresh(kid):
+                return self._certs
+            certs, max_age = self._fetch()
+            self._store(certs, max_age)
+            return certs
+
+    async def aget(self, kid: Optional[str] = None) -> Dict[str, str]:
+        """Async `get`; concurrent refreshes for the same kid share one fetch."""
+        if self._fresh(kid) or self._from_shared(kid):
+            return self._certs
+        if self._afetch is None:
+            self._afetch = HttpxCertFetcher()
+        return await self._inflight.do(kid, self._refresh)
+
+    async def _refresh(self) -> Dict[str, str]:
+        certs, max_age = await self._afetch()
+        self._store(certs, max_age)
+        return certs
+
+    async def aclose(self) -> None:
+        close = getattr(self._afetch, "aclose", None)
+        if close is not None:
+            await close()
+
+    def _from_shared(self, kid: Optional[str]) -> bool:
+        """Adopt certs another worker fetched; True if they are fresh and have `kid`."""
+        if self.shared is None:
+            return False
+        raw = self.shared.get(CERTS_KEY)
+        if raw is None:
+            return False
+        entry = json.loads(raw)
+        if kid is not None and kid not in entry["certs"]:
+            return False
+        self._certs = entry["certs"]
+        self._expires_at = time.monotonic() + entry["expires"] - time.time()
+        return True
+
+    def _store(self, certs: Dict[str, str], max_age: Optional[int]) -> None:
+        self._certs = certs
+        ttl = DEFAULT_CERTS_MAX_AGE if max_age is None else max_age
+        self._expires_at = time.monotonic() + ttl
+        if self.shared is not None:
+            expires = time.time() + ttl
+            self.shared.put(CERTS_KEY, json.dumps({"certs": certs, "expires": expires}).encode(), expires)
+
+    def invalidate(self) -> None:
+        self._expires_at = 0.0
+        if self.shared is not None:
+            self.shared.delete(CERTS_KEY)
+
+
+class ClaimsCache:
+    """Bounded LRU of verified claims, keyed by token hash and kept until `exp`."""
+
+    def __init__(self, maxsize: int = 1024, shared: Optional[SharedCache] = None):
+        self.maxsize = maxsize
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    def get(self, key: bytes) -> Optional[Dict[str, Any]]:
+        claims = self._get_local(key)
+        if claims is None and self.shared is not None:
+            raw = self.shared.get(key)
+            if raw is not None:
+                claims = json.loads(raw)
+                self._put_local(key, claims["exp"], claims)
+        return claims
+
+    def _get_local(self, key: bytes) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            exp, claims = entry
+            if time.time() >= exp:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return claims
+
+    def put(self, key: bytes, claims: Dict[str, Any]) -> None:
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)):
+            return
+        self._put_local(key, exp, claims)
+        if self.shared is not None:
+            self.shared.put(key, json.dumps(claims).encode(), float(exp))
+
+    def _put_local(self, key: bytes, exp: float, claims: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (float(exp), claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class TokenVerifier:
+    """Verifies Google-issued ID tokens for a single audience."""
+
+    def __init__(
+        self,
+        audience: str,
+        certs: Optional[CertCache] = None,
+        claims: Optional[ClaimsCache] = None,
+        clock_skew_in_seconds: int = 0,
+        max_workers: int = VERIFY_WORKERS,
+    ):
+        self.audience = audience
+        self.certs = certs if certs is not None else CertCache()
+        # Not `claims or ...`: an empty ClaimsCache is falsy
+        self.claims = claims if claims is not None else ClaimsCache()
+        self.clock_skew_in_seconds = clock_skew_in_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="token-verify")
+        self._verifying = SingleFlight()
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        """Return the token's claims; raises ValueError/GoogleAuthError if invalid."""
+        key = token_key(token)
+        cached = self.claims.get(key)
+        if cached is not None:
+            return cached
+
+        from google.auth import jwt
+
+        header = jwt.decode_header(token)
+        certs = self.certs.get(header.get("kid"))
+        decoded = self._decode(token, certs)
+        self.claims.put(key, decoded)
+        return decoded
+
+    async def averify(self, token: str) -> Dict[str, Any]:
+        """Async `verify` that never blocks the event loop."""
+        key = token_key(token)
+        cached = self.claims.get(key)
+        if cached is not None:
+            return cached
+        # The same token arriving concurrently is only checked once
+        return await self._verifying.do(key, lambda: self._averify(key, token))
+
+    async def _averify(self, key: bytes, token: str) -> Dict[str, Any]:
+        from google.auth import jwt
+
+        header = jwt.decode_header(token)
+        certs = await self.certs.aget(header.get("kid"))
+        loop = asyncio.get_running_loop()
+        decoded = await loop.run_in_executor(self._executor, self._decode, token, certs)
+        self.claims.put(key, decoded)
+        return decoded
+
+    def _decode(self, token: str, certs: Dict[str, str]) -> Dict[str, Any]:
+        from google.auth import jwt
+
+        decoded = jwt.decode(
+            token,
+            certs=certs,
+            audience=self.audience,
+            clock_skew_in_seconds=self.clock_skew_in_seconds,
+        )
+        if decoded.get("iss") not in GOOGLE_ISSUERS:
+            raise exceptions.GoogleAuthError(
+                f"Wrong issuer. 'iss' should be one of the following: {GOOGLE_ISSUERS}"
+            )
+        return decoded
+
+    async def warm(self) -> None:
+        """Load the JWT/RSA code and fetch the certs now, so the first request doesn't."""
+        from google.auth import jwt  # noqa: F401
+
+        await self.certs.aget()
+
+    async def aclose(self) -> None:
+        await self.certs.aclose()
+        self._executor.shutdown(wait=False)
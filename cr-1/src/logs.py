@@ -0,0 +1,264 @@
+"""Structured, sampled, non-blocking logging for the MCP services.
+
+`setup(service)` routes the root logger through a bounded in-memory queue:
+
+- request handlers only build a `LogRecord` and `put_nowait` it. When the
+  queue is full the record is dropped and counted, so a slow stdout never
+  stalls a request.
+- a `QueueListener` thread formats records as one JSON object per line, which
+  Cloud Logging parses into `jsonPayload` with `severity` and `message`.
+- redaction happens in the listener thread. Fields named in LOG_REDACT_FIELDS
+  (bearer tokens, JSON-RPC params/arguments, ...) are replaced, and anything
+  that looks like a JWT in a message is masked.
+
+Sampling is per route and is decided by the logger that `setup` returns,
+before any record is built. Calls below WARNING that pass
+`extra={"route": ...}` are kept with the probability set in LOG_SAMPLE_RATES
+(for example "/mcp=0.05,/hello=1"), or LOG_SAMPLE_RATE when the route is not
+listed. Warnings and errors are always kept.
+
+A forked process (a gunicorn worker of a preloaded app) does not inherit the
+writer thread, so it starts its own queue and writer right after the fork.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+from typing import Any, Dict, Optional
+
+# Root log level
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Records buffered between request handlers and the writer thread before dropping
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Default fraction of sub-WARNING records kept for routes not in LOG_SAMPLE_RATES
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+# Per-route sampling rates, "route=rate,route=rate"
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+# Extra fields whose values are never written
+LOG_REDACT_FIELDS = os.getenv(
+    "LOG_REDACT_FIELDS", "authorization,token,id_token,access_token,params,arguments"
+)
+
+REDACTED = "[REDACTED]"
+
+try:
+    import orjson
+
+    def _dumps(entry: Dict[str, Any]) -> str:
+        return orjson.dumps(entry, default=str).decode()
+
+except ImportError:
+
+    def _dumps(entry: Dict[str, Any]) -> str:
+        return json.dumps(entry, default=str)
+
+
+# Compact JWS: base64url header (always starts with eyJ), payload and signature
+_JWT_RE = re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]*")
+
+# Attributes every LogRecord has; anything else came from `extra=`
+_RECORD_ATTRS = frozenset(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+_SEVERITY = {
+    logging.DEBUG: "DEBUG",
+    logging.INFO: "INFO",
+    logging.WARNING: "WARNING",
+    logging.ERROR: "ERROR",
+    logging.CRITICAL: "CRITICAL",
+}
+
+
+def parse_rates(spec: str) -> Dict[str, float]:
+    rates: Dict[str, float] = {}
+    for item in spec.split(","):
+        route, sep, rate = item.strip().rpartition("=")
+        if sep and route:
+            rates[route.strip()] = float(rate)
+    return rates
+
+
+def redact(text: str) -> str:
+    return _JWT_RE.sub(REDACTED, text)
+
+
+class RouteSampler:
+    """Keeps a per-route fraction of log calls."""
+
+    def __init__(self, rates: Dict[str, float], default: float = 1.0):
+        self.rates = rates
+        self.default = default
+
+    def keep(self, route: Optional[str]) -> bool:
+        rate = self.rates.get(route, self.default) if route is not None else 1.0
+        return rate >= 1.0 or random.random() < rate
+
+
+class SampledLogger(logging.LoggerAdapter):
+    """Logger adapter that applies route sampling before a record is built."""
+
+    def __init__(self, logger: logging.Logger, sampler: RouteSampler):
+        super().__init__(logger, {})
+        self.sampler = sampler
+
+    def log(self, level: int, msg: Any, *args: Any, **kwargs: Any) -> None:
+        if level < logging.WARNING:
+            extra = kwargs.get("extra")
+            if extra is not None and not self.sampler.keep(extra.get("route")):
+                return
+        if self.logger.isEnabledFor(level):
+            self.logger._log(level, msg, args, **kwargs)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when full."""
+
+    def __init__(self, log_queue: "queue.Queue[Any]"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge args into the message here; formatting and redaction are
+        # left to the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class CloudLoggingFormatter(logging.Formatter):
+    """One JSON object per record, in the shape Cloud Logging reads from stdout."""
+
+    def __init__(self, service: str, redact_fields: frozenset):
+        super().__init__()
+        self.service = service
+        self.redact_fields = redact_fields
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "severity": _SEVERITY.get(record.levelno, record.levelname),
+            "message": redact(record.getMessage()),
+            "timestamp": {"seconds": int(record.created), "nanos": int(record.created % 1 * 1e9)},
+            "service": self.service,
+            "logger": record.name,
+        }
+        fields = record.__dict__
+        for key in fields.keys() - _RECORD_ATTRS:
+            value = fields[key]
+            if key.lower() in self.redact_fields:
+                entry[key] = REDACTED
+            elif isinstance(value, str):
+                entry[key] = redact(value)
+            else:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = redact(self.formatException(record.exc_info))
+        return _dumps(entry)
+
+
+class _DropReporter(logging.Handler):
+    """Writes a WARNING line when records were dropped since the last write."""
+
+    def __init__(self, target: logging.Handler, source: DroppingQueueHandler):
+        super().__init__()
+        self.target = target
+        self.source = source
+        self.reported = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        dropped = self.source.dropped
+        if dropped != self.reported:
+            self.target.handle(
+                logging.makeLogRecord(
+                    {
+                        "name": __name__,
+                        "levelno": logging.WARNING,
+                        "levelname": "WARNING",
+                        "msg": "log queue full, records dropped",
+                        "dropped": dropped - self.reported,
+                    }
+                )
+            )
+            self.reported = dropped
+        self.target.handle(record)
+
+
+_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[DroppingQueueHandler] = None
+
+
+def setup(service: str, stream: Any = None) -> SampledLogger:
+    """Install the queue-backed JSON handler on the root logger (once) and return `service`'s logger."""
+    global _listener, _handler
+    with _lock:
+        if _listener is None:
+            writer = logging.StreamHandler(stream or sys.stdout)
+            writer.setFormatter(
+                CloudLoggingFormatter(
+                    service, frozenset(f.strip().lower() for f in LOG_REDACT_FIELDS.split(",") if f.strip())
+                )
+            )
+            log_queue: "queue.Queue[Any]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+            _handler = DroppingQueueHandler(log_queue)
+            _listener = logging.handlers.QueueListener(log_queue, _DropReporter(writer, _handler))
+            _listener.start()
+            atexit.register(shutdown)
+
+            root = logging.getLogger()
+            root.handlers = [_handler]
+            root.setLevel(LOG_LEVEL)
+            # httpx logs every request at INFO; the proxies log their own upstream calls
+            logging.getLogger("httpx").setLevel(logging.WARNING)
+
+            # Skip the per-record caller lookup and process/thread fields,
+            # none of which are written (see "Optimization" in the logging docs)
+            logging._srcfile = None
+            logging.logThreads = False
+            logging.logProcesses = False
+            logging.logMultiprocessing = False
+    return SampledLogger(logging.getLogger(service), RouteSampler(parse_rates(LOG_SAMPLE_RATES), LOG_SAMPLE_RATE))
+
+
+def shutdown() -> None:
+    """Flush queued records and stop the writer thread."""
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+            if _handler is not None:
+                logging.getLogger().removeHandler(_handler)
+                _handler = None
+
+
+def dropped() -> int:
+    """Number of records dropped because the queue was full."""
+    return _handler.dropped if _handler is not None else 0
+
+
+def _restart_after_fork() -> None:
+    """Give a forked child its own queue and writer thread."""
+    global _listener, _lock
+    _lock = threading.Lock()
+    if _listener is not None and _handler is not None:
+        _handler.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _listener = logging.handlers.QueueListener(_handler.queue, *_listener.handlers)
+        _listener.start()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
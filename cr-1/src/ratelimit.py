@@ -0,0 +1,311 @@
+"""Per-caller token-bucket rate limits for /mcp, keyed on the verified ID token.
+
+The principal is the token's `email` claim (the calling service account), or
+`sub` when there is no email. Each principal has a bucket holding up to
+`burst` tokens, refilled at `rate` tokens per second. Every JSON-RPC message
+in a request costs one token. A batch is checked as a whole: either all of
+its messages are admitted or none are.
+
+Optionally, a tool can have its own limit. A `tools/call` of that tool then
+also draws from a per-principal bucket for the tool.
+
+Limits are written "<count>/<s|m|h>[:burst]". "20/s" allows 20 per second
+with bursts of 20; "600/m:50" allows 600 per minute with bursts of 50. A
+request that needs more tokens than a bucket can hold (a batch larger than
+the burst) could never be admitted, so it is refused outright, without a
+Retry-After.
+
+- RATE_LIMIT is the default per-principal limit. Leave it unset for no default.
+- RATE_LIMITS holds comma-separated overrides:
+  - "<principal>=<limit>" for one principal
+  - "<principal>:<tool>=<limit>" for one principal's calls to one tool
+  - "*:<tool>=<limit>" for every principal's calls to one tool
+
+The in-memory buckets live in an LRU map of at most RATE_LIMIT_MAX_BUCKETS
+entries. A check is a dict lookup plus a little arithmetic. Buckets that
+have been idle long enough to refill completely are evicted as new ones are
+added; such a bucket is the same as a new one.
+
+When RATE_LIMIT_REDIS_URL is set, buckets live in Redis (or anything that
+speaks its protocol and runs Lua), so all instances share a caller's limits.
+Each check is one EVALSHA that refills and takes tokens atomically using the
+server's clock. Keys expire once their bucket would be full again. If Redis
+cannot be reached, checks fall back to the local buckets.
+"""
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from registry import encode_error, tool_call_args
+
+logger = logging.getLogger(__name__)
+
+# JSON-RPC error code for requests rejected by a rate limit (server error range)
+RATE_LIMITED = -32004
+
+# Principal used in RATE_LIMITS for "any caller"
+ANY = "*"
+
+_PERIODS = {"s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class Limit(NamedTuple):
+    rate: float  # tokens per second
+    burst: float  # bucket capacity
+
+
+# (key, limit, cost): one bucket draw in a check
+Draw = Tuple[str, Limit, int]
+
+
+def parse_limit(spec: str) -> Limit:
+    """Parse "<count>/<s|m|h>[:burst]" (a bare count means per second); raises ValueError."""
+    text, _, burst = spec.strip().partition(":")
+    count, _, period = text.partition("/")
+    seconds = _PERIODS.get(period.strip() or "s")
+    if seconds is None:
+        raise ValueError(f"rate limit {spec!r}: period must be s, m or h")
+    limit = Limit(float(count) / seconds, float(burst) if burst else float(count))
+    if not limit.rate > 0:
+        raise ValueError(f"rate limit {spec!r}: count must be positive")
+    if not limit.burst >= 1:
+        raise ValueError(f"rate limit {spec!r}: burst must be at least 1")
+    return limit
+
+
+def parse_limits(spec: str) -> Dict[Tuple[str, str], Limit]:
+    """Parse RATE_LIMITS into {(principal, tool): limit}; tool is "" for whole-principal limits."""
+    limits: Dict[Tuple[str, str], Limit] = {}
+    for item in spec.split(","):
+        target, sep, limit = item.strip().rpartition("=")
+        if not sep or not target:
+            continue
+        principal, _, tool = target.partition(":")
+        limits[(principal.strip(), tool.strip())] = parse_limit(limit)
+    return limits
+
+
+class LocalBuckets:
+    """In-memory token buckets in a bounded LRU map."""
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        # key -> [tokens, updated (monotonic), limit]
+        self._buckets: "OrderedDict[str, List[Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, draws: List[Draw]) -> Optional[Tuple[int, float]]:
+        """Take every draw, or none of them; on refusal returns (index of the draw, seconds until it fits)."""
+        now = time.monotonic()
+        buckets = []
+        for index, (key, limit, cost) in enumerate(draws):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._add(key, limit, now)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+                bucket[1] = now
+            if bucket[0] < cost:
+                return index, (cost - bucket[0]) / limit.rate
+            buckets.append(bucket)
+        for bucket, (_key, _limit, cost) in zip(buckets, draws):
+            bucket[0] -= cost
+        return None
+
+    def _add(self, key: str, limit: Limit, now: float) -> List[Any]:
+        buckets = self._buckets
+        # The oldest bucket is dropped if full again (idle long enough), or to stay within maxsize
+        if buckets:
+            _oldest_key, (tokens, updated, oldest_limit) = next(iter(buckets.items()))
+            if len(buckets) >= self.maxsize or tokens + (now - updated) * oldest_limit.rate >= oldest_limit.burst:
+                buckets.popitem(last=False)
+        bucket = [limit.burst, now, limit]
+        buckets[key] = bucket
+        return bucket
+
+
+# Refill and take from every bucket in KEYS, or from none of them.
+# ARGV holds rate, burst and cost for each key. Numbers are returned as
+# strings because Redis truncates Lua numbers to integers.
+_TAKE_SCRIPT = """
+local now = redis.call('TIME')
+local t = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local tokens = {}
+for i = 1, #KEYS do
+  local rate, burst, cost = tonumber(ARGV[3*i-2]), tonumber(ARGV[3*i-1]), tonumber(ARGV[3*i])
+  local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+  local have = tonumber(state[1])
+  if have == nil then
+    have = burst
+  else
+    have = math.min(burst, have + math.max(0, t - tonumber(state[2])) * rate)
+  end
+  if have < cost then
+    return {i, tostring((cost - have) / rate)}
+  end
+  tokens[i] = have - cost
+end
+for i = 1, #KEYS do
+  local rate, burst = tonumber(ARGV[3*i-2]), tonumber(ARGV[3*i-1])
+  redis.call('HSET', KEYS[i], 'tokens', tostring(tokens[i]), 'ts', tostring(t))
+  redis.call('PEXPIRE', KEYS[i], math.ceil((burst - tokens[i]) / rate * 1000) + 1000)
+end
+return {0, '0'}
+"""
+
+
+class RedisBuckets:
+    """Token buckets shared through Redis, updated atomically by a Lua script."""
+
+    def __init__(self, url: str, prefix: str = "mcp:ratelimit:"):
+        import redis.asyncio  # optional dependency, only needed with RATE_LIMIT_REDIS_URL
+
+        self.client = redis.asyncio.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        self.prefix = prefix
+        self._take = self.client.register_script(_TAKE_SCRIPT)
+
+    async def take(self, draws: List[Draw]) -> Optional[Tuple[int, float]]:
+        args: List[Any] = []
+        for _key, limit, cost in draws:
+            args += [limit.rate, limit.burst, cost]
+        index, retry_after = await self._take(keys=[self.prefix + key for key, _l, _c in draws], args=args)
+        if not index:
+            return None
+        return int(index) - 1, float(retry_after)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+class RateLimiter:
+    """Per-principal and per-principal-per-tool limits for JSON-RPC requests."""
+
+    def __init__(
+        self,
+        default: Optional[Limit] = None,
+        limits: Optional[Dict[Tuple[str, str], Limit]] = None,
+        maxsize: int = 10000,
+        shared: Optional[RedisBuckets] = None,
+    ):
+        self.default = default
+        self.limits = limits or {}
+        self.tools = frozenset(tool for _principal, tool in self.limits if tool)
+        self.local = LocalBuckets(maxsize)
+        self.shared = shared
+        self.rejected = {"principal": 0, "tool": 0}
+        self._shared_error_at = 0.0
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        default = os.getenv("RATE_LIMIT", "")
+        url = os.getenv("RATE_LIMIT_REDIS_URL", "")
+        return cls(
+            default=parse_limit(default) if default else None,
+            limits=parse_limits(os.getenv("RATE_LIMITS", "")),
+            maxsize=int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "10000")),
+            shared=RedisBuckets(url) if url else None,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.default is not None or bool(self.limits)
+
+    def draws(self, principal: str, body: Any) -> List[Draw]:
+        """Bucket draws for a parsed JSON-RPC message or batch sent by `principal`."""
+        messages = body if isinstance(body, list) else [body]
+        # Keys share a {hash tag} so one script can touch them all on a Redis cluster
+        key = f"{{{principal}}}"
+        draws: List[Draw] = []
+        limit = self.limits.get((principal, ""), self.default)
+        if limit is not None:
+            draws.append((key, limit, len(messages)))
+        if self.tools:
+            tool_calls: Dict[str, int] = {}
+            for message in messages:
+                if not isinstance(message, dict) or message.get("method") != "tools/call":
+                    continue
+                params = message.get("params") or {}
+                # Malformed calls are answered with -32602 by the handler; they only cost the principal token
+                if not isinstance(params, dict):
+                    continue
+                tool = tool_call_args(params)[0]
+                if isinstance(tool, str) and tool in self.tools:
+                    tool_calls[tool] = tool_calls.get(tool, 0) + 1
+            for tool, count in tool_calls.items():
+                limit = self.limits.get((principal, tool)) or self.limits.get((ANY, tool))
+                if limit is not None:
+                    draws.append((f"{key}:{tool}", limit, count))
+        return draws
+
+    async def check(self, principal: str, body: Any) -> Optional[float]:
+        """Take tokens for a request; returns None if it may run, else seconds to wait before retrying.
+
+        The wait is infinite for a request larger than a bucket's burst.
+        """
+        draws = self.draws(principal, body)
+        if not draws:
+            return None
+        refused: Optional[Tuple[int, float]] = None
+        # A draw larger than its bucket never fits, however long the caller waits
+        oversized = next((i for i, (_key, limit, cost) in enumerate(draws) if cost > limit.burst), None)
+        if oversized is not None:
+            refused = oversized, math.inf
+        elif self.shared is not None:
+            try:
+                refused = await self.shared.take(draws)
+            except Exception as e:
+                # Fail over to this instance's buckets rather than failing requests; warn once a minute
+                now = time.monotonic()
+                if now - self._shared_error_at > 60:
+                    self._shared_error_at = now
+                    logger.warning("shared rate limit store unavailable, using local buckets", extra={"error": str(e)})
+                refused = self.local.take(draws)
+        else:
+            refused = self.local.take(draws)
+        if refused is None:
+            return None
+        index, retry_after = refused
+        self.rejected["principal" if draws[index][0] == f"{{{principal}}}" else "tool"] += 1
+        return retry_after
+
+    def rejected_body(self, body: Any, retry_after: float) -> bytes:
+        """JSON-RPC error for a rate-limited message (id null for batches)."""
+        msg_id = body.get("id") if isinstance(body, dict) else None
+        if math.isinf(retry_after):
+            return encode_error(msg_id, RATE_LIMITED, "Request exceeds the rate limit burst; send fewer messages per batch")
+        return encode_error(msg_id, RATE_LIMITED, "Rate limit exceeded", {"retryAfter": retry_after_header(retry_after)})
+
+    def rejected_headers(self, retry_after: float) -> Dict[str, str]:
+        """Headers for the 429: Retry-After, unless waiting would not help."""
+        if math.isinf(retry_after):
+            return {}
+        return {"Retry-After": str(retry_after_header(retry_after))}
+
+    def render(self) -> str:
+        """Prometheus text for rate limit rejections and local bucket count."""
+        lines = [
+            "# HELP mcp_rate_limited_total Requests rejected with 429, by the limit that was hit.",
+            "# TYPE mcp_rate_limited_total counter",
+        ]
+        lines += [f'mcp_rate_limited_total{{limit="{k}"}} {n}' for k, n in self.rejected.items()]
+        lines += [
+            "# HELP mcp_rate_limit_buckets Token buckets held in memory.",
+            "# TYPE mcp_rate_limit_buckets gauge",
+            f"mcp_rate_limit_buckets {len(self.local)}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    async def aclose(self) -> None:
+        if self.shared is not None:
+            await self.shared.aclose()
+
+
+def retry_after_header(seconds: float) -> int:
+    """Retry-After value: whole seconds, at least 1."""
+    return max(1, math.ceil(seconds))
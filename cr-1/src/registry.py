@@ -0,0 +1,250 @@
+"""Method and tool registry shared by the MCP JSON-RPC handlers.
+
+Handlers are registered with decorators and looked up by name in a dict, so
+dispatch cost does not grow with the number of methods or tools. Results that
+never change between requests (`initialize`, `tools/list`) are registered with
+`@registry.cached(...)`: they are serialized once and spliced into each
+response envelope as ready-made bytes.
+
+Tools are plain functions, coroutines, or async generators. A generator tool
+yields MCP content items (and optionally `Progress`), which lets the FastAPI
+servers stream its output over SSE; called over plain JSON its items are
+collected into `{"content": [...]}`.
+
+Each tool's input schema is compiled into a validator when the tool is
+registered (schema.py). `acall_tool`, `call_tool` and the SSE path check the
+arguments with it before running the handler, so a handler only sees
+arguments that match its schema, and bad ones are rejected with a JSON-RPC
+-32602 error naming each failing path.
+
+The same module is used by the FastAPI servers (cr-1, MCP-1/cr-1) and the cr-4
+Cloud Function; each service registers its own methods and tools.
+"""
+import inspect
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from schema import INVALID_PARAMS, compile_schema
+from serializer import dumps
+from timing import ServerTiming
+
+
+class RpcError(Exception):
+    """Raised by handlers to return a JSON-RPC error object."""
+
+    def __init__(self, code: int, message: str, data: Any = None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.data = data
+
+
+def encode_result(id_value: Any, result: bytes) -> bytes:
+    """Build a JSON-RPC success envelope around an already serialized result."""
+    return b'{"jsonrpc":"2.0","id":' + dumps(id_value) + b',"result":' + result + b"}"
+
+
+def encode_error(id_value: Any, code: int, message: str, data: Any = None) -> bytes:
+    error: Dict[str, Any] = {"code": code, "message": message}
+    if data is not None:
+        error["data"] = data
+    return dumps({"jsonrpc": "2.0", "id": id_value, "error": error})
+
+
+def encode_batch(parts: Iterable[bytes]) -> bytes:
+    return b"[" + b",".join(parts) + b"]"
+
+
+def tool_call_args(params: Any) -> Tuple[Any, Dict[str, Any]]:
+    """Split tools/call params into (tool name, arguments).
+
+    Accepts the MCP spec shape `{name, arguments}` and the legacy shape used by
+    the cr-2/cr-3 proxies, `{tool, <argument>: ...}`. Any other params (an
+    array, say) raise RpcError(-32602).
+    """
+    if not isinstance(params, dict):
+        raise RpcError(INVALID_PARAMS, "Invalid params: tools/call params must be an object")
+    if "tool" in params:
+        arguments = params.get("arguments")
+        if arguments is None:
+            arguments = {k: v for k, v in params.items() if k not in ("tool", "_meta")}
+        return params["tool"], arguments
+    return params.get("name"), params.get("arguments") or {}
+
+
+class Progress:
+    """Yielded by a streaming tool to report progress (notifications/progress)."""
+
+    __slots__ = ("progress", "total", "message")
+
+    def __init__(self, progress: float, total: Optional[float] = None, message: Optional[str] = None):
+        self.progress = progress
+        self.total = total
+        self.message = message
+
+
+class Method:
+    __slots__ = ("name", "handler", "is_async", "cacheable", "result")
+
+    def __init__(self, name: str, handler: Callable[..., Any], cacheable: bool = False):
+        self.name = name
+        self.handler = handler
+        self.is_async = inspect.iscoroutinefunction(handler)
+        self.cacheable = cacheable
+        # Serialized result for cacheable methods, built on first use or by freeze()
+        self.result: Optional[bytes] = None
+
+
+class Tool:
+    __slots__ = ("name", "description", "input_schema", "handler", "is_async", "is_stream", "validator")
+
+    def __init__(self, name: str, description: str, input_schema: Dict[str, Any], handler: Callable[..., Any]):
+        self.name = name
+        self.description = description
+        self.input_schema = input_schema
+        self.handler = handler
+        self.is_async = inspect.iscoroutinefunction(handler)
+        self.is_stream = inspect.isasyncgenfunction(handler)
+        self.validator = compile_schema(input_schema, name)
+
+    def check(self, arguments: Any) -> None:
+        """Raise RpcError(-32602) unless `arguments` match the tool's input schema."""
+        errors = self.validator(arguments)
+        if not errors:
+            return
+        path, message = errors[0]
+        text = f"Invalid params: arguments{path} {message}"
+        if len(errors) > 1:
+            text += f" (and {len(errors) - 1} more)"
+        raise RpcError(INVALID_PARAMS, text, {"errors": [{"path": p, "message": m} for p, m in errors]})
+
+
+class Registry:
+    """Name -> handler tables for JSON-RPC methods and MCP tools."""
+
+    def __init__(self, schema_key: str = "inputSchema"):
+        # Key used for a tool's JSON Schema in tools/list ("parameters" in MCP-1)
+        self.schema_key = schema_key
+        self.methods: Dict[str, Method] = {}
+        self.tools: Dict[str, Tool] = {}
+
+    def method(self, name: str, *aliases: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        """Register `handler(params) -> result` for a JSON-RPC method."""
+
+        def register(handler: Callable[..., Any]) -> Callable[..., Any]:
+            entry = Method(name, handler)
+            for key in (name, *aliases):
+                self.methods[key] = entry
+            return handler
+
+        return register
+
+    def cached(self, name: str, *aliases: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        """Register a method whose result is built once and served as cached bytes."""
+
+        def register(builder: Callable[..., Any]) -> Callable[..., Any]:
+            entry = Method(name, builder, cacheable=True)
+            for key in (name, *aliases):
+                self.methods[key] = entry
+            return builder
+
+        return register
+
+    def tool(
+        self, name: str, description: str, input_schema: Optional[Dict[str, Any]] = None
+    ) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        """Register `handler(arguments) -> result` as an MCP tool.
+
+        The schema is compiled here, so one the validator cannot check raises
+        schema.SchemaError at import time.
+        """
+
+        def register(handler: Callable[..., Any]) -> Callable[..., Any]:
+            self.tools[name] = Tool(name, description, input_schema or {"type": "object"}, handler)
+            self._invalidate()
+            return handler
+
+        return register
+
+    def get(self, name: Any) -> Optional[Method]:
+        return self.methods.get(name) if isinstance(name, str) else None
+
+    def get_tool(self, name: Any) -> Optional[Tool]:
+        return self.tools.get(name) if isinstance(name, str) else None
+
+    def tool_descriptors(self) -> List[Dict[str, Any]]:
+        return [
+            {"name": t.name, "description": t.description, self.schema_key: t.input_schema}
+            for t in self.tools.values()
+        ]
+
+    def cached_result(self, entry: Method) -> bytes:
+        result = entry.result
+        if result is None:
+            result = entry.result = dumps(entry.handler())
+        return result
+
+    def freeze(self) -> None:
+        """Serialize every cached result now (call at startup)."""
+        for entry in self.methods.values():
+            if entry.cacheable:
+                self.cached_result(entry)
+
+    def _invalidate(self) -> None:
+        # tools/list (and anything else cached) may depend on the tool table
+        for entry in self.methods.values():
+            entry.result = None
+
+    async def acall(self, entry: Method, params: Dict[str, Any], timing: Optional[ServerTiming] = None) -> bytes:
+        """Run a method and return its serialized result.
+
+        With `timing`, the handler and the encoding are recorded as the
+        "dispatch" and "serialize" stages.
+        """
+        started = time.perf_counter()
+        if entry.cacheable:
+            result = self.cached_result(entry)
+            if timing is not None:
+                timing.since("dispatch", started)
+            return result
+        value = entry.handler(params)
+        if entry.is_async:
+            value = await value
+        return self._serialize(value, started, timing)
+
+    def call(self, entry: Method, params: Dict[str, Any], timing: Optional[ServerTiming] = None) -> bytes:
+        """Synchronous `acall` for WSGI callers; async handlers are not allowed."""
+        started = time.perf_counter()
+        if entry.cacheable:
+            result = self.cached_result(entry)
+            if timing is not None:
+                timing.since("dispatch", started)
+            return result
+        if entry.is_async:
+            raise TypeError(f"{entry.name} is async; use acall()")
+        return self._serialize(entry.handler(params), started, timing)
+
+    @staticmethod
+    def _serialize(value: Any, started: float, timing: Optional[ServerTiming]) -> bytes:
+        if timing is None:
+            return dumps(value)
+        mark = timing.since("dispatch", started)
+        result = dumps(value)
+        timing.since("serialize", mark)
+        return result
+
+    async def acall_tool(self, tool: Tool, arguments: Dict[str, Any]) -> Any:
+        tool.check(arguments)
+        if tool.is_stream:
+            content = [item async for item in tool.handler(arguments) if not isinstance(item, Progress)]
+            return {"content": content}
+        result = tool.handler(arguments)
+        if tool.is_async:
+            result = await result
+        return result
+
+    def call_tool(self, tool: Tool, arguments: Dict[str, Any]) -> Any:
+        if tool.is_async or tool.is_stream:
+            raise TypeError(f"tool {tool.name} is async; use acall_tool()")
+        tool.check(arguments)
+        return tool.handler(arguments)
@@ -0,0 +1,352 @@
+"""Tool argument validation: each inputSchema compiled once into Python code.
+
+`compile_schema(schema)` turns a JSON Schema into the source of a Python
+function and `exec`s it once, at tool registration. A call then runs straight
+isinstance checks, dict lookups and comparisons. It never walks the schema
+or dispatches on keywords, which is what an interpreting validator such as
+jsonschema does on every call (see benchmarks/bench_schema.py).
+
+`Validator(value)` returns a list of `(path, message)` pairs, empty when the
+value is valid. Paths are JSON Pointers into the validated value
+("/names/1"); they are only built when a check fails.
+
+Supported keywords:
+
+- any type: type, enum, const, allOf, anyOf, oneOf, not, and local $ref
+  ("#/$defs/..." or "#/definitions/...", recursion allowed)
+- objects: properties, required, additionalProperties (bool or schema),
+  minProperties, maxProperties
+- arrays: items (one schema), minItems, maxItems, uniqueItems
+- strings: minLength, maxLength, pattern
+- numbers: minimum, maximum, exclusiveMinimum, exclusiveMaximum (numeric
+  form), multipleOf
+
+Annotations (title, description, default, examples, format, ...) are
+ignored. Any other keyword raises SchemaError when the schema is compiled, so
+an unsupported schema fails at import instead of going unchecked.
+"""
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Keywords that describe a value without constraining it
+ANNOTATIONS = frozenset(
+    {
+        "$schema", "$id", "$comment", "$defs", "definitions", "title", "description", "default",
+        "examples", "format", "deprecated", "readOnly", "writeOnly", "contentMediaType", "contentEncoding",
+    }
+)
+
+OBJECT_KEYWORDS = ("properties", "required", "additionalProperties", "minProperties", "maxProperties")
+ARRAY_KEYWORDS = ("items", "minItems", "maxItems", "uniqueItems")
+STRING_KEYWORDS = ("minLength", "maxLength", "pattern")
+NUMBER_KEYWORDS = ("minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum", "multipleOf")
+GENERAL_KEYWORDS = ("type", "enum", "const", "allOf", "anyOf", "oneOf", "not", "$ref")
+
+SUPPORTED = frozenset(OBJECT_KEYWORDS + ARRAY_KEYWORDS + STRING_KEYWORDS + NUMBER_KEYWORDS + GENERAL_KEYWORDS)
+
+# type name -> expression testing the value named {v}; bools are not numbers in JSON
+_TYPE_TESTS = {
+    "object": "isinstance({v}, dict)",
+    "array": "isinstance({v}, list)",
+    "string": "isinstance({v}, str)",
+    "boolean": "isinstance({v}, bool)",
+    "null": "{v} is None",
+    "number": "(isinstance({v}, (int, float)) and not isinstance({v}, bool))",
+    "integer": "(isinstance({v}, int) and not isinstance({v}, bool) or isinstance({v}, float) and {v}.is_integer())",
+}
+
+# The type whose keywords a keyword group checks
+_GROUPS = (("object", OBJECT_KEYWORDS), ("array", ARRAY_KEYWORDS), ("string", STRING_KEYWORDS), ("number", NUMBER_KEYWORDS))
+
+Errors = List[Tuple[str, str]]
+
+# JSON-RPC error code for arguments that fail validation
+INVALID_PARAMS = -32602
+
+
+class SchemaError(ValueError):
+    """The schema uses something `compile_schema` cannot check."""
+
+
+def _json_equal(a: Any, b: Any) -> bool:
+    """Equality as JSON defines it: true is not 1, and 1 equals 1.0."""
+    if isinstance(a, bool) or isinstance(b, bool):
+        return a is b
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return a == b
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_json_equal(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_json_equal(a[k], b[k]) for k in a)
+    return type(a) is type(b) and a == b
+
+
+def _unique(items: List[Any]) -> bool:
+    seen: List[Any] = []
+    for item in items:
+        if any(_json_equal(item, other) for other in seen):
+            return False
+        seen.append(item)
+    return True
+
+
+def _multiple_of(value: Any, factor: Any) -> bool:
+    if isinstance(value, int) and isinstance(factor, int):
+        return value % factor == 0
+    quotient = value / factor
+    return quotient == int(quotient)
+
+
+def _escape(key: str) -> str:
+    """A key as a JSON Pointer reference token."""
+    return key.replace("~", "~0").replace("/", "~1")
+
+
+def _describe(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+
+class _Compiler:
+    """Emits one Python function per compiled (sub)schema."""
+
+    def __init__(self, root: Any):
+        self.root = root
+        self.functions: List[List[str]] = []
+        self.refs: Dict[str, str] = {}
+        self.constants: Dict[str, Any] = {}
+        self.counter = 0
+
+    def name(self, prefix: str) -> str:
+        self.counter += 1
+        return f"{prefix}{self.counter}"
+
+    def constant(self, value: Any) -> str:
+        name = self.name("_c")
+        self.constants[name] = value
+        return name
+
+    def function(self, schema: Any, where: str) -> str:
+        """Compile `schema` into `name(v, path, errors)` and return the name."""
+        name = self.name("_f")
+        lines = [f"def {name}(v, path, errors):"]
+        body = self.node(schema, "v", [], where)
+        lines += ["    " + line for line in body] or ["    pass"]
+        self.functions.append(lines)
+        return name
+
+    def ref(self, pointer: str) -> str:
+        name = self.refs.get(pointer)
+        if name is None:
+            if not pointer.startswith("#/"):
+                raise SchemaError(f"only local $ref is supported, got {pointer!r}")
+            target = self.root
+            for token in pointer[2:].split("/"):
+                token = token.replace("~1", "/").replace("~0", "~")
+                if not isinstance(target, dict) or token not in target:
+                    raise SchemaError(f"$ref {pointer!r} does not resolve")
+                target = target[token]
+            # Named before compiling, so a recursive schema calls itself
+            name = self.refs[pointer] = f"_r{len(self.refs) + 1}"
+            compiled = self.function(target, pointer)
+            self.functions.append([f"{name} = {compiled}"])
+        return name
+
+    @staticmethod
+    def path(parts: List[str]) -> str:
+        """Expression for the JSON Pointer of the current value (`parts` are expressions)."""
+        return " + ".join(["path", *parts]) if parts else "path"
+
+    def fail(self, parts: List[str], message: str) -> str:
+        return f"errors.append(({self.path(parts)}, {message!r}))"
+
+    def node(self, schema: Any, v: str, parts: List[str], where: str) -> List[str]:
+        """Lines checking the value named `v` against `schema`."""
+        if schema is True:
+            return []
+        if schema is False:
+            return [self.fail(parts, "is not allowed")]
+        if not isinstance(schema, dict):
+            raise SchemaError(f"schema at {where or '#'} must be an object or a boolean")
+        unknown = set(schema) - SUPPORTED - ANNOTATIONS
+        if unknown:
+            raise SchemaError(f"unsupported keyword(s) {sorted(unknown)} at {where or '#'}")
+
+        lines: List[str] = []
+        types = schema.get("type")
+        if isinstance(types, str):
+            types = [types]
+        if types is not None:
+            for t in types:
+                if t not in _TYPE_TESTS:
+                    raise SchemaError(f"unknown type {t!r} at {where or '#'}")
+            test = " or ".join(_TYPE_TESTS[t].format(v=v) for t in types)
+            lines += [f"if not ({test}):", "    " + self.fail(parts, "must be " + " or ".join(types))]
+
+        typed: List[str] = []
+        for group_type, keywords in _GROUPS:
+            present = [k for k in keywords if k in schema]
+            if not present:
+                continue
+            group = getattr(self, f"_{group_type}")(schema, v, parts, where)
+            if not group:
+                continue
+            # Keywords only apply to values of their type; skip the test when `type` already made it
+            if types == [group_type] or (group_type == "number" and types == ["integer"]):
+                typed += group
+            else:
+                typed += [f"if {_TYPE_TESTS[group_type].format(v=v)}:"] + ["    " + line for line in group]
+        if typed:
+            lines += (["else:"] if types is not None else []) + ["    " + line if types is not None else line for line in typed]
+
+        lines += self._general(schema, v, parts, where)
+        return lines
+
+    def _general(self, schema: Dict[str, Any], v: str, parts: List[str], where: str) -> List[str]:
+        lines: List[str] = []
+        if "enum" in schema:
+            values = schema["enum"]
+            if all(isinstance(e, str) for e in values):
+                allowed = self.constant(frozenset(values))
+                test = f"isinstance({v}, str) and {v} in {allowed}"
+            else:
+                allowed = self.constant(list(values))
+                test = f"any(_json_equal({v}, e) for e in {allowed})"
+            lines += [f"if not ({test}):", "    " + self.fail(parts, f"must be one of {_describe(values)}")]
+        if "const" in schema:
+            expected = self.constant(schema["const"])
+            lines += [f"if not _json_equal({v}, {expected}):", "    " + self.fail(parts, f"must be {_describe(schema['const'])}")]
+        for i, sub in enumerate(schema.get("allOf", ())):
+            lines += self.node(sub, v, parts, f"{where}/allOf/{i}")
+        if "anyOf" in schema or "oneOf" in schema:
+            for keyword in ("anyOf", "oneOf"):
+                if keyword not in schema:
+                    continue
+                names = [self.function(sub, f"{where}/{keyword}/{i}") for i, sub in enumerate(schema[keyword])]
+                matches = self.name("m")
+                lines.append(f"{matches} = 0")
+                for name in names:
+                    scratch = self.name("e")
+                    lines += [f"{scratch} = []", f"{name}({v}, '', {scratch})", f"if not {scratch}:", f"    {matches} += 1"]
+                if keyword == "anyOf":
+                    lines += [f"if not {matches}:", "    " + self.fail(parts, "must match at least one schema in anyOf")]
+                else:
+                    lines += [f"if {matches} != 1:", "    " + self.fail(parts, "must match exactly one schema in oneOf")]
+        if "not" in schema:
+            name = self.function(schema["not"], f"{where}/not")
+            scratch = self.name("e")
+            lines += [f"{scratch} = []", f"{name}({v}, '', {scratch})", f"if not {scratch}:", "    " + self.fail(parts, "must not match the schema in not")]
+        if "$ref" in schema:
+            lines.append(f"{self.ref(schema['$ref'])}({v}, {self.path(parts)}, errors)")
+        return lines
+
+    def _object(self, schema: Dict[str, Any], v: str, parts: List[str], where: str) -> List[str]:
+        lines: List[str] = []
+        properties: Dict[str, Any] = schema.get("properties", {})
+        for key in schema.get("required", ()):
+            lines += [f"if {key!r} not in {v}:", "    " + self.fail(parts + [repr("/" + _escape(key))], "is required")]
+        for key, sub in properties.items():
+            child = self.name("v")
+            body = self.node(sub, child, parts + [repr("/" + _escape(key))], f"{where}/properties/{_escape(key)}")
+            if body:
+                lines += [f"if {key!r} in {v}:", f"    {child} = {v}[{key!r}]"] + ["    " + line for line in body]
+        extra = schema.get("additionalProperties", True)
+        if extra is not True:
+            known = self.constant(frozenset(properties))
+            key_var, child = self.name("k"), self.name("v")
+            key_part = f"'/' + _escape({key_var})"
+            if extra is False:
+                body = [self.fail(parts + [key_part], "is not allowed")]
+            else:
+                body = [f"{child} = {v}[{key_var}]"] + self.node(extra, child, parts + [key_part], f"{where}/additionalProperties")
+            lines += [f"for {key_var} in {v}:", f"    if {key_var} not in {known}:"] + ["        " + line for line in body]
+        if "minProperties" in schema:
+            n = schema["minProperties"]
+            lines += [f"if len({v}) < {n!r}:", "    " + self.fail(parts, f"must have at least {n} properties")]
+        if "maxProperties" in schema:
+            n = schema["maxProperties"]
+            lines += [f"if len({v}) > {n!r}:", "    " + self.fail(parts, f"must have at most {n} properties")]
+        return lines
+
+    def _array(self, schema: Dict[str, Any], v: str, parts: List[str], where: str) -> List[str]:
+        lines: List[str] = []
+        if "minItems" in schema:
+            n = schema["minItems"]
+            lines += [f"if len({v}) < {n!r}:", "    " + self.fail(parts, f"must have at least {n} items")]
+        if "maxItems" in schema:
+            n = schema["maxItems"]
+            lines += [f"if len({v}) > {n!r}:", "    " + self.fail(parts, f"must have at most {n} items")]
+        if schema.get("uniqueItems"):
+            lines += [f"if not _unique({v}):", "    " + self.fail(parts, "must not contain duplicate items")]
+        if "items" in schema:
+            if isinstance(schema["items"], list):
+                raise SchemaError(f"tuple-form items is not supported at {where or '#'}")
+            index, child = self.name("i"), self.name("v")
+            body = self.node(schema["items"], child, parts + ["'/'", f"str({index})"], f"{where}/items")
+            if body:
+                lines += [f"for {index}, {child} in enumerate({v}):"] + ["    " + line for line in body]
+        return lines
+
+    def _string(self, schema: Dict[str, Any], v: str, parts: List[str], where: str) -> List[str]:
+        lines: List[str] = []
+        if "minLength" in schema:
+            n = schema["minLength"]
+            lines += [f"if len({v}) < {n!r}:", "    " + self.fail(parts, f"must be at least {n} characters")]
+        if "maxLength" in schema:
+            n = schema["maxLength"]
+            lines += [f"if len({v}) > {n!r}:", "    " + self.fail(parts, f"must be at most {n} characters")]
+        if "pattern" in schema:
+            pattern = self.constant(re.compile(schema["pattern"]))
+            lines += [f"if not {pattern}.search({v}):", "    " + self.fail(parts, f"must match pattern {schema['pattern']}")]
+        return lines
+
+    def _number(self, schema: Dict[str, Any], v: str, parts: List[str], where: str) -> List[str]:
+        lines: List[str] = []
+        for keyword, op, text in (
+            ("minimum", "<", ">="),
+            ("maximum", ">", "<="),
+            ("exclusiveMinimum", "<=", ">"),
+            ("exclusiveMaximum", ">=", "<"),
+        ):
+            if keyword not in schema:
+                continue
+            bound = schema[keyword]
+            if isinstance(bound, bool) or not isinstance(bound, (int, float)):
+                raise SchemaError(f"{keyword} must be a number at {where or '#'}")
+            lines += [f"if {v} {op} {bound!r}:", "    " + self.fail(parts, f"must be {text} {bound}")]
+        if "multipleOf" in schema:
+            factor = schema["multipleOf"]
+            lines += [f"if not _multiple_of({v}, {factor!r}):", "    " + self.fail(parts, f"must be a multiple of {factor}")]
+        return lines
+
+
+class Validator:
+    """A schema compiled to Python; `validator(value)` returns [(path, message), ...], empty if valid."""
+
+    __slots__ = ("schema", "source", "_check")
+
+    def __init__(self, schema: Any, source: str, check: Callable[[Any, str, Errors], None]):
+        self.schema = schema
+        self.source = source
+        self._check = check
+
+    def __call__(self, value: Any) -> Errors:
+        errors: Errors = []
+        self._check(value, "", errors)
+        return errors
+
+
+def compile_schema(schema: Any, name: Optional[str] = None) -> Validator:
+    """Generate and compile the validation code for `schema` (raises SchemaError)."""
+    compiler = _Compiler(schema)
+    root = compiler.function(schema, "")
+    source = "\n\n".join("\n".join(lines) for lines in compiler.functions) + "\n"
+    namespace: Dict[str, Any] = {
+        "_json_equal": _json_equal,
+        "_unique": _unique,
+        "_multiple_of": _multiple_of,
+        "_escape": _escape,
+        **compiler.constants,
+    }
+    exec(compile(source, f"<schema {name or 'validator'}>", "exec"), namespace)
+    return Validator(schema, source, namespace[root])
@@ -1,13 +1,83 @@
-from typing import Any, Dict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+import asyncio
+import hmac
+import os
+import time
 from fastapi import FastAPI, HTTPException, Request, Depends
-from fastapi.responses import Response
+from fastapi.responses import Response, StreamingResponse
 import uvicorn
-from google.auth.transport import requests
-import google.oauth2.id_token
-import json
+
+import logs
+from admission import AdmissionController
+from auth import CertCache, ClaimsCache, TokenVerifier
+from metrics import PROMETHEUS_CONTENT_TYPE, Metrics, OtlpExporter, call_labels
+from ratelimit import RateLimiter
+from registry import Progress, Registry, RpcError, encode_batch, encode_error, encode_result, tool_call_args
+from serializer import DecodeError, loads
+from session_store import HEADER as SESSION_HEADER, SessionStore
+from shared_cache import SharedCache, render_caches
+from streaming import SSE_HEADERS, SSE_MEDIA_TYPE, accepts_sse, stream_tool_call, streaming_tool_call
+from timing import ServerTiming, ServerTimingMiddleware
+from tracing import BatchSpanExporter, Span, Tracer, TracingMiddleware
+from warmup import warm_up
+from worker_metrics import WorkerMetrics
+
+# JSON logs to stdout through a background writer (see logs.py)
+logger = logs.setup("mcp-server")
+
+# Expected ID token audience (this service's URL)
+AUTH_AUDIENCE = os.getenv("AUTH_AUDIENCE", "https://mcp-hello-456052106337.us-central1.run.app")
+
+# Certs are kept until their Cache-Control max-age expires, verified claims until token exp.
+# Both are shared by the gunicorn workers of an instance (see shared_cache.py)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+shared_certs = SharedCache("certs", slots=1, slot_size=16384)
+shared_claims = SharedCache("claims", slots=TOKEN_CACHE_SIZE)
+token_verifier = TokenVerifier(
+    AUTH_AUDIENCE,
+    certs=CertCache(shared=shared_certs),
+    claims=ClaimsCache(maxsize=TOKEN_CACHE_SIZE, shared=shared_claims),
+)
+
+
+# Per-method/per-tool latency histograms, served on /metrics (and pushed over OTLP if configured)
+metrics = Metrics()
+metrics_exporter = OtlpExporter.from_env(metrics, "mcp-server")
+
+# Continues the caller's W3C traceparent; spans are batch-exported if OTLP or TRACE_EXPORT_FILE is set
+span_exporter = BatchSpanExporter.from_env("mcp-server")
+tracer = Tracer(span_exporter, float(os.getenv("OTEL_TRACES_SAMPLER_ARG", "1.0")))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if metrics_exporter is not None:
+        metrics_exporter.start()
+    if span_exporter is not None:
+        span_exporter.start()
+    worker_metrics.start()
+    # Google certs and the JWT/RSA code are loaded before the first request needs them
+    await warm_up({"certs": token_verifier.warm})
+    yield
+    await token_verifier.aclose()
+    await rate_limiter.aclose()
+    await session_store.aclose()
+    await asyncio.to_thread(worker_metrics.stop)
+    if metrics_exporter is not None:
+        await asyncio.to_thread(metrics_exporter.stop)
+    if span_exporter is not None:
+        await asyncio.to_thread(span_exporter.stop)
+
 
 # Initialize FastAPI server
-app = FastAPI(title="hello-server")
+app = FastAPI(title="hello-server", lifespan=lifespan)
+
+# Per-stage timings (auth, parse, dispatch, serialize) in a Server-Timing response header
+app.add_middleware(ServerTimingMiddleware)
+
+# One server span per request (outermost, so it covers everything below)
+app.add_middleware(TracingMiddleware, tracer=tracer)
 
 async def verify_token(request: Request):
     """Verify the incoming ID token."""
@@ -16,17 +86,14 @@ async def verify_token(request: Request):
         raise HTTPException(status_code=401, detail="Missing or invalid authentication token")
     
     token = auth_header.split("Bearer ")[1]
+    started = time.perf_counter()
     try:
-        # Initialize the Requests object
-        request = requests.Request()
-        
-        # Verify the ID token
-        decoded_token = google.oauth2.id_token.verify_oauth2_token(
-            token, request)
-        
-        # Verify the token's audience matches our service
-        if decoded_token.get("aud") != "https://mcp-hello-456052106337.us-central1.run.app":
-            raise ValueError("Invalid token audience")
+        # Verify the ID token (signature, issuer, expiry and audience) off the event loop
+        decoded_token = await token_verifier.averify(token)
+        request.state.timing.since("auth", started)
+        metrics.observe_auth(started, True)
+        # Rate limits are kept per calling service account
+        request.state.principal = decoded_token.get("email") or decoded_token.get("sub") or ""
         
         # Optional: Application-level service account restriction
         # Uncomment the following lines if you want to restrict at application level
@@ -41,23 +108,36 @@ async def verify_token(request: Request):
         #         detail=f"Access denied for service account: {caller_email}"
         #     )
         
-        # Log cal ity details for diagnostics
+        # Log caller identity details for diagnostics
         # IAM policy at Cloud Run level controls which service accounts can invoke this service
-        try:
-            caller_email = decoded_token.get("email")
-            caller_sub = decoded_token.get("sub")
-            caller_iss = decoded_token.get("iss")
-            caller_aud = decoded_token.get("aud")
-            print(
-                f"[MCP-SERVER] Caller email={caller_email} sub={caller_sub} iss={caller_iss} aud={caller_aud}"
-            )
-        except Exception as log_e:
-            print(f"[MCP-SERVER] Failed to log token claims: {log_e}")
-            
+        logger.info(
+            "caller verified",
+            extra={
+                "route": request.url.path,
+                "caller_email": decoded_token.get("email"),
+                "caller_sub": decoded_token.get("sub"),
+                "caller_iss": decoded_token.get("iss"),
+                "caller_aud": decoded_token.get("aud"),
+            },
+        )
+
         return decoded_token
     except Exception as e:
+        metrics.observe_auth(started, False)
         raise HTTPException(status_code=401, detail=f"Invalid token: {str(e)}")
 
+
+# Optional static bearer token for /metrics, for scrapers that cannot present an ID token
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+
+async def verify_metrics_token(request: Request):
+    """Accept METRICS_TOKEN as the bearer token for /metrics; anything else must be a valid ID token."""
+    presented = request.headers.get("Authorization", "").encode()
+    if METRICS_TOKEN and hmac.compare_digest(presented, f"Bearer {METRICS_TOKEN}".encode()):
+        return None
+    return await verify_token(request)
+
 @app.get("/hello", dependencies=[Depends(verify_token)])
 def say_hello(name: str = "World") -> dict[str, Any]:
     """
@@ -75,101 +155,295 @@ def say_hello(name: str = "World") -> dict[str, Any]:
 # MCP endpoint with manual JSON-RPC handling
 # -----------------------------
 
+# Upper bound on the number of entries accepted in one JSON-RPC batch
+MAX_BATCH_SIZE = int(os.getenv("MCP_MAX_BATCH_SIZE", "50"))
+
+# Per-caller (and optionally per-tool) token buckets, see ratelimit.py
+rate_limiter = RateLimiter.from_env()
+
+# In-flight limit (per worker), short wait queue and a reserved initialize/ping lane for /mcp (see admission.py)
+admission = AdmissionController.from_env()
+
+# Mcp-Session-Id sessions issued on initialize (MCP_SESSIONS=true, see session_store.py)
+session_store = SessionStore.from_env()
+
+# JSON-RPC error code for a request whose Mcp-Session-Id is unknown or expired (sent with HTTP 404)
+SESSION_NOT_FOUND = -32001
+
+registry = Registry()
+
+
+@registry.cached("initialize")
+def mcp_initialize() -> Dict[str, Any]:
+    return {
+        "protocolVersion": "2024-11-05",
+        "capabilities": {
+            "tools": {}
+        },
+        "serverInfo": {
+            "name": "mcp-hello",
+            "version": "1.0.0"
+        }
+    }
+
+
+@registry.cached("ping")
+def mcp_ping() -> Dict[str, Any]:
+    return {}
+
+
+@registry.cached("tools/list")
+def mcp_tools_list() -> Dict[str, Any]:
+    return {"tools": registry.tool_descriptors()}
+
+
+@registry.method("tools/call")
+async def mcp_tools_call(params: Dict[str, Any]) -> Any:
+    tool_name, arguments = tool_call_args(params)
+    tool = registry.get_tool(tool_name)
+    if tool is None:
+        raise RpcError(-32601, f"Tool not found: {tool_name}")
+    return await registry.acall_tool(tool, arguments)
+
+
+@registry.tool(
+    "hello",
+    "Greets a name with a friendly message",
+    {
+        "type": "object",
+        "properties": {
+            "name": {
+                "type": "string",
+                "description": "Name to greet"
+            }
+        }
+    },
+)
+def hello_tool(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    name = arguments.get("name", "World")
+    # Return the result directly as the old format expected
+    return {"message": f"Hello, {name}!", "type": "greeting"}
+
+
+
+@registry.tool(
+    "hello_stream",
+    "Greets each name in turn, streaming one greeting at a time",
+    {
+        "type": "object",
+        "properties": {
+            "names": {"type": "array", "items": {"type": "string"}, "description": "Names to greet"}
+        },
+    },
+)
+async def hello_stream_tool(arguments: Dict[str, Any]) -> AsyncIterator[Any]:
+    names = arguments.get("names") or ["World"]
+    yield Progress(0, len(names), "greeting")
+    for name in names:
+        yield {"type": "text", "text": f"Hello, {name}!"}
+
+# Serialize initialize/ping/tools/list once, at import time
+registry.freeze()
+
+
+def _json_response(content: bytes, status_code: int = 200) -> Response:
+    return Response(content=content, status_code=status_code, media_type="application/json")
+
+
+def _call_span(label: str, tool: str, msg_id: Any) -> Span:
+    """Span for one JSON-RPC call, named by the metric labels so span names stay bounded too."""
+    span = tracer.start(
+        f"{label} {tool}" if tool else label,
+        attributes={"rpc.system": "jsonrpc", "rpc.method": label, "rpc.jsonrpc.request_id": str(msg_id)},
+    )
+    if tool:
+        span.set("mcp.tool", tool)
+    return span
+
+
+async def handle_rpc(body: Any, timing: Optional[ServerTiming] = None) -> Optional[bytes]:
+    """Handle a single JSON-RPC message; returns None for notifications.
+
+    `timing` gets the dispatch/serialize stages (single requests only; batch
+    entries run concurrently and are timed as a whole).
+    """
+    if not isinstance(body, dict):
+        return encode_error(None, -32600, "Invalid Request")
+
+    # Requests without an id are notifications and get no response
+    is_notification = "id" not in body
+    msg_id = body.get("id")
+    method = body.get("method")
+    params = body.get("params") or {}
+    entry = registry.get(method)
+    label, tool = call_labels(registry, entry, params)
+    series = metrics.begin(label, tool)
+    span = _call_span(label, tool, msg_id)
+    started = time.perf_counter()
+    code = 0
+    error = None
+    try:
+        # params are redacted by the log formatter
+        logger.info("mcp request", extra={"route": "/mcp", "method": method, "id": msg_id, "params": params})
+
+        if entry is None:
+            raise RpcError(-32601, f"Method not found: {method}")
+        response = encode_result(msg_id, await registry.acall(entry, params, timing))
+    except RpcError as e:
+        code, error = e.code, e.message
+        response = encode_error(msg_id, e.code, e.message, e.data)
+    except Exception as e:
+        code, error = -32603, str(e)
+        logger.exception("mcp request failed", extra={"route": "/mcp", "method": method, "id": msg_id})
+        response = encode_error(msg_id, -32603, "Internal error", str(e))
+    metrics.end(series, started, code)
+    if code:
+        span.set("rpc.jsonrpc.error_code", code)
+    span.end(error)
+    return None if is_notification else response
+
+
 # Mount MCP server into FastAPI with auth dependency
 @app.post("/mcp", dependencies=[Depends(verify_token)])
 async def mcp_endpoint(request: Request):
-    """MCP endpoint with authentication - handles JSON-RPC 2.0 requests."""
+    """MCP endpoint with authentication - handles JSON-RPC 2.0 requests and batches."""
+    timing = request.state.timing
+    raw = await request.body()
+    started = time.perf_counter()
     try:
-        body = await request.json()
-        print(f"[MCP-SERVER] Received MCP method={body.get('method')} id={body.get('id')} params={body.get('params')}")
-        
-        # Handle different MCP methods
-        method = body.get("method")
-        params = body.get("params", {})
-        msg_id = body.get("id")
-        
-        if method == "initialize":
-            result = {
-                "protocolVersion": "2024-11-05",
-                "capabilities": {
-                    "tools": {}
-                },
-                "serverInfo": {
-                    "name": "mcp-hello",
-                    "version": "1.0.0"
-                }
-            }
-        elif method == "tools/list":
-            result = {
-                "tools": [
-                    {
-                        "name": "hello",
-                        "description": "Greets a name with a friendly message",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "name": {
-                                    "type": "string",
-                                    "description": "Name to greet"
-                                }
-                            }
-                        }
-                    }
-                ]
-            }
-        elif method == "tools/call":
-            tool_name = params.get("tool")
-            if tool_name == "hello":
-                name = params.get("name", "World")
-                # Return the result directly as the old format expected
-                result = {"message": f"Hello, {name}!", "type": "greeting"}
-            else:
-                return Response(
-                    content=json.dumps({
-                        "jsonrpc": "2.0",
-                        "id": msg_id,
-                        "error": {
-                            "code": -32601,
-                            "message": f"Tool not found: {tool_name}"
-                        }
-                    }),
-                    media_type="application/json"
-                )
-        else:
+        body = loads(raw)
+    except DecodeError as e:
+        logger.warning("mcp parse error", extra={"route": "/mcp", "error": str(e)})
+        return _json_response(encode_error(None, -32700, "Parse error", str(e)))
+    timing.since("parse", started)
+
+    session_id = request.headers.get(SESSION_HEADER) if session_store.enabled else None
+    if session_id:
+        session = await session_store.get(session_id, request.state.principal)
+        if session is None:
+            # Unknown or expired: the client starts a new session with initialize
+            msg_id = body.get("id") if isinstance(body, dict) else None
+            return _json_response(encode_error(msg_id, SESSION_NOT_FOUND, "Session not found"), status_code=404)
+        request.state.session = session
+
+    if rate_limiter.enabled:
+        retry_after = await rate_limiter.check(request.state.principal, body)
+        if retry_after is not None:
             return Response(
-                content=json.dumps({
-                    "jsonrpc": "2.0",
-                    "id": msg_id,
-                    "error": {
-                        "code": -32601,
-                        "message": f"Method not found: {method}"
-                    }
-                }),
-                media_type="application/json"
+                content=rate_limiter.rejected_body(body, retry_after),
+                status_code=429,
+                media_type="application/json",
+                headers=rate_limiter.rejected_headers(retry_after),
             )
-        
-        response = {
-            "jsonrpc": "2.0",
-            "id": msg_id,
-            "result": result
-        }
-        
-        return Response(content=json.dumps(response), media_type="application/json")
-        
-    except Exception as e:
-        print(f"[MCP-SERVER] Error: {e}")
+
+    lane = await admission.acquire(admission.is_priority(body))
+    if lane is None:
         return Response(
-            content=json.dumps({
-                "jsonrpc": "2.0",
-                "id": body.get("id") if "body" in locals() else None,
-                "error": {
-                    "code": -32603,
-                    "message": "Internal error",
-                    "data": str(e)
-                }
-            }),
-            media_type="application/json"
+            content=admission.overload_body(body),
+            status_code=503,
+            media_type="application/json",
+            headers={"Retry-After": str(admission.retry_after)},
         )
+    try:
+        response = await _mcp_response(request, body, timing)
+        if session_store.enabled and response.status_code == 200 and _is_initialize(body):
+            session = await session_store.create(request.state.principal, body.get("params") or {})
+            response.headers[SESSION_HEADER] = session.id
+    except BaseException:
+        admission.release(lane)
+        raise
+    if isinstance(response, StreamingResponse):
+        # A stream keeps its slot until the last event is sent
+        response.body_iterator = admission.hold(lane, response.body_iterator)
+    else:
+        admission.release(lane)
+    return response
+
+
+def _is_initialize(body: Any) -> bool:
+    return isinstance(body, dict) and body.get("method") == "initialize" and "id" in body
+
+
+async def _mcp_response(request: Request, body: Any, timing: ServerTiming) -> Response:
+    if isinstance(body, list):
+        if not body or len(body) > MAX_BATCH_SIZE:
+            return _json_response(
+                encode_error(None, -32600, "Invalid Request", f"batch must contain between 1 and {MAX_BATCH_SIZE} entries")
+            )
+        # Batch entries are independent, so run them concurrently
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(handle_rpc(entry) for entry in body))
+        responses = [r for r in responses if r is not None]
+        started = timing.since("dispatch", started)
+        if not responses:
+            return Response(status_code=202)
+        content = encode_batch(responses)
+        timing.since("serialize", started)
+        return _json_response(content)
+
+    # Streamable HTTP: stream tool output as SSE when the client accepts it
+    if isinstance(body, dict) and accepts_sse(request.headers.get("accept")):
+        stream = streaming_tool_call(registry, body)
+        if stream is not None:
+            tool, arguments = stream
+            params = body.get("params") or {}
+            progress_token = (params.get("_meta") or {}).get("progressToken")
+            # params are redacted by the log formatter
+            logger.info("mcp request", extra={"route": "/mcp", "method": "tools/call", "id": body["id"], "params": params})
+            series = metrics.begin("tools/call", tool.name)
+            span = _call_span("tools/call", tool.name, body["id"])
+            return StreamingResponse(
+                metrics.track_stream(
+                    series, time.perf_counter(), stream_tool_call(tool, arguments, body["id"], progress_token, span)
+                ),
+                media_type=SSE_MEDIA_TYPE,
+                headers=SSE_HEADERS,
+            )
+
+    response = await handle_rpc(body, timing)
+    if response is None:
+        return Response(status_code=202)
+    return _json_response(response)
+
+
+@app.get("/mcp", dependencies=[Depends(verify_token)])
+async def mcp_stream():
+    """No server-initiated SSE stream is offered (streamable HTTP allows 405 here)."""
+    return Response(status_code=405, headers={"Allow": "POST"})
+
+
+@app.delete("/mcp", dependencies=[Depends(verify_token)])
+async def mcp_end_session(request: Request):
+    """End the session named by Mcp-Session-Id (405 when sessions are off)."""
+    if not session_store.enabled:
+        return Response(status_code=405, headers={"Allow": "POST"})
+    session_id = request.headers.get(SESSION_HEADER)
+    if not session_id:
+        return Response(status_code=400)
+    if not await session_store.delete(session_id, request.state.principal):
+        return Response(status_code=404)
+    return Response(status_code=204)
+
+
+def render_metrics() -> str:
+    """This worker's metrics in Prometheus text format."""
+    return (
+        metrics.render()
+        + admission.render()
+        + rate_limiter.render()
+        + session_store.render()
+        + render_caches([shared_certs, shared_claims])
+    )
+
+
+# Every gunicorn worker's metrics, labelled worker="<pid>", from whichever worker is scraped
+worker_metrics = WorkerMetrics.from_env(render_metrics)
+
+
+@app.get("/metrics", dependencies=[Depends(verify_metrics_token)])
+def metrics_endpoint() -> Response:
+    """Prometheus scrape endpoint (ID token, or METRICS_TOKEN for a scraper that cannot get one)."""
+    return Response(content=worker_metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
@@ -0,0 +1,290 @@
+"""Server-side MCP sessions: `Mcp-Session-Id` issued on initialize, kept in a bounded table.
+
+With MCP_SESSIONS=true, a successful `initialize` creates a session and
+returns its id in the `Mcp-Session-Id` response header. Clients send that id
+on later requests, and the request is then tied to the session: its
+principal, the protocolVersion, capabilities and clientInfo the client sent,
+and a small per-session cache handlers can use (`SessionStore.cache_put`).
+A request that carries an unknown or expired id, or an id that belongs to
+another principal, gets 404, which tells the client to initialize again.
+Requests without an id are still served statelessly, as before.
+DELETE /mcp with the header ends the session.
+
+Sessions live in an LRU table (an OrderedDict keyed by id). A lookup is one
+dict get and one move to the end, so it costs the same at any table size,
+and nothing is serialized or copied for it. The client's capabilities and
+clientInfo are stored as serialized bytes, so an idle session stays small.
+Three limits bound the table:
+
+- SESSION_TTL: seconds a session may stay idle. Every use restarts the
+  clock, so the least recently used session is always the first to expire.
+  Expired sessions are dropped from the front of the table as new ones are
+  added.
+- SESSION_MAX_SESSIONS: the number of sessions kept. Past it, the least
+  recently used session is evicted.
+- SESSION_MAX_BYTES: a hard cap on the estimated memory used by sessions and
+  their caches. Least recently used sessions are evicted to stay under it.
+
+With several instances (Cloud Run scales out), a client's next request may
+reach an instance that has never seen its session. Set SESSION_REDIS_URL so
+that sessions are also written to Redis (or anything that speaks its
+protocol). An instance that misses locally loads the session from there.
+Redis expiry follows the TTL and is refreshed at most every quarter TTL, not
+on every request. Per-session caches stay on the instance that built them.
+If Redis cannot be reached, the local table keeps working on its own.
+"""
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from serializer import dumps
+
+logger = logging.getLogger(__name__)
+
+HEADER = "Mcp-Session-Id"
+
+# Estimated bytes per session besides its variable-length fields (object, slots, table entry)
+SESSION_OVERHEAD = 512
+
+
+class Session:
+    """One client session; capabilities and clientInfo are kept serialized."""
+
+    __slots__ = ("id", "principal", "protocol_version", "capabilities", "client_info", "expires", "synced", "size", "cache")
+
+    def __init__(self, session_id: str, principal: str, protocol_version: str, capabilities: bytes, client_info: bytes):
+        self.id = session_id
+        self.principal = principal
+        self.protocol_version = protocol_version
+        self.capabilities = capabilities
+        self.client_info = client_info
+        self.expires = 0.0
+        # When the shared store's expiry was last pushed forward
+        self.synced = 0.0
+        self.size = SESSION_OVERHEAD + len(session_id) + len(principal) + len(capabilities) + len(client_info)
+        # Per-session cache, created on first use
+        self.cache: Optional[Dict[str, bytes]] = None
+
+
+class RedisSessions:
+    """Sessions shared through Redis hashes that expire after the session TTL."""
+
+    def __init__(self, url: str, prefix: str = "mcp:session:"):
+        import redis.asyncio  # optional dependency, only needed with SESSION_REDIS_URL
+
+        self.client = redis.asyncio.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        self.prefix = prefix
+
+    async def load(self, session_id: str) -> Optional[Session]:
+        fields = await self.client.hgetall(self.prefix + session_id)
+        if not fields:
+            return None
+        return Session(
+            session_id,
+            fields[b"principal"].decode(),
+            fields[b"protocol_version"].decode(),
+            fields[b"capabilities"],
+            fields[b"client_info"],
+        )
+
+    async def save(self, session: Session, ttl: float) -> None:
+        key = self.prefix + session.id
+        mapping = {
+            "principal": session.principal,
+            "protocol_version": session.protocol_version,
+            "capabilities": session.capabilities,
+            "client_info": session.client_info,
+        }
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping=mapping)
+            pipe.pexpire(key, int(ttl * 1000))
+            await pipe.execute()
+
+    async def touch(self, session_id: str, ttl: float) -> None:
+        await self.client.pexpire(self.prefix + session_id, int(ttl * 1000))
+
+    async def delete(self, session_id: str) -> None:
+        await self.client.delete(self.prefix + session_id)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+class SessionStore:
+    """Bounded LRU table of MCP sessions with idle TTL, an optional Redis copy, and Prometheus counters."""
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        ttl: float = 1800.0,
+        max_sessions: int = 10000,
+        max_bytes: int = 16 * 1024 * 1024,
+        shared: Optional[RedisSessions] = None,
+    ):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.bytes = 0
+        self.counts: Dict[str, int] = {"created": 0, "loaded": 0, "not_found": 0, "deleted": 0}
+        self.evicted: Dict[str, int] = {"ttl": 0, "lru": 0, "memory": 0}
+        self._table: "OrderedDict[str, Session]" = OrderedDict()
+        self._shared_error_at = 0.0
+
+    @classmethod
+    def from_env(cls) -> "SessionStore":
+        url = os.getenv("SESSION_REDIS_URL", "")
+        return cls(
+            enabled=os.getenv("MCP_SESSIONS", "false").lower() in {"1", "true", "yes"},
+            ttl=float(os.getenv("SESSION_TTL", "1800")),
+            max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "10000")),
+            max_bytes=int(os.getenv("SESSION_MAX_BYTES", str(16 * 1024 * 1024))),
+            shared=RedisSessions(url) if url else None,
+        )
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    async def create(self, principal: str, params: Dict[str, Any]) -> Session:
+        """Start a session for an `initialize` call with `params`."""
+        session = Session(
+            secrets.token_urlsafe(24),
+            principal,
+            str(params.get("protocolVersion") or ""),
+            dumps(params.get("capabilities") or {}),
+            dumps(params.get("clientInfo") or {}),
+        )
+        now = time.monotonic()
+        self._add(session, now)
+        self.counts["created"] += 1
+        if self.shared is not None:
+            try:
+                await self.shared.save(session, self.ttl)
+                session.synced = now
+            except Exception as e:
+                self._shared_failed(e)
+        return session
+
+    async def get(self, session_id: str, principal: str) -> Optional[Session]:
+        """The live session with this id for this principal, or None (answer 404)."""
+        now = time.monotonic()
+        session = self._table.get(session_id)
+        if session is not None:
+            if session.expires <= now:
+                self._remove(session)
+                self.evicted["ttl"] += 1
+                session = None
+            else:
+                self._table.move_to_end(session_id)
+                session.expires = now + self.ttl
+                if self.shared is not None and now - session.synced > self.ttl / 4:
+                    try:
+                        await self.shared.touch(session_id, self.ttl)
+                        session.synced = now
+                    except Exception as e:
+                        self._shared_failed(e)
+        elif self.shared is not None:
+            # Created on another instance
+            try:
+                session = await self.shared.load(session_id)
+            except Exception as e:
+                self._shared_failed(e)
+            if session is not None:
+                self._add(session, now)
+                self.counts["loaded"] += 1
+        if session is None or session.principal != principal:
+            self.counts["not_found"] += 1
+            return None
+        return session
+
+    async def delete(self, session_id: str, principal: str) -> bool:
+        """End a session (DELETE /mcp); False if there was no such session for this principal."""
+        session = await self.get(session_id, principal)
+        if session is None:
+            return False
+        self._remove(session)
+        self.counts["deleted"] += 1
+        if self.shared is not None:
+            try:
+                await self.shared.delete(session_id)
+            except Exception as e:
+                self._shared_failed(e)
+        return True
+
+    def cache_put(self, session: Session, key: str, value: bytes) -> None:
+        """Keep `value` in the session's cache; it counts toward SESSION_MAX_BYTES."""
+        if session.cache is None:
+            session.cache = {}
+        old = session.cache.get(key)
+        delta = len(value) - len(old) if old is not None else len(key) + len(value)
+        session.cache[key] = value
+        session.size += delta
+        if self._table.get(session.id) is session:
+            self.bytes += delta
+            self._trim(session)
+
+    def _add(self, session: Session, now: float) -> None:
+        session.expires = now + self.ttl
+        table = self._table
+        # Expired sessions are all at the front: drop them first
+        while table:
+            oldest = next(iter(table.values()))
+            if oldest.expires > now:
+                break
+            self._remove(oldest)
+            self.evicted["ttl"] += 1
+        if len(table) >= self.max_sessions:
+            self._remove(next(iter(table.values())))
+            self.evicted["lru"] += 1
+        table[session.id] = session
+        self.bytes += session.size
+        self._trim(session)
+
+    def _trim(self, keep: Session) -> None:
+        # Evict least recently used sessions (never `keep`) until under the memory cap
+        table = self._table
+        while self.bytes > self.max_bytes and len(table) > 1:
+            oldest = next(iter(table.values()))
+            if oldest is keep:
+                break
+            self._remove(oldest)
+            self.evicted["memory"] += 1
+
+    def _remove(self, session: Session) -> None:
+        del self._table[session.id]
+        self.bytes -= session.size
+
+    def _shared_failed(self, error: Exception) -> None:
+        # Keep serving from the local table; warn once a minute
+        now = time.monotonic()
+        if now - self._shared_error_at > 60:
+            self._shared_error_at = now
+            logger.warning("shared session store unavailable, using local sessions", extra={"error": str(error)})
+
+    def render(self) -> str:
+        """Prometheus text for session counts, estimated memory, lookups and evictions."""
+        lines = [
+            "# HELP mcp_sessions MCP sessions held in memory.",
+            "# TYPE mcp_sessions gauge",
+            f"mcp_sessions {len(self._table)}",
+            "# HELP mcp_session_bytes Estimated memory used by sessions and their caches.",
+            "# TYPE mcp_session_bytes gauge",
+            f"mcp_session_bytes {self.bytes}",
+            "# HELP mcp_session_events_total Sessions created, loaded from the shared store, not found and deleted.",
+            "# TYPE mcp_session_events_total counter",
+        ]
+        lines += [f'mcp_session_events_total{{event="{k}"}} {n}' for k, n in self.counts.items()]
+        lines += [
+            "# HELP mcp_session_evictions_total Sessions dropped from memory, by reason.",
+            "# TYPE mcp_session_evictions_total counter",
+        ]
+        lines += [f'mcp_session_evictions_total{{reason="{k}"}} {n}' for k, n in self.evicted.items()]
+        return "\n".join(lines) + "\n"
+
+    async def aclose(self) -> None:
+        if self.shared is not None:
+            await self.shared.aclose()
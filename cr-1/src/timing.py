@@ -0,0 +1,95 @@
+"""Per-request stage timings returned in a `Server-Timing` response header.
+
+A `ServerTiming` collects (stage, duration) pairs measured with
+`time.perf_counter()`. Handlers add stages as they finish them, e.g.
+
+    started = time.perf_counter()
+    body = loads(raw)
+    timing.since("parse", started)
+
+and the header lists them in order with a closing `total`:
+
+    Server-Timing: auth;dur=0.41, parse;dur=0.02, dispatch;dur=0.10, serialize;dur=0.01, total;dur=0.60
+
+(durations in milliseconds, as the header defines). Proxies fold the upstream
+service's header into their own with `merge()`, so the stages of both hops
+appear in one response.
+
+FastAPI apps install `ServerTimingMiddleware`, which puts a fresh
+`ServerTiming` on `request.state.timing` and adds the header when the
+response starts, including error and streaming responses. WSGI callers
+create a `ServerTiming` themselves and set `header()` on the response.
+"""
+import time
+from typing import Any, Awaitable, Callable, Dict, List, MutableMapping, Optional, Tuple
+
+HEADER = "Server-Timing"
+
+
+class ServerTiming:
+    __slots__ = ("started", "entries")
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.entries: List[Tuple[str, float]] = []
+
+    def add(self, name: str, seconds: float) -> None:
+        self.entries.append((name, seconds * 1000.0))
+
+    def since(self, name: str, started: float) -> float:
+        """Record the time elapsed since `started` as `name`; returns now, to chain stages."""
+        now = time.perf_counter()
+        self.entries.append((name, (now - started) * 1000.0))
+        return now
+
+    def merge(self, header: Optional[str], prefix: str) -> None:
+        """Append the entries of another service's Server-Timing header, names prefixed."""
+        if not header:
+            return
+        for metric in header.split(","):
+            name, *params = metric.strip().split(";")
+            if not name:
+                continue
+            for param in params:
+                key, _, value = param.strip().partition("=")
+                if key == "dur":
+                    try:
+                        self.entries.append((prefix + name, float(value)))
+                    except ValueError:
+                        pass
+                    break
+
+    def header(self) -> str:
+        total = (time.perf_counter() - self.started) * 1000.0
+        return ", ".join(f"{name};dur={ms:.2f}" for name, ms in (*self.entries, ("total", total)))
+
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware: `request.state.timing` in, `Server-Timing` header out."""
+
+    def __init__(self, app: Callable[[Scope, Receive, Send], Awaitable[None]]):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = ServerTiming()
+        state: Dict[str, Any] = scope.setdefault("state", {})
+        state["timing"] = timing
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", ()))
+                headers.append((b"server-timing", timing.header().encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
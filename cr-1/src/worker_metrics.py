@@ -0,0 +1,164 @@
+"""/metrics for every gunicorn worker, whichever worker answers the scrape.
+
+Under gunicorn (see gunicorn.conf.py) each worker process keeps its own
+counters, histograms, breakers and admission state, and a scrape of /metrics
+reaches whichever worker accepts the connection. `WorkerMetrics` lets any
+worker answer for all of them:
+
+- every sample gets a `worker="<pid>"` label, so series from different
+  workers never collide and a query sums them with `sum without (worker)`;
+- each worker writes its labelled metrics to `<dir>/<pid>.prom` every
+  METRICS_SNAPSHOT_INTERVAL seconds, and again whenever it serves a scrape;
+- `render()` merges this worker's fresh metrics with the snapshots of the
+  other live workers, one family (HELP/TYPE block) at a time, and deletes
+  snapshots left by workers that have exited.
+
+Other workers' series are at most one interval old. The directory is
+METRICS_DIR if set, otherwise a new temporary directory created at import;
+with preload_app that happens in the gunicorn master, so all workers share
+it. Without gunicorn there is a single process and `render()` returns its
+own metrics with the label added.
+"""
+import logging
+import os
+import tempfile
+import threading
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_SUFFIX = ".prom"
+
+
+def label_worker(text: str, pid: int) -> str:
+    """Prometheus text with `worker="<pid>"` added to every sample."""
+    label = f'worker="{pid}"'
+    lines = []
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            brace, space = line.find("{"), line.find(" ")
+            if 0 <= brace < space:
+                line = f"{line[:brace + 1]}{label},{line[brace + 1:]}"
+            else:
+                line = f"{line[:space]}{{{label}}}{line[space:]}"
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def merge(texts: List[str]) -> str:
+    """Prometheus texts combined so each family's HELP/TYPE appears once, followed by all its samples."""
+    headers: Dict[str, List[str]] = {}
+    samples: Dict[str, List[str]] = {}
+    for text in texts:
+        family = ""
+        for line in text.splitlines():
+            if line.startswith(("# HELP ", "# TYPE ")):
+                family = line.split(" ", 3)[2]
+                known = headers.setdefault(family, [])
+                if line not in known:
+                    known.append(line)
+            elif line and not line.startswith("#"):
+                headers.setdefault(family, [])
+                samples.setdefault(family, []).append(line)
+    lines: List[str] = []
+    for family, header in headers.items():
+        lines += header + samples.get(family, [])
+    return "\n".join(lines) + "\n"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WorkerMetrics:
+    """Each worker's metrics shared through a directory of snapshots."""
+
+    def __init__(self, render: Callable[[], str], directory: Optional[str] = None, interval: float = 5.0):
+        self._render = render
+        self.directory = directory or tempfile.mkdtemp(prefix="mcp-metrics-")
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls, render: Callable[[], str]) -> "WorkerMetrics":
+        directory = os.getenv("METRICS_DIR")
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return cls(render, directory, interval=float(os.getenv("METRICS_SNAPSHOT_INTERVAL", "5")))
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"{pid}{_SUFFIX}")
+
+    def snapshot(self) -> str:
+        """This worker's labelled metrics, also written to its snapshot file."""
+        pid = os.getpid()
+        text = label_worker(self._render(), pid)
+        path = self._path(pid)
+        try:
+            with open(path + ".tmp", "w") as f:
+                f.write(text)
+            # Readers see the old snapshot or the new one, never half of it
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.warning("metrics snapshot failed", extra={"path": path, "error": str(e)})
+        return text
+
+    def render(self) -> str:
+        """Prometheus text for this worker (fresh) and every other live worker (last snapshot)."""
+        own = os.getpid()
+        texts = [self.snapshot()]
+        try:
+            names = sorted(os.listdir(self.directory))
+        except OSError:
+            names = []
+        for name in names:
+            if not name.endswith(_SUFFIX):
+                continue
+            try:
+                pid = int(name[: -len(_SUFFIX)])
+            except ValueError:
+                continue
+            if pid == own:
+                continue
+            path = self._path(pid)
+            try:
+                if not _alive(pid):
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    texts.append(f.read())
+            except OSError:
+                continue
+        return merge(texts)
+
+    def start(self) -> None:
+        """Write a snapshot every `interval` seconds from a background thread (call in each worker)."""
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+
+        def run() -> None:
+            self.snapshot()
+            while not self._stop.wait(self.interval):
+                self.snapshot()
+
+        self._thread = threading.Thread(target=run, name="metrics-snapshots", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the snapshots and remove this worker's file."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        try:
+            os.remove(self._path(os.getpid()))
+        except OSError:
+            pass
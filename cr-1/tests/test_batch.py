@@ -0,0 +1,94 @@
+"""JSON-RPC batches on /mcp: per-entry responses in order, notifications left out, and the batch size bounds.
+
+Usage:
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import server  # noqa: E402
+
+AUTH = {"Authorization": "Bearer a@x"}
+NOTIFICATION = {"jsonrpc": "2.0", "method": "notifications/initialized"}
+
+
+def hello(msg_id, name):
+    return {"jsonrpc": "2.0", "id": msg_id, "method": "tools/call", "params": {"name": "hello", "arguments": {"name": name}}}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    async def averify(token):
+        return {"email": token}
+
+    monkeypatch.setattr(server.token_verifier, "averify", averify)
+    return TestClient(server.app)
+
+
+def test_mixed_batch(client):
+    batch = [
+        hello(1, "A"),
+        NOTIFICATION,
+        {"jsonrpc": "2.0", "id": "x", "method": "nope"},
+        5,
+        hello(3, 4),
+    ]
+    response = client.post("/mcp", json=batch, headers=AUTH)
+    assert response.status_code == 200
+    one, unknown, invalid, bad_args = response.json()
+    assert one == {"jsonrpc": "2.0", "id": 1, "result": {"message": "Hello, A!", "type": "greeting"}}
+    assert unknown["id"] == "x" and unknown["error"]["code"] == -32601
+    assert invalid == {"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "Invalid Request"}}
+    assert bad_args["id"] == 3 and bad_args["error"]["code"] == -32602
+
+
+def test_ids_echoed_as_sent(client):
+    batch = [hello("a-1", "A"), hello(2, "B"), hello(None, "C"), hello("a-1", "D")]
+    response = client.post("/mcp", json=batch, headers=AUTH)
+    assert [(r["id"], r["result"]["message"]) for r in response.json()] == [
+        ("a-1", "Hello, A!"),
+        (2, "Hello, B!"),
+        (None, "Hello, C!"),
+        ("a-1", "Hello, D!"),
+    ]
+
+
+def test_only_notifications_accepted_without_body(client):
+    response = client.post("/mcp", json=[NOTIFICATION, NOTIFICATION], headers=AUTH)
+    assert response.status_code == 202 and response.content == b""
+
+
+@pytest.mark.parametrize("size", [0, 3])
+def test_batch_size_bounds(client, monkeypatch, size):
+    monkeypatch.setattr(server, "MAX_BATCH_SIZE", 2)
+    response = client.post("/mcp", json=[hello(i, "A") for i in range(size)], headers=AUTH)
+    error = response.json()
+    assert response.status_code == 200
+    assert error["id"] is None and error["error"]["code"] == -32600
+    assert error["error"]["data"] == "batch must contain between 1 and 2 entries"
+
+
+def test_entries_run_concurrently(client, monkeypatch):
+    acall = server.registry.acall
+
+    async def slow(entry, params, timing=None):
+        await asyncio.sleep(0.1)
+        return await acall(entry, params, timing)
+
+    monkeypatch.setattr(server.registry, "acall", slow)
+    started = time.perf_counter()
+    response = client.post("/mcp", json=[hello(i, "A") for i in range(5)], headers=AUTH)
+    assert len(response.json()) == 5
+    assert time.perf_counter() - started < 0.3
+
+
+def test_batch_needs_auth(client):
+    assert client.post("/mcp", json=[hello(1, "A")]).status_code == 401
@@ -0,0 +1,103 @@
+"""Metrics: exported histogram buckets in /metrics and OTLP, the (method, tool) labels of a call, and auth on /metrics.
+
+Usage:
+    python -m pytest tests
+"""
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from metrics import BOUNDS, EXPORT_BOUNDS, UNKNOWN, Metrics, OtlpExporter, call_labels  # noqa: E402
+from registry import Registry  # noqa: E402
+import server  # noqa: E402
+
+# Calls on both sides of the 1 s and 2 s exported bounds, plus one past the last bound
+ELAPSED = [0.9, 0.95, 1.1, 1.6, 1.9, 60.0]
+
+
+def recorded() -> Metrics:
+    metrics = Metrics()
+    for elapsed in ELAPSED:
+        series = metrics.begin("tools/call", "hello")
+        # end() measures from `started`, so start that long ago
+        metrics.end(series, time.perf_counter() - elapsed)
+    return metrics
+
+
+def test_export_bounds_are_powers_of_two_and_the_last_bound():
+    assert EXPORT_BOUNDS[:3] == (2.0**-16, 2.0**-15, 2.0**-14)
+    assert EXPORT_BOUNDS[-3:] == (16.0, 32.0, BOUNDS[-1])
+    assert set(EXPORT_BOUNDS) <= set(BOUNDS)
+
+
+def test_render_merges_buckets():
+    lines = recorded().render().splitlines()
+    buckets = {
+        line.split('le="')[1].split('"')[0]: int(line.rsplit(" ", 1)[1])
+        for line in lines
+        if line.startswith("mcp_request_duration_seconds_bucket")
+    }
+    assert len(buckets) == len(EXPORT_BOUNDS) + 1
+    assert (buckets["0.5"], buckets["1.0"], buckets["2.0"], buckets["56.0"], buckets["+Inf"]) == (0, 2, 5, 5, 6)
+    assert 'mcp_request_duration_seconds_count{method="tools/call",tool="hello"} 6' in lines
+
+
+def test_otlp_uses_the_same_buckets():
+    exporter = OtlpExporter(recorded(), "http://collector/v1/metrics", "mcp-server")
+    duration = exporter.payload()["resourceMetrics"][0]["scopeMetrics"][0]["metrics"][0]
+    (point,) = duration["histogram"]["dataPoints"]
+    assert point["explicitBounds"] == list(EXPORT_BOUNDS)
+    assert len(point["bucketCounts"]) == len(EXPORT_BOUNDS) + 1
+    assert sum(int(c) for c in point["bucketCounts"]) == int(point["count"]) == len(ELAPSED)
+
+
+def test_call_labels():
+    registry = Registry()
+    registry.method("tools/call")(lambda params: None)
+    registry.method("ping")(lambda params: None)
+    registry.tool("hello", "Greets a name")(lambda arguments: None)
+    call = registry.get("tools/call")
+    assert call_labels(registry, call, {"name": "hello", "arguments": {}}) == ("tools/call", "hello")
+    assert call_labels(registry, call, {"tool": "hello", "name": "World"}) == ("tools/call", "hello")
+    assert call_labels(registry, call, {"name": "nope"}) == ("tools/call", UNKNOWN)
+    assert call_labels(registry, call, ["hello"]) == ("tools/call", UNKNOWN)
+    assert call_labels(registry, registry.get("ping"), None) == ("ping", "")
+    assert call_labels(registry, None, None) == (UNKNOWN, "")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    async def averify(token):
+        if token != "a@x":
+            raise ValueError("bad token")
+        return {"email": token}
+
+    monkeypatch.setattr(server.token_verifier, "averify", averify)
+    return TestClient(server.app)
+
+
+@pytest.mark.parametrize(
+    "metrics_token, authorization, status",
+    [
+        ("", None, 401),
+        ("", "Bearer a@x", 200),
+        ("", "Bearer other", 401),
+        ("scrape", "Bearer scrape", 200),
+        ("scrape", "Bearer a@x", 200),
+        ("scrape", "Bearer wrong", 401),
+        ("scrape", "scrape", 401),
+    ],
+)
+def test_metrics_endpoint_needs_auth(client, monkeypatch, metrics_token, authorization, status):
+    monkeypatch.setattr(server, "METRICS_TOKEN", metrics_token)
+    headers = {"Authorization": authorization} if authorization else {}
+    response = client.get("/metrics", headers=headers)
+    assert response.status_code == status
+    if status == 200:
+        assert "# TYPE mcp_requests_total counter" in response.text
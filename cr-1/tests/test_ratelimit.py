@@ -0,0 +1,191 @@
+"""Token buckets: local refill, all-or-nothing draws and eviction, and the Redis script against a stand-in.
+
+The Redis tests run the real Lua script on fakeredis (with lupa for Lua) and
+are skipped when those are not installed.
+
+Usage:
+    python -m pytest tests
+"""
+import asyncio
+import math
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import ratelimit  # noqa: E402
+from ratelimit import Limit, LocalBuckets, RateLimiter, RedisBuckets, parse_limit, parse_limits  # noqa: E402
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    return clock
+
+
+def test_parse_limit():
+    assert parse_limit("20/s") == Limit(20.0, 20.0)
+    assert parse_limit("600/m:50") == Limit(10.0, 50.0)
+    assert parse_limit("5") == Limit(5.0, 5.0)
+    assert parse_limits("a@x=1/s, *:hello=60/m:2") == {("a@x", ""): Limit(1.0, 1.0), ("*", "hello"): Limit(1.0, 2.0)}
+
+
+@pytest.mark.parametrize("spec", ["0/s", "-1/s", "5/s:0", "5/s:0.5", "5/d", "x/s"])
+def test_parse_limit_rejects(spec):
+    with pytest.raises(ValueError):
+        parse_limit(spec)
+
+
+def test_local_refill(clock):
+    buckets = LocalBuckets()
+    draw = [("k", Limit(1.0, 2.0), 2)]
+    assert buckets.take(draw) is None
+    assert buckets.take(draw) == (0, 2.0)
+    clock.now += 1
+    assert buckets.take(draw) == (0, 1.0)
+    clock.now += 1
+    assert buckets.take(draw) is None
+    # Refill stops at the burst
+    clock.now += 100
+    assert buckets.take(draw) is None
+    assert buckets.take([("k", Limit(1.0, 2.0), 1)]) == (0, 1.0)
+
+
+def test_local_all_or_nothing(clock):
+    buckets = LocalBuckets()
+    roomy, tight = ("a", Limit(1.0, 10.0), 3), ("b", Limit(1.0, 2.0), 2)
+    assert buckets.take([tight]) is None
+    assert buckets.take([roomy, tight]) == (1, 2.0)
+    # The refused batch took nothing from the first bucket
+    assert buckets.take([("a", Limit(1.0, 10.0), 10)]) is None
+
+
+def test_local_evicts_lru_at_maxsize(clock):
+    buckets = LocalBuckets(maxsize=2)
+    limit = Limit(1.0, 5.0)
+    buckets.take([("a", limit, 5)])
+    buckets.take([("b", limit, 5)])
+    buckets.take([("a", limit, 0)])  # a is now the most recently used
+    buckets.take([("c", limit, 1)])
+    assert len(buckets) == 2
+    # a kept its empty bucket; b was evicted, so it starts full again
+    assert buckets.take([("a", limit, 1)]) is not None
+    assert buckets.take([("b", limit, 5)]) is None
+
+
+def test_local_evicts_refilled_buckets(clock):
+    buckets = LocalBuckets()
+    buckets.take([("a", Limit(1.0, 2.0), 2)])
+    clock.now += 1
+    buckets.take([("b", Limit(1.0, 2.0), 1)])
+    assert len(buckets) == 2
+    # a has been idle long enough to be full again: adding c drops it
+    clock.now += 5
+    buckets.take([("c", Limit(1.0, 2.0), 1)])
+    assert len(buckets) == 2
+
+
+def test_oversized_request_refused_without_retry_after(clock):
+    limiter = RateLimiter(default=Limit(20.0, 20.0))
+    batch = [{"jsonrpc": "2.0", "id": i, "method": "ping"} for i in range(30)]
+    retry_after = asyncio.run(limiter.check("a@x", batch))
+    assert retry_after == math.inf
+    assert limiter.rejected_headers(retry_after) == {}
+    assert b"burst" in limiter.rejected_body(batch, retry_after)
+    # Nothing was taken: a request that fits is still admitted in full
+    assert asyncio.run(limiter.check("a@x", batch[:20])) is None
+    assert limiter.rejected_headers(0.2) == {"Retry-After": "1"}
+
+
+def test_draws_skip_malformed_tool_calls():
+    limiter = RateLimiter(limits={("*", "hello"): Limit(1.0, 1.0)})
+    calls = [
+        {"method": "tools/call", "params": ["hello"]},
+        {"method": "tools/call", "params": {"name": ["hello"]}},
+        {"method": "tools/call", "params": {"tool": {"x": 1}}},
+        {"method": "tools/call", "params": {"name": "hello"}},
+    ]
+    assert limiter.draws("a@x", calls) == [("{a@x}:hello", Limit(1.0, 1.0), 1)]
+
+
+class Unreachable:
+    async def take(self, draws):
+        raise ConnectionError("connection refused")
+
+    async def aclose(self) -> None:
+        pass
+
+
+def test_falls_back_to_local_buckets(clock):
+    limiter = RateLimiter(default=Limit(1.0, 2.0), shared=Unreachable())
+    assert asyncio.run(limiter.check("a@x", {"id": 1, "method": "ping"})) is None
+    assert asyncio.run(limiter.check("a@x", {"id": 2, "method": "ping"})) is None
+    assert asyncio.run(limiter.check("a@x", {"id": 3, "method": "ping"})) == 1.0
+    assert limiter.rejected == {"principal": 1, "tool": 0}
+
+
+@pytest.fixture
+def redis_buckets(monkeypatch):
+    pytest.importorskip("lupa")
+    fakeredis = pytest.importorskip("fakeredis")
+    import redis.asyncio
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.asyncio, "from_url", lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=server))
+    return RedisBuckets("redis://stand-in")
+
+
+def test_redis_take_and_refuse(redis_buckets):
+    async def run():
+        assert await redis_buckets.take([("{a}", Limit(4.0, 2.0), 2)]) is None
+        index, retry_after = await redis_buckets.take([("{a}", Limit(4.0, 2.0), 1)])
+        tokens = await redis_buckets.client.hget("mcp:ratelimit:{a}", "tokens")
+        ttl = await redis_buckets.client.pttl("mcp:ratelimit:{a}")
+        return index, retry_after, tokens, ttl
+
+    index, retry_after, tokens, ttl = asyncio.run(run())
+    assert index == 0
+    # The script returns the wait as a string, so fractions survive
+    assert isinstance(retry_after, float) and 0.2 < retry_after <= 0.25
+    assert float(tokens) < 0.1
+    # The key expires once the bucket would be full again, plus a second
+    assert 1000 < ttl <= 1500
+
+
+def test_redis_all_or_nothing(redis_buckets):
+    async def run():
+        tight = ("{a}:hello", Limit(1.0, 2.0), 2)
+        await redis_buckets.take([tight])
+        refused = await redis_buckets.take([("{a}", Limit(1.0, 10.0), 3), tight])
+        untouched = await redis_buckets.client.exists("mcp:ratelimit:{a}")
+        admitted = await redis_buckets.take([("{a}", Limit(1.0, 10.0), 10)])
+        return refused, untouched, admitted
+
+    refused, untouched, admitted = asyncio.run(run())
+    assert refused[0] == 1 and 1.9 < refused[1] <= 2.0
+    assert not untouched
+    assert admitted is None
+
+
+def test_redis_limiter_end_to_end(redis_buckets):
+    limiter = RateLimiter(default=Limit(1.0, 1.0), shared=redis_buckets)
+
+    async def run():
+        return [await limiter.check("a@x", {"id": i, "method": "ping"}) for i in range(2)]
+
+    first, second = asyncio.run(run())
+    assert first is None
+    assert 0.9 < second <= 1.0
+    # The shared store answered, so the local buckets were never used
+    assert len(limiter.local) == 0
@@ -0,0 +1,167 @@
+"""Compiled validators: error paths and messages, schemas rejected at compile time, and agreement with jsonschema.
+
+The agreement test is skipped when jsonschema is not installed.
+
+Usage:
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from registry import RpcError, Tool  # noqa: E402
+from schema import INVALID_PARAMS, SchemaError, compile_schema  # noqa: E402
+
+SEARCH = {
+    "type": "object",
+    "properties": {
+        "query": {"type": "string", "minLength": 1, "maxLength": 8},
+        "limit": {"type": "integer", "minimum": 1, "maximum": 100},
+        "sort": {"enum": ["relevance", "date"]},
+        "cursor": {"type": ["string", "null"], "pattern": "^[a-z]*$"},
+        "tags": {"type": "array", "items": {"type": "string"}, "maxItems": 3, "uniqueItems": True},
+        "filters": {"type": "array", "items": {"$ref": "#/$defs/filter"}},
+        "a/b~c": {"const": 1},
+    },
+    "required": ["query"],
+    "additionalProperties": False,
+    "$defs": {
+        "filter": {
+            "type": "object",
+            "properties": {"op": {"enum": ["eq", 1, True]}, "value": {"type": "number", "multipleOf": 0.5}},
+            "required": ["op"],
+        }
+    },
+}
+
+
+@pytest.fixture(scope="module")
+def search():
+    return compile_schema(SEARCH, "search")
+
+
+# (arguments, errors) for SEARCH
+CASES = [
+    ({"query": "ok"}, []),
+    ({}, [("/query", "is required")]),
+    ([], [("", "must be object")]),
+    ({"query": ""}, [("/query", "must be at least 1 characters")]),
+    ({"query": "x" * 9}, [("/query", "must be at most 8 characters")]),
+    ({"query": 5}, [("/query", "must be string")]),
+    ({"query": "q", "limit": 0}, [("/limit", "must be >= 1")]),
+    ({"query": "q", "limit": 2.5}, [("/limit", "must be integer")]),
+    # true is not an integer, though it is an int in Python
+    ({"query": "q", "limit": True}, [("/limit", "must be integer")]),
+    ({"query": "q", "limit": 3.0}, []),
+    ({"query": "q", "sort": "size"}, [("/sort", 'must be one of ["relevance","date"]')]),
+    ({"query": "q", "cursor": None}, []),
+    ({"query": "q", "cursor": "A1"}, [("/cursor", "must match pattern ^[a-z]*$")]),
+    ({"query": "q", "tags": ["a", 1]}, [("/tags/1", "must be string")]),
+    ({"query": "q", "tags": ["a", "a"]}, [("/tags", "must not contain duplicate items")]),
+    ({"query": "q", "tags": list("abcd")}, [("/tags", "must have at most 3 items")]),
+    ({"query": "q", "extra": 1}, [("/extra", "is not allowed")]),
+    ({"query": "q", "a/b~c": 2}, [("/a~1b~0c", "must be 1")]),
+    ({"query": "q", "a/b~c": 1.0}, []),
+    ({"query": "q", "a/b~c": True}, [("/a~1b~0c", "must be 1")]),
+    ({"query": "q", "filters": [{"op": "eq"}, {}]}, [("/filters/1/op", "is required")]),
+    ({"query": "q", "filters": [{"op": 1.0, "value": 1.5}]}, []),
+    ({"query": "q", "filters": [{"op": 1, "value": 0.3}]}, [("/filters/0/value", "must be a multiple of 0.5")]),
+    ({"query": "q", "filters": [{"op": "ne"}]}, [("/filters/0/op", 'must be one of ["eq",1,true]')]),
+    # Every error is reported, in schema order
+    ({"limit": 0, "extra": 1}, [("/query", "is required"), ("/limit", "must be >= 1"), ("/extra", "is not allowed")]),
+]
+
+
+@pytest.mark.parametrize("arguments, errors", CASES)
+def test_errors(search, arguments, errors):
+    assert search(arguments) == errors
+
+
+def test_combinators():
+    validator = compile_schema(
+        {
+            "anyOf": [{"type": "string"}, {"type": "integer"}],
+            "oneOf": [{"minimum": 0}, {"maximum": 10}],
+            "not": {"const": 5},
+        }
+    )
+    assert validator(-1) == []
+    assert validator(5) == [("", "must match exactly one schema in oneOf"), ("", "must not match the schema in not")]
+    # Bounds only apply to numbers, so null matches both oneOf branches
+    assert validator(None) == [
+        ("", "must match at least one schema in anyOf"),
+        ("", "must match exactly one schema in oneOf"),
+    ]
+
+
+def test_recursive_ref():
+    validator = compile_schema(
+        {
+            "$ref": "#/definitions/node",
+            "definitions": {
+                "node": {
+                    "type": "object",
+                    "properties": {"children": {"type": "array", "items": {"$ref": "#/definitions/node"}}},
+                    "additionalProperties": False,
+                }
+            },
+        }
+    )
+    assert validator({"children": [{"children": []}, {"children": [{}]}]}) == []
+    assert validator({"children": [{}, {"children": [{"x": 1}]}]}) == [("/children/1/children/0/x", "is not allowed")]
+
+
+def test_additional_properties_schema():
+    validator = compile_schema({"type": "object", "additionalProperties": {"type": "integer"}, "maxProperties": 2})
+    assert validator({"a": 1, "b": "2", "c": 3}) == [("/b", "must be integer"), ("", "must have at most 2 properties")]
+
+
+@pytest.mark.parametrize(
+    "schema, message",
+    [
+        ({"type": "object", "patternProperties": {}}, "unsupported keyword(s) ['patternProperties'] at #"),
+        ({"properties": {"a": {"type": "decimal"}}}, "unknown type 'decimal' at /properties/a"),
+        ({"properties": {"a": 5}}, "schema at /properties/a must be an object or a boolean"),
+        ({"$ref": "https://example.com/schema"}, "only local $ref is supported"),
+        ({"$ref": "#/$defs/missing"}, "$ref '#/$defs/missing' does not resolve"),
+        ({"items": [{"type": "string"}]}, "tuple-form items is not supported at #"),
+        ({"minimum": "1"}, "minimum must be a number at #"),
+        ({"exclusiveMaximum": True}, "exclusiveMaximum must be a number at #"),
+    ],
+)
+def test_schema_error(schema, message):
+    with pytest.raises(SchemaError) as raised:
+        compile_schema(schema)
+    assert message in str(raised.value)
+
+
+def test_boolean_schemas():
+    assert compile_schema(True)({"anything": 1}) == []
+    assert compile_schema({"properties": {"a": False}})({"a": 1}) == [("/a", "is not allowed")]
+
+
+def test_annotations_ignored():
+    validator = compile_schema({"type": "string", "format": "email", "description": "x", "examples": ["a"]})
+    assert validator("not an email") == []
+
+
+def test_tool_check_raises_invalid_params():
+    tool = Tool("search", "", SEARCH, lambda arguments: None)
+    tool.check({"query": "q"})
+    with pytest.raises(RpcError) as raised:
+        tool.check({"limit": 0})
+    error = raised.value
+    assert error.code == INVALID_PARAMS
+    assert error.message == "Invalid params: arguments/query is required (and 1 more)"
+    assert error.data == {"errors": [{"path": "/query", "message": "is required"}, {"path": "/limit", "message": "must be >= 1"}]}
+
+
+def test_agrees_with_jsonschema(search):
+    jsonschema = pytest.importorskip("jsonschema")
+    reference = jsonschema.Draft202012Validator(SEARCH)
+    for arguments, _ in CASES:
+        assert (not search(arguments)) == reference.is_valid(arguments), arguments
+        assert len(search(arguments)) == len(list(reference.iter_errors(arguments))), arguments
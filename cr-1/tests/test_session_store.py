@@ -0,0 +1,238 @@
+"""Session table limits, the Redis copy against a stand-in, and the 404 for foreign or unknown sessions.
+
+The Redis tests use fakeredis and are skipped when it is not installed.
+
+Usage:
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import session_store  # noqa: E402
+from session_store import HEADER, RedisSessions, SessionStore  # noqa: E402
+
+PARAMS = {"protocolVersion": "2025-03-26", "capabilities": {}, "clientInfo": {"name": "test"}}
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_store.time, "monotonic", clock)
+    return clock
+
+
+def test_create_get_delete(clock):
+    store = SessionStore(enabled=True)
+
+    async def run():
+        session = await store.create("a@x", PARAMS)
+        found = await store.get(session.id, "a@x")
+        deleted = await store.delete(session.id, "a@x")
+        return session, found, deleted, await store.get(session.id, "a@x"), await store.delete(session.id, "a@x")
+
+    session, found, deleted, after, deleted_again = asyncio.run(run())
+    assert found is session
+    assert session.protocol_version == "2025-03-26" and session.client_info == b'{"name":"test"}'
+    assert deleted and after is None and not deleted_again
+    assert len(store) == 0 and store.bytes == 0
+    assert store.counts == {"created": 1, "loaded": 0, "not_found": 2, "deleted": 1}
+
+
+def test_foreign_principal_not_found(clock):
+    store = SessionStore(enabled=True)
+
+    async def run():
+        session = await store.create("a@x", PARAMS)
+        return session, await store.get(session.id, "b@x"), await store.delete(session.id, "b@x")
+
+    session, foreign, deleted = asyncio.run(run())
+    assert foreign is None and not deleted
+    # The owner's session is untouched
+    assert asyncio.run(store.get(session.id, "a@x")) is session
+
+
+def test_idle_ttl(clock):
+    store = SessionStore(enabled=True, ttl=60)
+    session = asyncio.run(store.create("a@x", PARAMS))
+    # Each use restarts the clock
+    for _ in range(3):
+        clock.now += 50
+        assert asyncio.run(store.get(session.id, "a@x")) is session
+    clock.now += 60
+    assert asyncio.run(store.get(session.id, "a@x")) is None
+    assert store.evicted["ttl"] == 1 and len(store) == 0
+
+
+def test_expired_sessions_dropped_on_create(clock):
+    store = SessionStore(enabled=True, ttl=60)
+    asyncio.run(store.create("a@x", PARAMS))
+    asyncio.run(store.create("a@x", PARAMS))
+    clock.now += 61
+    asyncio.run(store.create("a@x", PARAMS))
+    assert len(store) == 1 and store.evicted["ttl"] == 2
+
+
+def test_lru_eviction(clock):
+    store = SessionStore(enabled=True, max_sessions=2)
+
+    async def run():
+        a = await store.create("a@x", PARAMS)
+        b = await store.create("a@x", PARAMS)
+        await store.get(a.id, "a@x")
+        c = await store.create("a@x", PARAMS)
+        return [await store.get(s.id, "a@x") is s for s in (a, b, c)]
+
+    assert asyncio.run(run()) == [True, False, True]
+    assert store.evicted["lru"] == 1
+
+
+def test_byte_cap_eviction(clock):
+    size = asyncio.run(SessionStore(enabled=True).create("a@x", PARAMS)).size
+    store = SessionStore(enabled=True, max_bytes=int(size * 2.5))
+
+    async def run():
+        a = await store.create("a@x", PARAMS)
+        b = await store.create("a@x", PARAMS)
+        c = await store.create("a@x", PARAMS)
+        first = [await store.get(s.id, "a@x") is s for s in (a, b, c)]
+        # A large cache entry evicts other sessions, never the one it belongs to
+        store.cache_put(c, "tools", b"x" * size)
+        second = [await store.get(s.id, "a@x") is s for s in (b, c)]
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == [False, True, True]
+    assert second == [False, True]
+    assert store.evicted["memory"] == 2
+    assert store.bytes <= store.max_bytes
+
+
+@pytest.fixture
+def redis_sessions(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    import redis.asyncio
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.asyncio, "from_url", lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=server))
+    # Each call is a separate instance sharing the one Redis
+    return lambda: RedisSessions("redis://stand-in")
+
+
+def test_redis_shared_across_instances(clock, redis_sessions):
+    here = SessionStore(enabled=True, ttl=60, shared=redis_sessions())
+    there = SessionStore(enabled=True, ttl=60, shared=redis_sessions())
+
+    async def run():
+        session = await here.create("a@x", PARAMS)
+        key = "mcp:session:" + session.id
+        fields = await here.shared.client.hgetall(key)
+        ttl = await here.shared.client.pttl(key)
+        foreign = await there.get(session.id, "b@x")
+        loaded = await there.get(session.id, "a@x")
+        deleted = await there.delete(session.id, "a@x")
+        exists = await here.shared.client.exists(key)
+        return session, fields, ttl, foreign, loaded, deleted, exists
+
+    session, fields, ttl, foreign, loaded, deleted, exists = asyncio.run(run())
+    assert fields[b"principal"] == b"a@x" and fields[b"client_info"] == b'{"name":"test"}'
+    assert 59000 < ttl <= 60000
+    assert foreign is None
+    assert loaded is not None and loaded.id == session.id and loaded.capabilities == session.capabilities
+    assert there.counts["loaded"] == 1
+    assert deleted and not exists
+
+
+def test_redis_expiry_refreshed_at_most_every_quarter_ttl(clock, redis_sessions):
+    store = SessionStore(enabled=True, ttl=60, shared=redis_sessions())
+
+    async def run():
+        session = await store.create("a@x", PARAMS)
+        key = "mcp:session:" + session.id
+        await store.shared.client.pexpire(key, 1000)
+        clock.now += 10
+        await store.get(session.id, "a@x")
+        early = await store.shared.client.pttl(key)
+        clock.now += 10
+        await store.get(session.id, "a@x")
+        late = await store.shared.client.pttl(key)
+        return early, late
+
+    early, late = asyncio.run(run())
+    assert early <= 1000
+    assert 59000 < late <= 60000
+
+
+def test_redis_expired_session_not_loaded(clock, redis_sessions):
+    here = SessionStore(enabled=True, ttl=60, shared=redis_sessions())
+    there = SessionStore(enabled=True, ttl=60, shared=redis_sessions())
+
+    async def run():
+        session = await here.create("a@x", PARAMS)
+        await here.shared.client.delete("mcp:session:" + session.id)
+        return await there.get(session.id, "a@x")
+
+    assert asyncio.run(run()) is None
+    assert there.counts["not_found"] == 1
+
+
+class Unreachable:
+    async def load(self, *args):
+        raise ConnectionError("connection refused")
+
+    save = touch = delete = load
+
+    async def aclose(self) -> None:
+        pass
+
+
+def test_falls_back_to_local_table(clock):
+    store = SessionStore(enabled=True, ttl=60, shared=Unreachable())
+
+    async def run():
+        session = await store.create("a@x", PARAMS)
+        clock.now += 30
+        found = await store.get(session.id, "a@x")
+        missing = await store.get("unknown", "a@x")
+        deleted = await store.delete(session.id, "a@x")
+        return session, found, missing, deleted
+
+    session, found, missing, deleted = asyncio.run(run())
+    assert found is session and missing is None and deleted
+
+
+def test_http_session_lifecycle(monkeypatch):
+    import server
+    from fastapi.testclient import TestClient
+
+    async def averify(token):
+        return {"email": token}
+
+    monkeypatch.setattr(server.token_verifier, "averify", averify)
+    monkeypatch.setattr(server, "session_store", SessionStore(enabled=True))
+    client = TestClient(server.app)
+    initialize = {"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": PARAMS}
+    ping = {"jsonrpc": "2.0", "id": 2, "method": "ping"}
+
+    response = client.post("/mcp", json=initialize, headers={"Authorization": "Bearer a@x"})
+    session_id = response.headers[HEADER]
+    owner = {"Authorization": "Bearer a@x", HEADER: session_id}
+    stranger = {"Authorization": "Bearer b@x", HEADER: session_id}
+
+    assert client.post("/mcp", json=ping, headers=owner).status_code == 200
+    assert client.post("/mcp", json=ping, headers=stranger).status_code == 404
+    assert client.delete("/mcp", headers=stranger).status_code == 404
+    assert client.delete("/mcp", headers=owner).status_code == 204
+    assert client.post("/mcp", json=ping, headers=owner).status_code == 404
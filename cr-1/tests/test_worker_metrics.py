@@ -0,0 +1,90 @@
+"""Per-worker /metrics: the worker label, merging families across workers, and snapshots of exited workers.
+
+Usage:
+    python -m pytest tests
+"""
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from worker_metrics import WorkerMetrics, label_worker, merge  # noqa: E402
+
+TEXT = """# HELP mcp_requests_total Requests.
+# TYPE mcp_requests_total counter
+mcp_requests_total{method="tools/call"} 3
+# HELP mcp_in_flight Requests in flight.
+# TYPE mcp_in_flight gauge
+mcp_in_flight 1
+"""
+
+
+def test_label_worker():
+    assert label_worker(TEXT, 42).splitlines() == [
+        "# HELP mcp_requests_total Requests.",
+        "# TYPE mcp_requests_total counter",
+        'mcp_requests_total{worker="42",method="tools/call"} 3',
+        "# HELP mcp_in_flight Requests in flight.",
+        "# TYPE mcp_in_flight gauge",
+        'mcp_in_flight{worker="42"} 1',
+    ]
+
+
+def test_merge_keeps_families_together():
+    merged = merge([label_worker(TEXT, 1), label_worker(TEXT, 2)]).splitlines()
+    assert merged == [
+        "# HELP mcp_requests_total Requests.",
+        "# TYPE mcp_requests_total counter",
+        'mcp_requests_total{worker="1",method="tools/call"} 3',
+        'mcp_requests_total{worker="2",method="tools/call"} 3',
+        "# HELP mcp_in_flight Requests in flight.",
+        "# TYPE mcp_in_flight gauge",
+        'mcp_in_flight{worker="1"} 1',
+        'mcp_in_flight{worker="2"} 1',
+    ]
+
+
+def test_render_includes_other_live_workers(tmp_path):
+    # The test runner's parent process stands in for another live worker
+    other = os.getppid()
+    (tmp_path / f"{other}.prom").write_text(label_worker(TEXT, other))
+    own = WorkerMetrics(lambda: TEXT, str(tmp_path))
+    rendered = own.render()
+    assert f'mcp_in_flight{{worker="{os.getpid()}"}} 1' in rendered
+    assert f'mcp_in_flight{{worker="{other}"}} 1' in rendered
+    assert rendered.count("# TYPE mcp_in_flight gauge") == 1
+    assert (tmp_path / f"{os.getpid()}.prom").exists()
+
+
+def test_exited_worker_snapshot_removed(tmp_path):
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    (tmp_path / f"{exited.pid}.prom").write_text(label_worker(TEXT, exited.pid))
+    rendered = WorkerMetrics(lambda: TEXT, str(tmp_path)).render()
+    assert f'worker="{exited.pid}"' not in rendered
+    assert not (tmp_path / f"{exited.pid}.prom").exists()
+
+
+def test_snapshot_is_fresh_on_every_render(tmp_path):
+    counts = []
+    metrics = WorkerMetrics(lambda: f"# TYPE n counter\nn {len(counts)}\n", str(tmp_path))
+    counts.append(1)
+    assert f'n{{worker="{os.getpid()}"}} 1' in metrics.render()
+
+
+def test_stop_removes_own_snapshot(tmp_path):
+    metrics = WorkerMetrics(lambda: TEXT, str(tmp_path), interval=0.01)
+    metrics.start()
+    metrics.render()
+    metrics.stop()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_from_env(monkeypatch, tmp_path):
+    directory = tmp_path / "metrics"
+    monkeypatch.setenv("METRICS_DIR", str(directory))
+    monkeypatch.setenv("METRICS_SNAPSHOT_INTERVAL", "2")
+    metrics = WorkerMetrics.from_env(lambda: TEXT)
+    assert metrics.directory == str(directory) and directory.is_dir()
+    assert metrics.interval == 2.0
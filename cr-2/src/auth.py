@@ -0,0 +1,159 @@
+"""Per-audience cache of minted Google ID tokens.
+
+Minting an ID token (`google.oauth2.id_token.fetch_id_token`) is a round trip to
+the metadata server or the OAuth endpoint. Tokens are valid for an hour, so
+`IdTokenCache` keeps one per audience and refreshes it in a background thread
+once it gets within `refresh_margin` seconds of `exp`. Callers only block when
+there is no usable token at all; `aget` does that blocking mint in a worker
+thread so async handlers never stall the event loop.
+
+With a `SharedCache` (shared_cache.py), the gunicorn workers of one instance
+share the tokens: a worker whose token is missing or due for refresh first
+takes a newer one another worker minted, and only mints if there is none.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from shared_cache import SharedCache
+
+logger = logging.getLogger(__name__)
+
+# Refresh this many seconds before the token's exp
+DEFAULT_REFRESH_MARGIN = 300
+
+# Treat tokens this close to exp as unusable
+EXPIRY_SKEW = 30
+
+# mint(audience) -> encoded ID token
+TokenMinter = Callable[[str], str]
+
+
+def google_token_minter() -> TokenMinter:
+    """Build a minter that reuses one google-auth transport (and its session)."""
+    import google.auth.transport.requests
+    import google.oauth2.id_token
+
+    auth_req = google.auth.transport.requests.Request()
+
+    def mint(audience: str) -> str:
+        return google.oauth2.id_token.fetch_id_token(auth_req, audience)
+
+    return mint
+
+
+def token_expiry(token: str) -> float:
+    """Return the token's `exp` claim (no signature check; we minted it)."""
+    from google.auth import jwt
+
+    claims = jwt.decode(token, verify=False)
+    return float(claims["exp"])
+
+
+class IdTokenCache:
+    """ID tokens keyed by audience, refreshed ahead of expiry."""
+
+    def __init__(
+        self,
+        mint: Optional[TokenMinter] = None,
+        refresh_margin: int = DEFAULT_REFRESH_MARGIN,
+        shared: Optional[SharedCache] = None,
+    ):
+        self._mint = mint
+        self.refresh_margin = refresh_margin
+        self.shared = shared
+        self._tokens: Dict[str, Tuple[str, float]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._refreshing: Dict[str, bool] = {}
+        self._guard = threading.Lock()
+
+    def get(self, audience: str) -> str:
+        """Return a valid token for `audience`, minting only if none is usable."""
+        token = self._cached(audience)
+        if token is not None:
+            return token
+
+        with self._lock_for(audience):
+            # Another caller (or worker) may have minted while we waited
+            entry = self._entry(audience)
+            if entry is not None and time.time() < entry[1] - EXPIRY_SKEW:
+                return entry[0]
+            return self._refresh(audience)
+
+    async def aget(self, audience: str) -> str:
+        """Async `get`: cache hits return immediately, mints run off the event loop."""
+        token = self._cached(audience)
+        if token is not None:
+            return token
+        return await asyncio.to_thread(self.get, audience)
+
+    def _entry(self, audience: str) -> Optional[Tuple[str, float]]:
+        """This worker's token, replaced by a newer shared one once it is due for refresh."""
+        entry = self._tokens.get(audience)
+        if self.shared is None or (entry is not None and time.time() < entry[1] - self.refresh_margin):
+            return entry
+        raw = self.shared.get(audience.encode())
+        if raw is not None:
+            token, exp = json.loads(raw)
+            if entry is None or exp > entry[1]:
+                entry = self._tokens[audience] = (token, exp)
+        return entry
+
+    def _cached(self, audience: str) -> Optional[str]:
+        entry = self._entry(audience)
+        if entry is None:
+            return None
+        token, exp = entry
+        now = time.time()
+        if now < exp - self.refresh_margin:
+            return token
+        if now < exp - EXPIRY_SKEW:
+            self._refresh_in_background(audience)
+            return token
+        return None
+
+    def invalidate(self, audience: str) -> None:
+        self._tokens.pop(audience, None)
+        if self.shared is not None:
+            self.shared.delete(audience.encode())
+
+    def _refresh(self, audience: str) -> str:
+        if self._mint is None:
+            self._mint = google_token_minter()
+        token = self._mint(audience)
+        exp = token_expiry(token)
+        self._tokens[audience] = (token, exp)
+        if self.shared is not None:
+            self.shared.put(audience.encode(), json.dumps([token, exp]).encode(), exp)
+        return token
+
+    def _refresh_in_background(self, audience: str) -> None:
+        with self._guard:
+            if self._refreshing.get(audience):
+                return
+            self._refreshing[audience] = True
+
+        def run() -> None:
+            try:
+                with self._lock_for(audience):
+                    # Skip the mint if another worker already refreshed the token
+                    entry = self._entry(audience)
+                    if entry is None or time.time() >= entry[1] - self.refresh_margin:
+                        self._refresh(audience)
+            except Exception as e:
+                # The current token is still valid; the next call will retry
+                logger.warning("background token refresh failed", extra={"audience": audience, "error": str(e)})
+            finally:
+                self._refreshing[audience] = False
+
+        threading.Thread(target=run, name="id-token-refresh", daemon=True).start()
+
+    def _lock_for(self, audience: str) -> threading.Lock:
+        lock = self._locks.get(audience)
+        if lock is None:
+            with self._guard:
+                lock = self._locks.setdefault(audience, threading.Lock())
+        return lock
@@ -0,0 +1,189 @@
+"""Micro-batching: concurrent JSON-RPC calls share one upstream batch POST.
+
+`MicroBatcher.call(group, message, traceparent)` queues a JSON-RPC request
+and blocks until its response arrives. A collector thread takes the first
+queued call, keeps collecting for UPSTREAM_BATCH_WINDOW_MS or until it has
+UPSTREAM_BATCH_MAX_SIZE calls, then sends each group's calls as one JSON-RPC
+batch on a small pool of sender threads (a lone call goes as a plain
+request). Calls are grouped by whatever has to match to share a POST; the
+proxy uses the Authorization header.
+
+In a batch, requests are renumbered by their position so callers' ids cannot
+clash, and each caller gets its own response back under its own id.
+Notifications are sent as they are; the server answers nothing for them, so
+their callers get None as the JSON-RPC response. If the server answers with
+something other than an array (an HTTP error, or one error object for the
+whole batch such as a rate-limit rejection), every caller gets that answer.
+
+A call waits at most the window before it is sent. That bounded delay buys
+one upstream request (one TLS stream, one Cloud Run request) per batch
+instead of one per call. UPSTREAM_BATCH_WINDOW_MS=0, the default, turns
+batching off. Keep UPSTREAM_BATCH_MAX_SIZE within the server's
+MCP_MAX_BATCH_SIZE.
+"""
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import httpx
+
+# send(group, body, traceparent) -> response; body is one message or a list of them
+SendBatch = Callable[[Hashable, Any, Optional[str]], httpx.Response]
+
+# JSON-RPC internal error, for a call the server left out of its batch response
+INTERNAL_ERROR = -32603
+
+
+class _Pending:
+    __slots__ = ("group", "message", "traceparent", "future")
+
+    def __init__(self, group: Hashable, message: Dict[str, Any], traceparent: Optional[str]):
+        self.group = group
+        self.message = message
+        self.traceparent = traceparent
+        self.future: "concurrent.futures.Future[Tuple[httpx.Response, Any]]" = concurrent.futures.Future()
+
+
+class MicroBatcher:
+    """Collects concurrent calls for up to `window` seconds and sends them as JSON-RPC batches."""
+
+    def __init__(self, name: str, send: SendBatch, window: float = 0.0, max_size: int = 20, senders: int = 8):
+        self.name = name
+        self.send = send
+        self.window = window
+        self.max_size = max_size
+        self.senders = senders
+        self.counts: Dict[str, int] = {"calls": 0, "requests": 0}
+        self._queue: "queue.Queue[Optional[_Pending]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name: str, send: SendBatch) -> "MicroBatcher":
+        return cls(
+            name,
+            send,
+            window=float(os.getenv("UPSTREAM_BATCH_WINDOW_MS", "0")) / 1000,
+            max_size=int(os.getenv("UPSTREAM_BATCH_MAX_SIZE", "20")),
+            senders=int(os.getenv("UPSTREAM_BATCH_SENDERS", "8")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def call(
+        self, group: Hashable, message: Dict[str, Any], traceparent: Optional[str] = None
+    ) -> Tuple[httpx.Response, Any]:
+        """Send `message` in the next batch for `group`.
+
+        Returns the HTTP response and this message's JSON-RPC response (None if the body was not JSON,
+        or if `message` is a notification sent in a batch).
+        """
+        self.start()
+        pending = _Pending(group, message, traceparent)
+        self._queue.put(pending)
+        return pending.future.result()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(self.senders, thread_name_prefix="batch-send")
+                self._thread = threading.Thread(target=self._run, name="batch-collector", daemon=True)
+                self._thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+            self._thread = None
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                return
+            groups: Dict[Hashable, List[_Pending]] = {first.group: [first]}
+            collected = 1
+            deadline = time.monotonic() + self.window
+            while collected < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Send what was collected, then stop
+                    stopping = True
+                    break
+                groups.setdefault(item.group, []).append(item)
+                collected += 1
+            assert self._executor is not None
+            self.counts["calls"] += collected
+            self.counts["requests"] += len(groups)
+            for group, items in groups.items():
+                self._executor.submit(self._flush, group, items)
+
+    def _flush(self, group: Hashable, items: List[_Pending]) -> None:
+        try:
+            if len(items) == 1:
+                body: Any = items[0].message
+            else:
+                body = [
+                    {**item.message, "id": index} if "id" in item.message else item.message
+                    for index, item in enumerate(items)
+                ]
+            response = self.send(group, body, items[0].traceparent)
+            self._deliver(items, response)
+        except BaseException as e:
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(e)
+
+    @staticmethod
+    def _deliver(items: List[_Pending], response: httpx.Response) -> None:
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        if len(items) == 1 or not isinstance(data, list):
+            for item in items:
+                item.future.set_result((response, data))
+            return
+        by_id = {entry.get("id"): entry for entry in data if isinstance(entry, dict)}
+        for index, item in enumerate(items):
+            if "id" not in item.message:
+                item.future.set_result((response, None))
+                continue
+            entry = by_id.get(index)
+            if entry is None:
+                error = {"code": INTERNAL_ERROR, "message": "No response for this call in the upstream batch"}
+                entry = {"jsonrpc": "2.0", "error": error}
+            item.future.set_result((response, {**entry, "id": item.message.get("id")}))
+
+    def render(self) -> str:
+        """Prometheus text for calls batched and the upstream requests that carried them."""
+        label = f'upstream="{self.name}"'
+        lines = [
+            "# HELP mcp_upstream_batched_calls_total Calls sent through the micro-batcher.",
+            "# TYPE mcp_upstream_batched_calls_total counter",
+            f"mcp_upstream_batched_calls_total{{{label}}} {self.counts['calls']}",
+            "# HELP mcp_upstream_batch_requests_total Upstream requests that carried them.",
+            "# TYPE mcp_upstream_batch_requests_total counter",
+            f"mcp_upstream_batch_requests_total{{{label}}} {self.counts['requests']}",
+        ]
+        return "\n".join(lines) + "\n"
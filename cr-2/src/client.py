@@ -1,48 +1,231 @@
-from typing import Any
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Hashable, Optional
+import asyncio
 import os
+import time
 import httpx
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response
+import math
 import uuid
 
-# Initialize FastAPI app that will act as a proxy
-app = FastAPI(title="hello-client")
+import logs
+from auth import IdTokenCache
+from balancer import Balancer
+from batching import MicroBatcher
+from hedging import Hedger
+from resilience import PROMETHEUS_CONTENT_TYPE, CircuitOpenError, Upstream, is_idempotent
+from sessions import SessionManager
+from shared_cache import SharedCache, render_caches
+from singleflight import SingleFlight, call_key
+from timing import ServerTiming, ServerTimingMiddleware
+from tracing import CLIENT, TRACEPARENT, BatchSpanExporter, Tracer, TracingMiddleware
+from warmup import warm_up
+from worker_metrics import WorkerMetrics
+
+# JSON logs to stdout through a background writer (see logs.py)
+logger = logs.setup("mcp-client-2")
 
 # Cloud Run server URL (fallback to local for development)
 SERVER_URL = os.getenv("SERVER_URL", "https://mcp-hello-456052106337.us-central1.run.app")
 
+# Server endpoints to balance across (e.g. one per region), comma-separated; defaults to SERVER_URL
+balancer = Balancer.from_env(os.getenv("SERVER_URLS", SERVER_URL))
+
+# ID token audience; with several endpoints, every server's AUTH_AUDIENCE must be set to this
+AUTH_AUDIENCE = os.getenv("AUTH_AUDIENCE", balancer.endpoints[0].url)
+
+# Minted ID tokens are reused per audience and refreshed in the background before exp.
+# They are shared by the gunicorn workers of an instance (see shared_cache.py)
+shared_tokens = SharedCache("id_tokens", slots=16, slot_size=4096)
+token_cache = IdTokenCache(refresh_margin=int(os.getenv("TOKEN_REFRESH_MARGIN", "300")), shared=shared_tokens)
+
+# Upstream calls carry a W3C traceparent; spans are batch-exported if OTLP or TRACE_EXPORT_FILE is set
+span_exporter = BatchSpanExporter.from_env("mcp-client-2")
+tracer = Tracer(span_exporter, float(os.getenv("OTEL_TRACES_SAMPLER_ARG", "1.0")))
+
+# Per-attempt timeouts, budgeted retries and a circuit breaker around every upstream call
+upstream = Upstream.from_env("server")
+
+# Optional hedging of slow idempotent MCP calls (HEDGE_PERCENTILE or HEDGE_DELAY_MS, see hedging.py)
+hedger = Hedger.from_env("server")
+
+# Identical idempotent calls in flight at once share one upstream call (SINGLE_FLIGHT=false to disable)
+single_flight = SingleFlight.from_env("server")
+
+# Long-lived pooled client (keep-alive + HTTP/2), created at startup and closed on shutdown
+http_client: Optional[httpx.Client] = None
+
+
+def create_http_client() -> httpx.Client:
+    return httpx.Client(
+        http2=True,
+        timeout=httpx.Timeout(float(os.getenv("UPSTREAM_TIMEOUT", "30"))),
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60")),
+        ),
+    )
+
+
+def get_http_client() -> httpx.Client:
+    global http_client
+    if http_client is None:
+        http_client = create_http_client()
+    return http_client
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_http_client()
+    if span_exporter is not None:
+        span_exporter.start()
+    balancer.start(probe_server)
+    worker_metrics.start()
+    # The ID token, connections and MCP sessions are ready before the first request needs them
+    await warm_up({"upstream": lambda: asyncio.to_thread(warm_upstream)})
+    yield
+    balancer.stop()
+    batcher.stop()
+    worker_metrics.stop()
+    global http_client
+    if http_client is not None:
+        http_client.close()
+        http_client = None
+    hedger.shutdown()
+    if span_exporter is not None:
+        span_exporter.stop()
+
+
+# Initialize FastAPI app that will act as a proxy
+app = FastAPI(title="hello-client", lifespan=lifespan)
+
+# token/upstream stages plus the upstream server's own stages in a Server-Timing header
+app.add_middleware(ServerTimingMiddleware)
+
+# One server span per request; upstream calls are client spans under it
+app.add_middleware(TracingMiddleware, tracer=tracer)
+
 def get_auth_token() -> str:
     """Get ID token for authenticating with the server."""
-    import google.auth.transport.requests
-    import google.oauth2.id_token
+    return token_cache.get(AUTH_AUDIENCE)
+
+
+def probe_server(base_url: str) -> httpx.Response:
+    """Balancer health probe: a JSON-RPC ping to one endpoint (any answer below 500 means it is up)."""
+    headers = {}
+    try:
+        headers["Authorization"] = f"Bearer {get_auth_token()}"
+    except Exception:
+        pass  # an unauthenticated ping still gets a 401, which shows the endpoint is reachable
+    payload = {"jsonrpc": "2.0", "id": "probe", "method": "ping"}
+    return get_http_client().post(f"{base_url}/mcp", json=payload, headers=headers, timeout=upstream.attempt_timeout)
+
+
+def post_mcp(base_url: str, body: Any, headers: dict[str, str], timeout: float) -> httpx.Response:
+    """POST a JSON-RPC message or batch to one endpoint's /mcp."""
+    return get_http_client().post(f"{base_url}/mcp", json=body, headers=headers, timeout=timeout)
+
+
+# One MCP session (initialize, tools/list, Mcp-Session-Id) per endpoint, reused by every call (see sessions.py)
+sessions = SessionManager.from_env("server", post_mcp, "mcp-client-2")
+
+
+def warm_upstream() -> None:
+    """Mint the ID token, then open a connection and an MCP session on every endpoint."""
+    headers = {"Authorization": f"Bearer {get_auth_token()}"}
+    failed = [
+        e.url for e in balancer.endpoints if sessions.session(e.url, headers, upstream.attempt_timeout)[0] is None
+    ]
+    if failed:
+        raise RuntimeError(f"MCP initialize failed on {', '.join(failed)}")
+
+
+def send_batch(authorization: str, body: Any, traceparent: Optional[str]) -> httpx.Response:
+    """POST one JSON-RPC message or batch collected by `batcher`, as a CLIENT span under the first caller's."""
+    messages = body if isinstance(body, list) else [body]
+    idempotent = all(is_idempotent(m["method"], (m.get("params") or {}).get("tool")) for m in messages)
+    headers = {"Content-Type": "application/json"}
+    if authorization:
+        headers["Authorization"] = authorization
+    with tracer.span(
+        "POST /mcp", CLIENT, traceparent, attributes={"http.method": "POST", "rpc.batch_size": len(messages)}
+    ) as span:
+        headers[TRACEPARENT] = span.traceparent()
+        response = upstream.call(
+            lambda timeout: balancer.call(lambda base_url: sessions.request(base_url, body, headers, timeout)),
+            idempotent=idempotent,
+        )
+        span.set("http.url", str(response.request.url))
+        span.set("http.status_code", response.status_code)
+    return response
+
+
+# Concurrent MCP calls packed into one JSON-RPC batch POST (UPSTREAM_BATCH_WINDOW_MS, see batching.py)
+batcher = MicroBatcher.from_env("server", send_batch)
 
-    auth_req = google.auth.transport.requests.Request()
-    target_audience = SERVER_URL
-    return google.oauth2.id_token.fetch_id_token(auth_req, target_audience)
 
-def call_hello_server(name: str, enable_auth: bool = False) -> dict:
-    """Call the hello server endpoint with optional authentication."""
-    url = f"{SERVER_URL}/hello?name={name}"
-    print(f"Calling server at: {url}")  # Debug print
+def coalesced(key: Hashable, idempotent: bool, fn: Callable[[], Any], timing: ServerTiming) -> Any:
+    """Run `fn()`, or share the result of an identical call in flight if the call is idempotent.
+
+    A caller that joined another's call gets a "coalesced" stage for its wait.
+    """
+    if not idempotent:
+        return fn()
+    started = time.perf_counter()
+    result, shared = single_flight.do(key, fn)
+    if shared:
+        timing.since("coalesced", started)
+    return result
+
+def call_hello_server(name: str, enable_auth: bool = False, timing: Optional[ServerTiming] = None) -> dict:
+    """Call the hello server endpoint with optional authentication.
+
+    The token mint and the HTTP call are added to `timing` as the "token" and
+    "upstream" stages, followed by the server's own stages ("upstream-*").
+    The HTTP call is a CLIENT span whose traceparent is sent upstream, and
+    goes through `upstream` (retries, retry budget, circuit breaker); each
+    attempt is sent to the endpoint `balancer` picks.
+    """
+    timing = timing or ServerTiming()
+    path = f"/hello?name={name}"
+    logger.info("calling hello server", extra={"route": "/api/v1/proxy_hello", "path": path})
     
     headers = {}
     if enable_auth:
         # Generate new token if enable_auth is True
+        started = time.perf_counter()
         try:
             id_token = get_auth_token()
-            print(f"\n[MCP-CLIENT-2] Auth Token: {id_token}\n")  # Print the token with service identifier
             headers = {"Authorization": f"Bearer {id_token}"}
         except Exception as e:
-            print(f"[MCP-CLIENT-2] Failed to get auth token: {e}")
+            logger.warning("failed to get auth token", extra={"audience": AUTH_AUDIENCE, "error": str(e)})
+        timing.since("token", started)
     
-    with httpx.Client() as client:
-        try:
-            response = client.get(url, headers=headers)
+    client = get_http_client()
+    started = time.perf_counter()
+    try:
+        with tracer.span("GET /hello", CLIENT, attributes={"http.method": "GET"}) as span:
+            headers[TRACEPARENT] = span.traceparent()
+            response = upstream.call(
+                lambda timeout: balancer.call(
+                    lambda base_url: client.get(base_url + path, headers=headers, timeout=timeout)
+                ),
+                idempotent=True,
+            )
+            span.set("http.url", str(response.request.url))
+            span.set("http.status_code", response.status_code)
+            timing.since("upstream", started)
+            timing.merge(response.headers.get("server-timing"), "upstream-")
             response.raise_for_status()
-            return response.json()
-        except httpx.HTTPError as e:
-            print(f"HTTP error occurred: {e}")  # Debug print
-            print(f"Response text: {e.response.text if hasattr(e, 'response') else 'No response'}")  # Debug print
-            raise
+        return response.json()
+    except httpx.HTTPError as e:
+        logger.warning(
+            "hello server http error",
+            extra={"error": str(e), "response_text": e.response.text if hasattr(e, "response") else None},
+        )
+        raise
 
 from fastapi import APIRouter
 
@@ -55,21 +238,37 @@ class NameRequest(BaseModel):
     enable_auth: bool = False
 
 @router.post("/proxy_hello")
-def proxy_hello(request: NameRequest) -> dict[str, Any]:
+def proxy_hello(request: NameRequest, http_request: Request) -> dict[str, Any]:
     """
     A proxy endpoint that connects to the hello server and returns its response.
     
     Args:
         request: The request body containing the name and authentication flag
     """
-    print(f"Received request with name: {request.name}, auth enabled: {request.enable_auth}")  # Debug print
+    logger.info(
+        "proxy_hello request",
+        extra={"route": "/api/v1/proxy_hello", "request_name": request.name, "enable_auth": request.enable_auth},
+    )
     try:
-        result = call_hello_server(request.name, request.enable_auth)
-        print(f"Got result from server: {result}")  # Debug print
+        timing = http_request.state.timing
+        result = coalesced(
+            call_key("GET /hello", None, {"name": request.name, "enable_auth": request.enable_auth}),
+            True,
+            lambda: call_hello_server(request.name, request.enable_auth, timing),
+            timing,
+        )
+        logger.debug("hello server result", extra={"route": "/api/v1/proxy_hello", "result": result})
         return {
             "proxied_message": result["message"],
             "proxy_info": "Called through client proxy"
         }
+    except CircuitOpenError as e:
+        logger.warning("proxy_hello failed fast", extra={"route": "/api/v1/proxy_hello", "error": str(e)})
+        raise HTTPException(
+            status_code=503,
+            detail={"error": f"Failed to call hello server: {e}", "status": "error"},
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
     except httpx.HTTPError as e:
         error_msg = str(e)
         # Get the status code from the response if available
@@ -85,7 +284,7 @@ def proxy_hello(request: NameRequest) -> dict[str, Any]:
         else:
             upstream_error = {"detail": error_msg}
         
-        print(f"Error occurred: {error_msg}")  # Debug print
+        logger.error("proxy_hello failed", extra={"route": "/api/v1/proxy_hello", "error": error_msg})
         raise HTTPException(
             status_code=status_code,
             detail={
@@ -96,7 +295,7 @@ def proxy_hello(request: NameRequest) -> dict[str, Any]:
         )
     except Exception as e:
         error_msg = str(e)
-        print(f"Error occurred: {error_msg}")  # Debug print
+        logger.error("proxy_hello failed", extra={"route": "/api/v1/proxy_hello", "error": error_msg})
         raise HTTPException(
             status_code=500,
             detail={
@@ -110,9 +309,16 @@ class MCPRequest(BaseModel):
     enable_auth: bool = False
 
 
-def call_mcp_server(name: str, enable_auth: bool = False) -> dict[str, Any]:
-    """Call the MCP /mcp endpoint using JSON-RPC 2.0 to invoke hello tool."""
-    url = f"{SERVER_URL}/mcp"
+def call_mcp_server(name: str, enable_auth: bool = False, timing: Optional[ServerTiming] = None) -> dict[str, Any]:
+    """Call the MCP /mcp endpoint using JSON-RPC 2.0 to invoke hello tool (stages as in call_hello_server).
+
+    If hedging is on and the tool is idempotent, a slow call is raced against a second copy.
+    With micro-batching on, the call instead joins the next JSON-RPC batch sent upstream.
+    Either way it runs in the endpoint's MCP session, so only the first call to an
+    endpoint pays for the initialize handshake.
+    """
+    timing = timing or ServerTiming()
+    idempotent = is_idempotent("tools/call", "hello")
     rpc_id = str(uuid.uuid4())
     payload = {
         "jsonrpc": "2.0",
@@ -123,34 +329,77 @@ def call_mcp_server(name: str, enable_auth: bool = False) -> dict[str, Any]:
 
     headers = {"Content-Type": "application/json"}
     if enable_auth:
+        started = time.perf_counter()
         try:
             id_token = get_auth_token()
-            print(f"\n[MCP-CLIENT-2] Auth Token: {id_token}\n")
             headers["Authorization"] = f"Bearer {id_token}"
         except Exception as e:
-            print(f"[MCP-CLIENT-2] Failed to get auth token: {e}")
+            logger.warning("failed to get auth token", extra={"audience": AUTH_AUDIENCE, "error": str(e)})
+        timing.since("token", started)
 
-    with httpx.Client() as client:
-        try:
-            response = client.post(url, json=payload, headers=headers)
+    started = time.perf_counter()
+    try:
+        with tracer.span(
+            "POST /mcp",
+            CLIENT,
+            attributes={"http.method": "POST", "rpc.method": "tools/call", "mcp.tool": "hello"},
+        ) as span:
+            headers[TRACEPARENT] = span.traceparent()
+
+            def send() -> httpx.Response:
+                return upstream.call(
+                    lambda timeout: balancer.call(
+                        lambda base_url: sessions.request(base_url, payload, headers, timeout)
+                    ),
+                    idempotent=idempotent,
+                )
+
+            data = None
+            if batcher.enabled:
+                response, data = batcher.call(headers.get("Authorization", ""), payload, headers[TRACEPARENT])
+            else:
+                response = hedger.call("tools/call hello", send, idempotent)
+            span.set("http.url", str(response.request.url))
+            span.set("http.status_code", response.status_code)
+            timing.since("upstream", started)
+            timing.merge(response.headers.get("server-timing"), "upstream-")
             response.raise_for_status()
+        if data is None:
             data = response.json()
-            if "error" in data:
-                raise HTTPException(status_code=502, detail={"rpc_error": data["error"]})
-            return data.get("result", {})
-        except httpx.HTTPError as e:
-            print(f"HTTP error occurred: {e}")
-            print(f"Response text: {e.response.text if hasattr(e, 'response') else 'No response'}")
-            raise
+        if "error" in data:
+            raise HTTPException(status_code=502, detail={"rpc_error": data["error"]})
+        return data.get("result", {})
+    except httpx.HTTPError as e:
+        logger.warning(
+            "mcp server http error",
+            extra={"error": str(e), "response_text": e.response.text if hasattr(e, "response") else None},
+        )
+        raise
 
 
 @router.post("/mcp_call")
-def mcp_call(request: MCPRequest) -> dict[str, Any]:
+def mcp_call(request: MCPRequest, http_request: Request) -> dict[str, Any]:
     """Proxy endpoint that triggers MCP tools/call hello on the server."""
-    print(f"[MCP-CLIENT-2] MCP call name={request.name} enable_auth={request.enable_auth}")
+    logger.info(
+        "mcp_call request",
+        extra={"route": "/api/v1/mcp_call", "request_name": request.name, "enable_auth": request.enable_auth},
+    )
     try:
-        result = call_mcp_server(request.name, request.enable_auth)
+        timing = http_request.state.timing
+        result = coalesced(
+            call_key("tools/call", "hello", {"name": request.name, "enable_auth": request.enable_auth}),
+            is_idempotent("tools/call", "hello"),
+            lambda: call_mcp_server(request.name, request.enable_auth, timing),
+            timing,
+        )
         return {"mcp_result": result, "proxy_info": "MCP client proxy"}
+    except CircuitOpenError as e:
+        logger.warning("mcp_call failed fast", extra={"route": "/api/v1/mcp_call", "error": str(e)})
+        raise HTTPException(
+            status_code=503,
+            detail={"error": f"Failed MCP call: {e}", "status": "error"},
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
     except httpx.HTTPError as e:
         error_msg = str(e)
         status_code = e.response.status_code if getattr(e, "response", None) is not None else 500
@@ -163,7 +412,7 @@ def mcp_call(request: MCPRequest) -> dict[str, Any]:
         else:
             upstream_error = {"detail": error_msg}
 
-        print(f"Error occurred: {error_msg}")
+        logger.error("mcp_call failed", extra={"route": "/api/v1/mcp_call", "error": error_msg})
         raise HTTPException(
             status_code=status_code,
             detail={
@@ -174,12 +423,62 @@ def mcp_call(request: MCPRequest) -> dict[str, Any]:
         )
     except Exception as e:
         error_msg = str(e)
-        print(f"Error occurred: {error_msg}")
+        logger.error("mcp_call failed", extra={"route": "/api/v1/mcp_call", "error": error_msg})
         raise HTTPException(status_code=500, detail={"error": f"Internal server error: {error_msg}", "status": "error"})
 
+@router.get("/tools")
+def list_tools() -> dict[str, Any]:
+    """The server's MCP tools, from the session cache (tools/list runs once per session, not per request)."""
+    tools = sessions.tools()
+    if tools is None:
+        headers = {"Content-Type": "application/json"}
+        try:
+            headers["Authorization"] = f"Bearer {get_auth_token()}"
+        except Exception as e:
+            logger.warning("failed to get auth token", extra={"audience": AUTH_AUDIENCE, "error": str(e)})
+        endpoint = balancer.pick()
+        started = time.monotonic()
+        try:
+            session, failed = sessions.session(endpoint.url, headers, upstream.attempt_timeout)
+        except httpx.HTTPError as e:
+            balancer.done(endpoint, started, False)
+            logger.error("list_tools http error", extra={"route": "/api/v1/tools", "error": str(e)})
+            raise HTTPException(status_code=502, detail={"error": f"Failed to list tools: {e}", "status": "error"})
+        balancer.done(endpoint, started, failed is None or failed.status_code < 500)
+        if session is None:
+            raise HTTPException(
+                status_code=failed.status_code,
+                detail={"error": f"MCP initialize failed with HTTP {failed.status_code}", "status": "error"},
+            )
+        tools = session.tools or []
+    return {"tools": tools, "proxy_info": "MCP client proxy"}
+
 # Include the router in the main app
 app.include_router(router, prefix="/api/v1")
 
+
+def render_metrics() -> str:
+    """This worker's metrics in Prometheus text format."""
+    return (
+        upstream.render()
+        + balancer.render()
+        + hedger.render()
+        + single_flight.render()
+        + batcher.render()
+        + sessions.render()
+        + render_caches([shared_tokens])
+    )
+
+
+# Every gunicorn worker's metrics, labelled worker="<pid>", from whichever worker is scraped
+worker_metrics = WorkerMetrics.from_env(render_metrics)
+
+
+@app.get("/metrics")
+def metrics_endpoint() -> Response:
+    """Prometheus scrape endpoint: upstream breaker, retries, balancer, hedging, coalescing, batching, sessions and token cache."""
+    return Response(content=worker_metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 import uvicorn
 
 if __name__ == "__main__":
@@ -0,0 +1,425 @@
+"""W3C Trace Context propagation and batched span export.
+
+A call through a proxy crosses two services, the proxy's /api/v1/mcp_call and
+the server's /mcp. Both record spans under one trace id, so the two hops show
+up in the same trace:
+
+- `TracingMiddleware` (ASGI) starts a SERVER span for each request. If the
+  request has a `traceparent` header, the span continues that trace;
+  otherwise it starts a new trace. Handlers see the span as the current span
+  (a contextvar), including sync handlers that run in the threadpool.
+- `Tracer.span(...)` / `Tracer.start(...)` open child spans. The proxy wraps
+  its upstream call in a CLIENT span and sends `span.traceparent()` with the
+  request. The server records one span per JSON-RPC call.
+
+Recording a span takes a few slot writes. Ids come from
+`random.getrandbits`.
+
+Ended spans that are sampled go to `BatchSpanExporter`. It holds them in a
+bounded queue, and a daemon thread exports them in batches to an OTLP/HTTP
+collector (OTEL_EXPORTER_OTLP_TRACES_ENDPOINT, or OTEL_EXPORTER_OTLP_ENDPOINT
++ /v1/traces), to a JSON-lines file (TRACE_EXPORT_FILE), or to both. When the
+queue is full, spans are dropped and counted instead of blocking the request.
+If no exporter is configured, trace context is still propagated but no spans
+are kept.
+
+New traces are sampled with probability OTEL_TRACES_SAMPLER_ARG (default 1.0).
+Continued traces follow the sampled flag of the incoming traceparent.
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, MutableMapping, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT = "traceparent"
+
+# Span kinds, numbered as in OTLP
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+_KIND_NAMES = {INTERNAL: "internal", SERVER: "server", CLIENT: "client"}
+
+# traceparent trace-flags bit for "sampled"
+SAMPLED = 0x01
+
+_HEX = frozenset("0123456789abcdef")
+
+_current: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("mcp_current_span", default=None)
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, int]]:
+    """(trace id, parent span id, flags) from a traceparent header; None if it is missing or invalid."""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) < 4:
+        return None
+    version, trace_id, span_id, flags = parts[:4]
+    if (
+        len(version) != 2
+        or version == "ff"
+        or (version == "00" and len(parts) != 4)
+        or len(trace_id) != 32
+        or len(span_id) != 16
+        or len(flags) != 2
+        or not _HEX.issuperset(version + trace_id + span_id + flags)
+        or trace_id == "0" * 32
+        or span_id == "0" * 16
+    ):
+        return None
+    return trace_id, span_id, int(flags, 16)
+
+
+def current_span() -> Optional["Span"]:
+    return _current.get()
+
+
+def _new_id(bits: int) -> str:
+    # All-zero ids are invalid; getrandbits returning 0 is astronomically rare
+    return "%0*x" % (bits // 4, random.getrandbits(bits) or 1)
+
+
+class Span:
+    __slots__ = (
+        "tracer",
+        "name",
+        "kind",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "flags",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "error",
+    )
+
+    def __init__(
+        self,
+        tracer: "Tracer",
+        name: str,
+        kind: int,
+        trace_id: str,
+        parent_id: Optional[str],
+        flags: int,
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.flags = flags
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes: Dict[str, Any] = dict(attributes) if attributes else {}
+        self.error: Optional[str] = None
+
+    @property
+    def sampled(self) -> bool:
+        return bool(self.flags & SAMPLED)
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def traceparent(self) -> str:
+        """Header value that makes the receiver's spans children of this one."""
+        return f"00-{self.trace_id}-{self.span_id}-{self.flags:02x}"
+
+    def end(self, error: Optional[str] = None) -> None:
+        """Finish the span (once); `error` marks it failed."""
+        if self.end_ns:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = error
+        self.tracer._finish(self)
+
+
+class Tracer:
+    """Creates spans and hands the sampled ones to an exporter."""
+
+    def __init__(self, exporter: Optional["BatchSpanExporter"] = None, ratio: float = 1.0):
+        self.exporter = exporter
+        self.ratio = ratio
+        # A new trace is sampled when the low 64 bits of its id fall below this
+        self._bound = int(max(0.0, min(ratio, 1.0)) * 2**64)
+
+    def start(
+        self,
+        name: str,
+        kind: int = INTERNAL,
+        parent: Union["Span", str, None] = None,
+        attributes: Optional[Dict[str, Any]] = None,
+    ) -> Span:
+        """Start a span under `parent`: a Span, a traceparent header value, or (None) the current span.
+
+        An invalid or absent parent starts a new trace.
+        """
+        if parent is None:
+            parent = _current.get()
+        if isinstance(parent, Span):
+            return Span(self, name, kind, parent.trace_id, parent.span_id, parent.flags, attributes)
+        context = parse_traceparent(parent)
+        if context is not None:
+            trace_id, parent_id, flags = context
+            return Span(self, name, kind, trace_id, parent_id, flags, attributes)
+        trace_id = _new_id(128)
+        flags = SAMPLED if int(trace_id[16:], 16) < self._bound else 0
+        return Span(self, name, kind, trace_id, None, flags, attributes)
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        kind: int = INTERNAL,
+        parent: Union["Span", str, None] = None,
+        attributes: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[Span]:
+        """Start a span, make it the current span for the block, and end it (failed if the block raises)."""
+        span = self.start(name, kind, parent, attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(error=str(e) or type(e).__name__)
+            raise
+        finally:
+            _current.reset(token)
+            span.end()
+
+    def _finish(self, span: Span) -> None:
+        if self.exporter is not None and span.flags & SAMPLED:
+            self.exporter.submit(span)
+
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+
+
+class TracingMiddleware:
+    """ASGI middleware: one SERVER span per HTTP request, continuing an incoming traceparent."""
+
+    def __init__(self, app: Callable[[Scope, Receive, Send], Awaitable[None]], tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        method, path = scope["method"], scope["path"]
+        span = self.tracer.start(
+            f"{method} {path}", SERVER, traceparent, {"http.method": method, "http.target": path}
+        )
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        token = _current.set(span)
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as e:
+            span.set("http.status_code", 500)
+            span.end(error=str(e) or type(e).__name__)
+            raise
+        finally:
+            _current.reset(token)
+        span.set("http.status_code", status)
+        span.end(error=f"HTTP {status}" if status >= 500 else None)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpSpanSink:
+    """Posts span batches to an OTLP/HTTP collector as JSON."""
+
+    def __init__(self, endpoint: str, service: str):
+        self.endpoint = endpoint
+        self.service = service
+
+    def __call__(self, spans: List[Span]) -> None:
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(self.payload(spans)).encode(), headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            response.read()
+
+    def payload(self, spans: List[Span]) -> Dict[str, Any]:
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service}}]},
+                    "scopeSpans": [{"scope": {"name": "mcp"}, "spans": [self.span(s) for s in spans]}],
+                }
+            ]
+        }
+
+    @staticmethod
+    def span(span: Span) -> Dict[str, Any]:
+        return {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "parentSpanId": span.parent_id or "",
+            "name": span.name,
+            "kind": span.kind,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+            # STATUS_CODE_ERROR = 2; unset otherwise
+            "status": {"code": 2, "message": span.error} if span.error is not None else {},
+        }
+
+
+class JsonFileSpanSink:
+    """Appends spans to a local file, one JSON object per line."""
+
+    def __init__(self, path: str, service: str):
+        self.path = path
+        self.service = service
+
+    def __call__(self, spans: List[Span]) -> None:
+        lines = "".join(json.dumps(self.record(s), default=str) + "\n" for s in spans)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    def record(self, span: Span) -> Dict[str, Any]:
+        return {
+            "service": self.service,
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "name": span.name,
+            "kind": _KIND_NAMES.get(span.kind, "internal"),
+            "start_unix_nano": span.start_ns,
+            "duration_ms": round((span.end_ns - span.start_ns) / 1e6, 3),
+            "attributes": span.attributes,
+            "error": span.error,
+        }
+
+
+class BatchSpanExporter:
+    """Bounded span queue, drained in batches by a daemon thread; drops spans when full."""
+
+    def __init__(
+        self,
+        sinks: List[Callable[[List[Span]], None]],
+        max_queue: int = 2048,
+        batch_size: int = 512,
+        delay: float = 5.0,
+    ):
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.delay = delay
+        self.dropped = 0
+        self._reported = 0
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=max_queue)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls, service: str) -> Optional["BatchSpanExporter"]:
+        service = os.getenv("OTEL_SERVICE_NAME", service)
+        sinks: List[Callable[[List[Span]], None]] = []
+        endpoint = os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT")
+        if not endpoint and os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+            endpoint = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "").rstrip("/") + "/v1/traces"
+        if endpoint:
+            sinks.append(OtlpSpanSink(endpoint, service))
+        path = os.getenv("TRACE_EXPORT_FILE")
+        if path:
+            sinks.append(JsonFileSpanSink(path, service))
+        if not sinks:
+            return None
+        return cls(
+            sinks,
+            max_queue=int(os.getenv("OTEL_BSP_MAX_QUEUE_SIZE", "2048")),
+            batch_size=int(os.getenv("OTEL_BSP_MAX_EXPORT_BATCH_SIZE", "512")),
+            delay=float(os.getenv("OTEL_BSP_SCHEDULE_DELAY", "5000")) / 1000,
+        )
+
+    def submit(self, span: Span) -> None:
+        """Queue an ended span without blocking; counts it as dropped if the queue is full."""
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        # Export every `delay` seconds, or sooner once a full batch is queued
+        while not self._stop.is_set():
+            self._wake.wait(self.delay)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        """Export everything queued so far, batch_size spans at a time."""
+        while True:
+            batch: List[Span] = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch:
+                self.export(batch)
+            if len(batch) < self.batch_size:
+                break
+        dropped = self.dropped
+        if dropped != self._reported:
+            logger.warning("span queue full, spans dropped", extra={"dropped": dropped - self._reported})
+            self._reported = dropped
+
+    def export(self, batch: List[Span]) -> None:
+        for sink in self.sinks:
+            try:
+                sink(batch)
+            except Exception as e:
+                logger.warning(
+                    "span export failed", extra={"sink": type(sink).__name__, "spans": len(batch), "error": str(e)}
+                )
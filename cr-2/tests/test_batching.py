@@ -0,0 +1,206 @@
+"""Micro-batching: grouping concurrent calls, and handing each caller its own response by id.
+
+The upstream is a stand-in `send` that answers a batch the way the MCP
+servers do, so nothing goes over the network.
+
+Usage:
+    python -m pytest tests
+"""
+import os
+import sys
+import threading
+import time
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from batching import INTERNAL_ERROR, MicroBatcher  # noqa: E402
+
+
+class Server:
+    """`send(group, body, traceparent)` stand-in echoing each request's params back as its result.
+
+    `answer` can rewrite the list of responses to a batch (reorder, drop
+    entries) or replace it with another body.
+    """
+
+    def __init__(self, answer=None, status=200):
+        self.answer = answer or (lambda responses: responses)
+        self.status = status
+        self.bodies = []
+        self.groups = []
+        self.traceparents = []
+
+    def __call__(self, group, body, traceparent) -> httpx.Response:
+        self.bodies.append(body)
+        self.groups.append(group)
+        self.traceparents.append(traceparent)
+        request = httpx.Request("POST", "http://server/mcp")
+        messages = body if isinstance(body, list) else [body]
+        responses = [{"jsonrpc": "2.0", "id": m["id"], "result": m.get("params")} for m in messages if "id" in m]
+        if not responses:
+            return httpx.Response(204, request=request)
+        answer = self.answer(responses) if isinstance(body, list) else responses[0]
+        return httpx.Response(self.status, json=answer, request=request)
+
+
+def request(caller, id=1):
+    return {"jsonrpc": "2.0", "id": id, "method": "tools/call", "params": {"tool": "hello", "name": caller}}
+
+
+def call_together(batcher: MicroBatcher, calls) -> list:
+    """Make each (group, message) call from its own thread at once; returns each (response, data) in order."""
+    results = [None] * len(calls)
+    ready = threading.Barrier(len(calls))
+
+    def caller(i: int) -> None:
+        group, message = calls[i]
+        ready.wait(timeout=5)
+        try:
+            results[i] = batcher.call(group, message, f"trace-{i}")
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(len(calls))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    return results
+
+
+@pytest.fixture
+def batcher_for():
+    batchers = []
+
+    def make(server, **kwargs) -> MicroBatcher:
+        kwargs.setdefault("window", 0.2)
+        batcher = MicroBatcher("server", server, **kwargs)
+        batchers.append(batcher)
+        return batcher
+
+    yield make
+    for batcher in batchers:
+        batcher.stop()
+
+
+def test_clashing_ids_demultiplexed(batcher_for):
+    server = Server()
+    batcher = batcher_for(server, max_size=3)
+    # Every caller used id 1; each gets its own result back under id 1
+    results = call_together(batcher, [("auth", request(name)) for name in ("a", "b", "c")])
+    assert len(server.bodies) == 1
+    assert [m["id"] for m in server.bodies[0]] == [0, 1, 2]
+    assert sorted(data["result"]["name"] for _, data in results) == ["a", "b", "c"]
+    assert all(data["id"] == 1 for _, data in results)
+    assert batcher.counts == {"calls": 3, "requests": 1}
+
+
+def test_responses_matched_by_id_not_position(batcher_for):
+    server = Server(answer=lambda responses: responses[::-1])
+    batcher = batcher_for(server, max_size=3)
+    messages = [request(name, id=f"caller-{name}") for name in ("a", "b", "c")]
+    results = call_together(batcher, [("auth", m) for m in messages])
+    for message, (_, data) in zip(messages, results):
+        assert data == {"jsonrpc": "2.0", "id": message["id"], "result": message["params"]}
+
+
+def test_missing_response_becomes_internal_error(batcher_for):
+    server = Server(answer=lambda responses: [r for r in responses if r["result"]["name"] != "b"])
+    batcher = batcher_for(server, max_size=3)
+    results = call_together(batcher, [("auth", request(name, id=name)) for name in ("a", "b", "c")])
+    by_id = {data["id"]: data for _, data in results}
+    assert by_id["b"]["error"]["code"] == INTERNAL_ERROR
+    assert by_id["a"]["result"] == {"tool": "hello", "name": "a"}
+
+
+def test_notifications_keep_no_id(batcher_for):
+    server = Server()
+    batcher = batcher_for(server, max_size=3)
+    notification = {"jsonrpc": "2.0", "method": "notifications/initialized"}
+    results = call_together(batcher, [("auth", request("a")), ("auth", notification), ("auth", request("c", id=7))])
+    body = server.bodies[0]
+    # Sent as a notification, so the server does not answer it
+    assert notification in body and sum("id" in m for m in body) == 2
+    assert results[1][1] is None
+    assert (results[0][1]["id"], results[0][1]["result"]["name"]) == (1, "a")
+    assert (results[2][1]["id"], results[2][1]["result"]["name"]) == (7, "c")
+
+
+def test_all_notifications_answered_with_none(batcher_for):
+    server = Server()
+    batcher = batcher_for(server, max_size=2)
+    notification = {"jsonrpc": "2.0", "method": "notifications/initialized"}
+    results = call_together(batcher, [("auth", notification), ("auth", notification)])
+    assert [(response.status_code, data) for response, data in results] == [(204, None), (204, None)]
+
+
+def test_whole_batch_error_goes_to_every_caller(batcher_for):
+    rejected = {"jsonrpc": "2.0", "id": None, "error": {"code": -32029, "message": "Rate limit exceeded"}}
+    server = Server(answer=lambda responses: rejected, status=429)
+    batcher = batcher_for(server, max_size=2)
+    results = call_together(batcher, [("auth", request("a")), ("auth", request("b"))])
+    assert [(response.status_code, data) for response, data in results] == [(429, rejected)] * 2
+
+
+def test_send_failure_raised_to_every_caller(batcher_for):
+    def send(group, body, traceparent):
+        raise httpx.ConnectError("connection refused")
+
+    batcher = batcher_for(send, max_size=2)
+    results = call_together(batcher, [("auth", request("a")), ("auth", request("b"))])
+    assert all(isinstance(e, httpx.ConnectError) for e in results)
+
+
+def test_groups_never_share_a_post(batcher_for):
+    server = Server()
+    batcher = batcher_for(server, window=0.1)
+    calls = [("alice", request("a")), ("bob", request("b")), ("alice", request("c"))]
+    results = call_together(batcher, calls)
+    assert sorted(server.groups) == ["alice", "bob"]
+    alice = server.bodies[server.groups.index("alice")]
+    bob = server.bodies[server.groups.index("bob")]
+    assert sorted(m["params"]["name"] for m in alice) == ["a", "c"]
+    # A lone call goes as a plain request under its own id
+    assert bob == request("b")
+    assert [data["result"]["name"] for _, data in results] == ["a", "b", "c"]
+    assert batcher.counts == {"calls": 3, "requests": 2}
+
+
+def test_max_size_splits_batches(batcher_for):
+    server = Server()
+    batcher = batcher_for(server, window=0.5, max_size=2)
+    results = call_together(batcher, [("auth", request(name)) for name in "abcd"])
+    assert sorted(len(body) for body in server.bodies) == [2, 2]
+    assert sorted(data["result"]["name"] for _, data in results) == list("abcd")
+
+
+def test_first_callers_traceparent_used(batcher_for):
+    server = Server()
+    batcher = batcher_for(server, max_size=1)
+    batcher.call("auth", request("a"), "trace-a")
+    assert server.traceparents == ["trace-a"]
+
+
+def test_stop_sends_what_was_collected():
+    server = Server()
+    batcher = MicroBatcher("server", server, window=10.0)
+    results = []
+    caller = threading.Thread(target=lambda: results.append(batcher.call("auth", request("a"))))
+    caller.start()
+    # Well inside the window: the call is queued or being collected, not sent
+    time.sleep(0.05)
+    assert not server.bodies
+    batcher.stop()
+    caller.join(timeout=5)
+    assert results and results[0][1]["result"]["name"] == "a"
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.setenv("UPSTREAM_BATCH_WINDOW_MS", "5")
+    batcher = MicroBatcher.from_env("server", Server())
+    assert batcher.enabled and batcher.window == 0.005
+    monkeypatch.delenv("UPSTREAM_BATCH_WINDOW_MS")
+    assert not MicroBatcher.from_env("server", Server()).enabled
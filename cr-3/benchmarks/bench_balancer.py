@@ -0,0 +1,93 @@
+"""Tail latency of the cr-3 proxy balancing over fast and deliberately slow servers.
+
+Starts --fast stand-in MCP servers answering after --fast-ms and --slow ones
+answering after --slow-ms (the stand-in from load_test.py), then the proxy
+from `src/` with all of them in SERVER_URLS. The proxy runs once per
+balancer policy, with the same callers and requests each time, and the
+script prints rps, p50, p99 and errors for each policy:
+
+    python benchmarks/bench_balancer.py
+    python benchmarks/bench_balancer.py --fast 3 --slow 1 --slow-ms 500 --concurrency 5 20
+
+round_robin sends every third request to the slow server, so its p99 is the
+slow server's latency. p2c should send it well under 1% of attempts (the
+share is printed from the proxy's /metrics) and keep the p99 close to the
+fast servers'. Everything runs on this machine, so keep the concurrency low
+enough that the proxy is not CPU-bound, or CPU queueing swamps the upstream
+latencies being compared.
+"""
+import argparse
+import asyncio
+from typing import Dict, List, Tuple
+
+import httpx
+
+from load_test import SRC, drive, free_port, spawn, wait_ready
+
+
+def endpoint_requests(metrics: str) -> Dict[str, float]:
+    """Attempts per endpoint URL from the proxy's /metrics."""
+    counts = {}
+    for line in metrics.splitlines():
+        if line.startswith("mcp_upstream_endpoint_requests_total{"):
+            labels, _, value = line.rpartition(" ")
+            counts[labels.split('endpoint="')[1].rstrip('"}')] = float(value)
+    return counts
+
+
+def run_proxy(policy: str, server_urls: List[str], levels: List[int], requests: int) -> Tuple[dict, Dict[str, float]]:
+    port = free_port()
+    env = {"SERVER_URLS": ",".join(server_urls), "BALANCER_POLICY": policy, "BALANCER_PROBE_INTERVAL": "1"}
+    proc = spawn(["--serve-proxy", SRC, str(port)], env=env)
+    try:
+        wait_ready(f"http://127.0.0.1:{port}/docs")
+        url = f"http://127.0.0.1:{port}/api/v1/mcp_call"
+        asyncio.run(drive(url, 10, 100))  # warm up connections and latency estimates
+        before = endpoint_requests(httpx.get(f"http://127.0.0.1:{port}/metrics").text)
+        results = {c: asyncio.run(drive(url, c, requests)) for c in levels}
+        after = endpoint_requests(httpx.get(f"http://127.0.0.1:{port}/metrics").text)
+        return results, {u: after.get(u, 0) - before.get(u, 0) for u in server_urls}
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fast", type=int, default=2, help="number of fast servers")
+    parser.add_argument("--slow", type=int, default=1, help="number of slow servers")
+    parser.add_argument("--fast-ms", type=float, default=20.0)
+    parser.add_argument("--slow-ms", type=float, default=200.0)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[2, 5])
+    parser.add_argument("--requests", type=int, default=1000, help="requests per concurrency level")
+    parser.add_argument("--policies", nargs="+", default=["round_robin", "p2c"])
+    args = parser.parse_args()
+
+    servers = []
+    urls = []
+    try:
+        for delay in [args.fast_ms] * args.fast + [args.slow_ms] * args.slow:
+            port = free_port()
+            servers.append(spawn(["--serve-upstream", str(port), str(delay)]))
+            urls.append(f"http://127.0.0.1:{port}")
+        for url in urls:
+            wait_ready(f"{url}/hello")
+        runs = {policy: run_proxy(policy, urls, args.concurrency, args.requests) for policy in args.policies}
+    finally:
+        for proc in servers:
+            proc.terminate()
+            proc.wait()
+
+    slow_urls = urls[args.fast:]
+    print(f"{args.fast} servers at {args.fast_ms:.0f} ms, {args.slow} at {args.slow_ms:.0f} ms")
+    print(f"{'policy':<12} {'callers':>7} {'rps':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for policy, (results, _sent) in runs.items():
+        for concurrency, r in results.items():
+            print(f"{policy:<12} {concurrency:>7} {r['rps']:>9.1f} {r['p50']:>9.1f} {r['p99']:>9.1f} {r['errors']:>7}")
+    for policy, (_results, sent) in runs.items():
+        share = sum(sent[u] for u in slow_urls) / max(1.0, sum(sent.values()))
+        print(f"{policy}: {share:.1%} of attempts went to the slow servers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Load test for the cr-3 proxy: requests/second and tail latency vs concurrency.
+
+Starts a stand-in MCP server (answers /hello and /mcp after --upstream-ms) and
+the proxy from `src/` in separate uvicorn processes, then drives
+POST /api/v1/mcp_call with N concurrent callers and reports rps, p50, p99 and
+errors at each level.
+
+Pass --baseline-rev to also run the proxy as it was at a git revision (for
+example the commit before the async conversion) and print both side by side:
+
+    python benchmarks/load_test.py --baseline-rev HEAD~1
+    python benchmarks/load_test.py --concurrency 10 100 1000 --upstream-ms 20
+
+ID token minting is replaced by a static unsigned token in both proxies so the
+numbers reflect the request path, not the metadata server.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, "..", "src")
+REPO_PATH = "cr-3/src"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def fake_id_token() -> str:
+    def segment(obj) -> str:
+        return base64.urlsafe_b64encode(json.dumps(obj).encode()).decode().rstrip("=")
+
+    claims = {"aud": "bench", "exp": int(time.time()) + 3600}
+    return f"{segment({'alg': 'none'})}.{segment(claims)}.{segment('sig')}"
+
+
+def serve_upstream(port: int, delay_ms: float) -> None:
+    import uvicorn
+    from fastapi import FastAPI, Request
+
+    app = FastAPI()
+
+    @app.get("/hello")
+    async def hello(name: str = "World"):
+        await asyncio.sleep(delay_ms / 1000)
+        return {"message": f"Hello, {name}!", "type": "greeting"}
+
+    @app.post("/mcp")
+    async def mcp(request: Request):
+        body = await request.json()
+        await asyncio.sleep(delay_ms / 1000)
+        name = body.get("params", {}).get("name", "World")
+        return {"jsonrpc": "2.0", "id": body.get("id"), "result": {"message": f"Hello, {name}!", "type": "greeting"}}
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def serve_proxy(src: str, port: int) -> None:
+    import google.oauth2.id_token
+    import uvicorn
+
+    token = fake_id_token()
+    google.oauth2.id_token.fetch_id_token = lambda request, audience: token
+    sys.path.insert(0, src)
+    sys.stdout = open(os.devnull, "w")
+    import client
+
+    uvicorn.run(client.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def spawn(args: List[str], env: Optional[dict] = None) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), *args],
+        env={**os.environ, **(env or {})},
+    )
+
+
+def wait_ready(url: str, timeout: float = 15.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=0.5)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def checkout(rev: str) -> str:
+    """Write cr-3/src as of `rev` into a temp dir and return its path."""
+    out = tempfile.mkdtemp(prefix="cr3-baseline-")
+    top = subprocess.check_output(["git", "rev-parse", "--show-toplevel"], cwd=HERE, text=True).strip()
+    names = subprocess.check_output(["git", "ls-tree", "--name-only", rev, f"{REPO_PATH}/"], cwd=top, text=True)
+    for path in names.split():
+        data = subprocess.check_output(["git", "show", f"{rev}:{path}"], cwd=top)
+        with open(os.path.join(out, os.path.basename(path)), "wb") as f:
+            f.write(data)
+    return out
+
+
+async def drive(url: str, concurrency: int, total: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    remaining = total
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+
+        async def caller() -> None:
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                try:
+                    response = await client.post(url, json={"name": "bench"})
+                    if response.status_code != 200 or "error" in response.json():
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(caller() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50": statistics.median(latencies),
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "errors": errors,
+    }
+
+
+def run_proxy(src: str, upstream_url: str, levels: List[int], per_caller: int, minimum: int) -> dict:
+    port = free_port()
+    proc = spawn(["--serve-proxy", src, str(port)], env={"SERVER_URL": upstream_url})
+    try:
+        wait_ready(f"http://127.0.0.1:{port}/docs")
+        url = f"http://127.0.0.1:{port}/api/v1/mcp_call"
+        asyncio.run(drive(url, 10, 50))  # warm up connections and token cache
+        return {c: asyncio.run(drive(url, c, max(minimum, c * per_caller))) for c in levels}
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--per-caller", type=int, default=5, help="requests per concurrent caller")
+    parser.add_argument("--min-requests", type=int, default=500)
+    parser.add_argument("--upstream-ms", type=float, default=20.0)
+    parser.add_argument("--baseline-rev", help="git revision to compare against")
+    parser.add_argument("--serve-upstream", nargs=2, metavar=("PORT", "DELAY_MS"), help=argparse.SUPPRESS)
+    parser.add_argument("--serve-proxy", nargs=2, metavar=("SRC", "PORT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_upstream:
+        serve_upstream(int(args.serve_upstream[0]), float(args.serve_upstream[1]))
+        return
+    if args.serve_proxy:
+        serve_proxy(args.serve_proxy[0], int(args.serve_proxy[1]))
+        return
+
+    upstream_port = free_port()
+    upstream = spawn(["--serve-upstream", str(upstream_port), str(args.upstream_ms)])
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    try:
+        wait_ready(f"{upstream_url}/hello")
+        runs = {}
+        if args.baseline_rev:
+            runs[f"before ({args.baseline_rev})"] = run_proxy(
+                checkout(args.baseline_rev), upstream_url, args.concurrency, args.per_caller, args.min_requests
+            )
+        runs["after"] = run_proxy(SRC, upstream_url, args.concurrency, args.per_caller, args.min_requests)
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+    print(f"upstream latency {args.upstream_ms:.0f} ms")
+    print(f"{'version':<20} {'callers':>7} {'rps':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for label, results in runs.items():
+        for concurrency, r in results.items():
+            print(f"{label:<20} {concurrency:>7} {r['rps']:>9.1f} {r['p50']:>9.1f} {r['p99']:>9.1f} {r['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""Client-side load balancing across several MCP server endpoints.
+
+SERVER_URLS lists the server's endpoints (one per region, or the internal
+load balancers from tf-templates), comma-separated. Each attempt goes to the
+endpoint returned by `pick()`, which draws two endpoints at random and takes
+the cheaper one (power of two choices):
+
+    cost = latency estimate * (requests in flight + 1)
+
+The latency estimate is a peak EWMA. A sample slower than the estimate
+replaces it at once; faster samples pull it down with a time constant of
+BALANCER_DECAY seconds. An endpoint that slows down loses traffic as soon as
+one slow response comes back, and wins it back gradually as it recovers.
+A failed attempt (transport error or 5xx) counts as at least FAILURE_LATENCY
+seconds, so an endpoint that fails fast does not look fast.
+
+Outlier ejection: after BALANCER_EJECT_FAILURES consecutive failures an
+endpoint is left out of `pick()` for BALANCER_EJECT_TIME seconds, multiplied
+by the number of times it was ejected recently (up to 10x). At most
+BALANCER_MAX_EJECTED (a fraction) of the endpoints are ejected at a time.
+
+Probes: every BALANCER_PROBE_INTERVAL seconds each endpoint is sent a
+JSON-RPC `ping`, and the outcome is recorded like a request. Endpoints that
+get little traffic keep a fresh estimate this way, and an endpoint that
+stops answering is ejected before requests find out. Probes only run with
+more than one endpoint.
+
+BALANCER_POLICY=round_robin replaces the power-of-two choice with plain
+rotation over the endpoints that are not ejected (a baseline for
+benchmarks/bench_balancer.py).
+"""
+import asyncio
+import itertools
+import logging
+import math
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+P2C = "p2c"
+ROUND_ROBIN = "round_robin"
+
+# Latency recorded for a failed attempt that failed faster than this (seconds)
+FAILURE_LATENCY = 1.0
+
+# Upper bound on the ejection time multiplier
+MAX_EJECTION_MULTIPLIER = 10
+
+
+class Endpoint:
+    """One upstream base URL and what the balancer knows about it."""
+
+    __slots__ = ("url", "ewma", "updated", "in_flight", "failures", "ejected_until", "ejections", "counts")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.ewma = 0.0
+        self.updated = 0.0
+        self.in_flight = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.counts = {"requests": 0, "failures": 0, "ejections": 0}
+
+    def cost(self) -> float:
+        return self.ewma * (self.in_flight + 1)
+
+    def observe(self, seconds: float, now: float, decay: float) -> None:
+        if self.updated == 0.0 or seconds > self.ewma:
+            self.ewma = seconds
+        else:
+            weight = math.exp(-(now - self.updated) / decay)
+            self.ewma = self.ewma * weight + seconds * (1 - weight)
+        self.updated = now
+
+
+class Balancer:
+    """Power-of-two-choices over peak-EWMA latency and in-flight count, with outlier ejection and probes."""
+
+    def __init__(
+        self,
+        urls: List[str],
+        name: str = "server",
+        policy: str = P2C,
+        decay: float = 5.0,
+        eject_failures: int = 3,
+        eject_time: float = 30.0,
+        max_ejected: float = 0.5,
+        probe_interval: float = 5.0,
+    ):
+        if not urls:
+            raise ValueError("at least one endpoint URL is required")
+        self.endpoints = [Endpoint(url.rstrip("/")) for url in urls]
+        self.name = name
+        self.policy = policy
+        self.decay = decay
+        self.eject_failures = eject_failures
+        self.eject_time = eject_time
+        self.max_ejected = max_ejected
+        self.probe_interval = probe_interval
+        self._rotation = itertools.count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    @classmethod
+    def from_env(cls, urls: str, name: str = "server") -> "Balancer":
+        return cls(
+            [url.strip() for url in urls.split(",") if url.strip()],
+            name,
+            policy=os.getenv("BALANCER_POLICY", P2C),
+            decay=float(os.getenv("BALANCER_DECAY", "5")),
+            eject_failures=int(os.getenv("BALANCER_EJECT_FAILURES", "3")),
+            eject_time=float(os.getenv("BALANCER_EJECT_TIME", "30")),
+            max_ejected=float(os.getenv("BALANCER_MAX_EJECTED", "0.5")),
+            probe_interval=float(os.getenv("BALANCER_PROBE_INTERVAL", "5")),
+        )
+
+    def pick(self) -> Endpoint:
+        """Choose an endpoint and count a request in flight on it; pair with `done`."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.ejected_until <= now] or self.endpoints
+            if len(candidates) == 1:
+                endpoint = candidates[0]
+            elif self.policy == ROUND_ROBIN:
+                endpoint = candidates[next(self._rotation) % len(candidates)]
+            else:
+                a, b = random.sample(candidates, 2)
+                endpoint = a if a.cost() <= b.cost() else b
+            endpoint.in_flight += 1
+            endpoint.counts["requests"] += 1
+        return endpoint
+
+    def done(self, endpoint: Endpoint, started: float, ok: Optional[bool]) -> None:
+        """Finish a request from `pick`; `ok` None means it was abandoned (e.g. cancelled) and is not recorded."""
+        with self._lock:
+            endpoint.in_flight -= 1
+            if ok is not None:
+                self._record(endpoint, started, ok)
+
+    def call(self, send: Callable[[str], httpx.Response]) -> httpx.Response:
+        """Run `send(base_url)` against a picked endpoint and record how it went."""
+        endpoint = self.pick()
+        started = time.monotonic()
+        ok = None
+        try:
+            response = send(endpoint.url)
+            ok = response.status_code < 500
+            return response
+        except httpx.TransportError:
+            ok = False
+            raise
+        finally:
+            self.done(endpoint, started, ok)
+
+    async def acall(self, send: Callable[[str], Awaitable[httpx.Response]]) -> httpx.Response:
+        """Async version of `call`."""
+        endpoint = self.pick()
+        started = time.monotonic()
+        ok = None
+        try:
+            response = await send(endpoint.url)
+            ok = response.status_code < 500
+            return response
+        except httpx.TransportError:
+            ok = False
+            raise
+        finally:
+            self.done(endpoint, started, ok)
+
+    def _record(self, endpoint: Endpoint, started: float, ok: bool) -> None:
+        # Caller holds self._lock
+        now = time.monotonic()
+        elapsed = now - started
+        if ok:
+            endpoint.observe(elapsed, now, self.decay)
+            endpoint.failures = 0
+            # Healthy for a full ejection period since it came back: start the multiplier over
+            if endpoint.ejections and now > endpoint.ejected_until + self.eject_time:
+                endpoint.ejections = 0
+            return
+        endpoint.observe(max(elapsed, FAILURE_LATENCY), now, self.decay)
+        endpoint.failures += 1
+        endpoint.counts["failures"] += 1
+        if endpoint.failures < self.eject_failures or endpoint.ejected_until > now:
+            return
+        ejected = sum(1 for e in self.endpoints if e.ejected_until > now)
+        if ejected + 1 > int(self.max_ejected * len(self.endpoints)):
+            return
+        endpoint.ejections += 1
+        endpoint.counts["ejections"] += 1
+        endpoint.failures = 0
+        seconds = self.eject_time * min(endpoint.ejections, MAX_EJECTION_MULTIPLIER)
+        endpoint.ejected_until = now + seconds
+        logger.warning("upstream endpoint ejected", extra={"endpoint": endpoint.url, "seconds": seconds})
+
+    def _probe_result(self, endpoint: Endpoint, started: float, response: Optional[httpx.Response]) -> None:
+        with self._lock:
+            self._record(endpoint, started, response is not None and response.status_code < 500)
+
+    def probe(self, send: Callable[[str], httpx.Response]) -> None:
+        """Probe every endpoint once with `send(base_url)`."""
+        for endpoint in self.endpoints:
+            started = time.monotonic()
+            try:
+                response = send(endpoint.url)
+                response.close()
+            except httpx.TransportError:
+                response = None
+            except Exception as e:
+                # Not the endpoint's fault (e.g. no token): record nothing
+                logger.warning("upstream probe failed", extra={"endpoint": endpoint.url, "error": str(e)})
+                continue
+            self._probe_result(endpoint, started, response)
+
+    async def aprobe(self, send: Callable[[str], Awaitable[httpx.Response]]) -> None:
+        """Async version of `probe`; endpoints are probed concurrently."""
+
+        async def one(endpoint: Endpoint) -> None:
+            started = time.monotonic()
+            try:
+                response: Optional[httpx.Response] = await send(endpoint.url)
+                await response.aclose()
+            except httpx.TransportError:
+                response = None
+            except Exception as e:
+                logger.warning("upstream probe failed", extra={"endpoint": endpoint.url, "error": str(e)})
+                return
+            self._probe_result(endpoint, started, response)
+
+        await asyncio.gather(*(one(endpoint) for endpoint in self.endpoints))
+
+    def start(self, send: Callable[[str], httpx.Response]) -> None:
+        """Probe in a background thread every `probe_interval` seconds."""
+        if len(self.endpoints) < 2 or self.probe_interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+
+        def run() -> None:
+            while not self._stop.wait(self.probe_interval):
+                self.probe(send)
+
+        self._thread = threading.Thread(target=run, name="upstream-probes", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def astart(self, send: Callable[[str], Awaitable[httpx.Response]]) -> None:
+        """Probe from a task on the running event loop every `probe_interval` seconds."""
+        if len(self.endpoints) < 2 or self.probe_interval <= 0 or self._task is not None:
+            return
+
+        async def run() -> None:
+            while True:
+                await asyncio.sleep(self.probe_interval)
+                await self.aprobe(send)
+
+        self._task = asyncio.get_running_loop().create_task(run())
+
+    async def astop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def render(self) -> str:
+        """Prometheus text for each endpoint's latency estimate, load, failures and ejections."""
+        now = time.monotonic()
+        series = [
+            ("mcp_upstream_endpoint_latency_seconds", "gauge", "Peak-EWMA latency estimate.", lambda e: e.ewma),
+            ("mcp_upstream_endpoint_in_flight", "gauge", "Attempts in flight.", lambda e: e.in_flight),
+            ("mcp_upstream_endpoint_ejected", "gauge", "1 while ejected as an outlier.", lambda e: int(e.ejected_until > now)),
+            ("mcp_upstream_endpoint_requests_total", "counter", "Attempts sent.", lambda e: e.counts["requests"]),
+            ("mcp_upstream_endpoint_failures_total", "counter", "Failed attempts and probes.", lambda e: e.counts["failures"]),
+            ("mcp_upstream_endpoint_ejections_total", "counter", "Times ejected.", lambda e: e.counts["ejections"]),
+        ]
+        lines: List[str] = []
+        for metric, kind, help_text, value in series:
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            lines += [
+                f'{metric}{{upstream="{self.name}",endpoint="{e.url}"}} {value(e)}' for e in self.endpoints
+            ]
+        return "\n".join(lines) + "\n"
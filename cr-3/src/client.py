@@ -1,47 +1,205 @@
-from typing import Any
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Hashable, Optional
+import asyncio
 import os
+import time
 import httpx
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
 import uuid
 
-# Initialize FastAPI app that will act as a proxy
-app = FastAPI(title="hello-client")
+import logs
+from auth import IdTokenCache
+from balancer import Balancer
+from hedging import Hedger
+from resilience import PROMETHEUS_CONTENT_TYPE, Upstream, is_idempotent
+from sessions import SessionManager
+from shared_cache import SharedCache, render_caches
+from singleflight import SingleFlight, call_key
+from timing import ServerTiming, ServerTimingMiddleware
+from tracing import CLIENT, TRACEPARENT, BatchSpanExporter, Tracer, TracingMiddleware
+from warmup import warm_up
+from worker_metrics import WorkerMetrics
+
+# JSON logs to stdout through a background writer (see logs.py)
+logger = logs.setup("mcp-client-3")
 
 # Cloud Run server URL (fallback to local for development)
 SERVER_URL = os.getenv("SERVER_URL", "https://mcp-hello-456052106337.us-central1.run.app")
 
-def get_auth_token() -> str:
+# Server endpoints to balance across (e.g. one per region), comma-separated; defaults to SERVER_URL
+balancer = Balancer.from_env(os.getenv("SERVER_URLS", SERVER_URL))
+
+# ID token audience; with several endpoints, every server's AUTH_AUDIENCE must be set to this
+AUTH_AUDIENCE = os.getenv("AUTH_AUDIENCE", balancer.endpoints[0].url)
+
+# Minted ID tokens are reused per audience and refreshed in the background before exp.
+# They are shared by the gunicorn workers of an instance (see shared_cache.py)
+shared_tokens = SharedCache("id_tokens", slots=16, slot_size=4096)
+token_cache = IdTokenCache(refresh_margin=int(os.getenv("TOKEN_REFRESH_MARGIN", "300")), shared=shared_tokens)
+
+# Upstream calls carry a W3C traceparent; spans are batch-exported if OTLP or TRACE_EXPORT_FILE is set
+span_exporter = BatchSpanExporter.from_env("mcp-client-3")
+tracer = Tracer(span_exporter, float(os.getenv("OTEL_TRACES_SAMPLER_ARG", "1.0")))
+
+# Per-attempt timeouts, budgeted retries and a circuit breaker around every upstream call
+upstream = Upstream.from_env("server")
+
+# Optional hedging of slow idempotent MCP calls (HEDGE_PERCENTILE or HEDGE_DELAY_MS, see hedging.py)
+hedger = Hedger.from_env("server")
+
+# Identical idempotent calls in flight at once share one upstream call (SINGLE_FLIGHT=false to disable)
+single_flight = SingleFlight.from_env("server")
+
+# Shared async client (keep-alive + HTTP/2), created at startup and closed on shutdown
+http_client: Optional[httpx.AsyncClient] = None
+
+
+def create_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(float(os.getenv("UPSTREAM_TIMEOUT", "30"))),
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60")),
+        ),
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global http_client
+    if http_client is None:
+        http_client = create_http_client()
+    return http_client
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_http_client()
+    if span_exporter is not None:
+        span_exporter.start()
+    balancer.astart(probe_server)
+    worker_metrics.start()
+    # The ID token, connections and MCP sessions are ready before the first request needs them
+    await warm_up({"upstream": warm_upstream})
+    yield
+    await balancer.astop()
+    await asyncio.to_thread(worker_metrics.stop)
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+    if span_exporter is not None:
+        await asyncio.to_thread(span_exporter.stop)
+
+
+# Initialize FastAPI app that will act as a proxy
+app = FastAPI(title="hello-client", lifespan=lifespan)
+
+# token/upstream stages plus the upstream server's own stages in a Server-Timing header
+app.add_middleware(ServerTimingMiddleware)
+
+# One server span per request; upstream calls are client spans under it
+app.add_middleware(TracingMiddleware, tracer=tracer)
+
+async def get_auth_token() -> str:
     """Get ID token for authenticating with the server."""
-    import google.auth.transport.requests
-    import google.oauth2.id_token
+    return await token_cache.aget(AUTH_AUDIENCE)
+
+
+async def probe_server(base_url: str) -> httpx.Response:
+    """Balancer health probe: a JSON-RPC ping to one endpoint (any answer below 500 means it is up)."""
+    headers = {}
+    try:
+        headers["Authorization"] = f"Bearer {await get_auth_token()}"
+    except Exception:
+        pass  # an unauthenticated ping still gets a 401, which shows the endpoint is reachable
+    payload = {"jsonrpc": "2.0", "id": "probe", "method": "ping"}
+    return await get_http_client().post(
+        f"{base_url}/mcp", json=payload, headers=headers, timeout=upstream.attempt_timeout
+    )
+
+
+async def post_mcp(base_url: str, body: Any, headers: dict[str, str], timeout: float) -> httpx.Response:
+    """POST a JSON-RPC message or batch to one endpoint's /mcp."""
+    return await get_http_client().post(f"{base_url}/mcp", json=body, headers=headers, timeout=timeout)
+
 
-    auth_req = google.auth.transport.requests.Request()
-    target_audience = SERVER_URL
-    return google.oauth2.id_token.fetch_id_token(auth_req, target_audience)
+# One MCP session (initialize, tools/list, Mcp-Session-Id) per endpoint, reused by every call (see sessions.py)
+sessions = SessionManager.from_env("server", post_mcp, "mcp-client-3")
 
-def call_hello_server(name: str) -> dict:
-    """Call the hello server endpoint with authentication."""
-    url = f"{SERVER_URL}/hello?name={name}"
-    print(f"Calling server at: {url}")  # Debug print
+
+async def warm_upstream() -> None:
+    """Mint the ID token, then open a connection and an MCP session on every endpoint."""
+    headers = {"Authorization": f"Bearer {await get_auth_token()}"}
+    opened = await asyncio.gather(
+        *(sessions.asession(e.url, headers, upstream.attempt_timeout) for e in balancer.endpoints)
+    )
+    failed = [e.url for e, (session, _) in zip(balancer.endpoints, opened) if session is None]
+    if failed:
+        raise RuntimeError(f"MCP initialize failed on {', '.join(failed)}")
+
+
+async def coalesced(key: Hashable, idempotent: bool, fn: Callable[[], Awaitable[Any]], timing: ServerTiming) -> Any:
+    """Run `fn()`, or share the result of an identical call in flight if the call is idempotent.
+
+    A caller that joined another's call gets a "coalesced" stage for its wait.
+    """
+    if not idempotent:
+        return await fn()
+    started = time.perf_counter()
+    result, shared = await single_flight.ado(key, fn)
+    if shared:
+        timing.since("coalesced", started)
+    return result
+
+async def call_hello_server(name: str, timing: Optional[ServerTiming] = None) -> dict:
+    """Call the hello server endpoint with authentication.
+
+    The token mint and the HTTP call are added to `timing` as the "token" and
+    "upstream" stages, followed by the server's own stages ("upstream-*").
+    The HTTP call is a CLIENT span whose traceparent is sent upstream, and
+    goes through `upstream` (retries, retry budget, circuit breaker); each
+    attempt is sent to the endpoint `balancer` picks.
+    """
+    timing = timing or ServerTiming()
+    path = f"/hello?name={name}"
+    logger.info("calling hello server", extra={"route": "/api/v1/proxy_hello", "path": path})
     
     # Get ID token for authentication
+    started = time.perf_counter()
     try:
-        id_token = get_auth_token()
-        print(f"\n[MCP-CLIENT-3] Auth Token: {id_token}\n")  # Print the token with service identifier
+        id_token = await get_auth_token()
         headers = {"Authorization": f"Bearer {id_token}"}
     except Exception as e:
-        print(f"[MCP-CLIENT-3] Failed to get auth token: {e}")
+        logger.warning("failed to get auth token", extra={"audience": AUTH_AUDIENCE, "error": str(e)})
         headers = {}
+    timing.since("token", started)
     
-    with httpx.Client() as client:
-        try:
-            response = client.get(url, headers=headers)
+    client = get_http_client()
+    started = time.perf_counter()
+    try:
+        with tracer.span("GET /hello", CLIENT, attributes={"http.method": "GET"}) as span:
+            headers[TRACEPARENT] = span.traceparent()
+            response = await upstream.acall(
+                lambda timeout: balancer.acall(
+                    lambda base_url: client.get(base_url + path, headers=headers, timeout=timeout)
+                ),
+                idempotent=True,
+            )
+            span.set("http.url", str(response.request.url))
+            span.set("http.status_code", response.status_code)
+            timing.since("upstream", started)
+            timing.merge(response.headers.get("server-timing"), "upstream-")
             response.raise_for_status()
-            return response.json()
-        except httpx.HTTPError as e:
-            print(f"HTTP error occurred: {e}")  # Debug print
-            print(f"Response text: {e.response.text if hasattr(e, 'response') else 'No response'}")  # Debug print
-            raise
+        return response.json()
+    except httpx.HTTPError as e:
+        logger.warning(
+            "hello server http error",
+            extra={"error": str(e), "response_text": e.response.text if hasattr(e, "response") else None},
+        )
+        raise
 
 from fastapi import APIRouter
 
@@ -53,24 +211,30 @@ class NameRequest(BaseModel):
     name: str = "World"
 
 @router.post("/proxy_hello")
-def proxy_hello(request: NameRequest) -> dict[str, Any]:
+async def proxy_hello(request: NameRequest, http_request: Request) -> dict[str, Any]:
     """
     A proxy endpoint that connects to the hello server and returns its response.
     
     Args:
         request: The request body containing the name to send to the hello server
     """
-    print(f"Received request with name: {request.name}")  # Debug print
+    logger.info("proxy_hello request", extra={"route": "/api/v1/proxy_hello", "request_name": request.name})
     try:
-        result = call_hello_server(request.name)
-        print(f"Got result from server: {result}")  # Debug print
+        timing = http_request.state.timing
+        result = await coalesced(
+            call_key("GET /hello", None, {"name": request.name}),
+            True,
+            lambda: call_hello_server(request.name, timing),
+            timing,
+        )
+        logger.debug("hello server result", extra={"route": "/api/v1/proxy_hello", "result": result})
         return {
             "proxied_message": result["message"],
             "proxy_info": "Called through client proxy"
         }
     except Exception as e:
         error_msg = str(e)
-        print(f"Error occurred: {error_msg}")  # Debug print
+        logger.error("proxy_hello failed", extra={"route": "/api/v1/proxy_hello", "error": error_msg})
         return {
             "error": f"Failed to call hello server: {error_msg}",
             "status": "error"
@@ -80,9 +244,16 @@ class MCPRequest(BaseModel):
     name: str = "World"
 
 
-def call_mcp_server(name: str) -> dict[str, Any]:
-    """Call the MCP /mcp endpoint using JSON-RPC 2.0 to invoke hello tool (always with auth)."""
-    url = f"{SERVER_URL}/mcp"
+async def call_mcp_server(name: str, timing: Optional[ServerTiming] = None) -> dict[str, Any]:
+    """Call the MCP /mcp endpoint using JSON-RPC 2.0 to invoke hello tool (always with auth).
+
+    Stages are added to `timing` as in call_hello_server. If hedging is on and
+    the tool is idempotent, a slow call is raced against a second copy. The call
+    runs in the endpoint's MCP session; only the first call to an endpoint pays
+    for the initialize handshake.
+    """
+    timing = timing or ServerTiming()
+    idempotent = is_idempotent("tools/call", "hello")
     rpc_id = str(uuid.uuid4())
     payload = {
         "jsonrpc": "2.0",
@@ -92,40 +263,112 @@ def call_mcp_server(name: str) -> dict[str, Any]:
     }
 
     headers = {"Content-Type": "application/json"}
+    started = time.perf_counter()
     try:
-        id_token = get_auth_token()
-        print(f"\n[MCP-CLIENT-3] Auth Token: {id_token}\n")
+        id_token = await get_auth_token()
         headers["Authorization"] = f"Bearer {id_token}"
     except Exception as e:
-        print(f"[MCP-CLIENT-3] Failed to get auth token: {e}")
+        logger.warning("failed to get auth token", extra={"audience": AUTH_AUDIENCE, "error": str(e)})
+    timing.since("token", started)
+
+    started = time.perf_counter()
+    with tracer.span(
+        "POST /mcp",
+        CLIENT,
+        attributes={"http.method": "POST", "rpc.method": "tools/call", "mcp.tool": "hello"},
+    ) as span:
+        headers[TRACEPARENT] = span.traceparent()
 
-    with httpx.Client() as client:
-        response = client.post(url, json=payload, headers=headers)
+        async def send() -> httpx.Response:
+            return await upstream.acall(
+                lambda timeout: balancer.acall(
+                    lambda base_url: sessions.arequest(base_url, payload, headers, timeout)
+                ),
+                idempotent=idempotent,
+            )
+
+        response = await hedger.acall("tools/call hello", send, idempotent)
+        span.set("http.url", str(response.request.url))
+        span.set("http.status_code", response.status_code)
+        timing.since("upstream", started)
+        timing.merge(response.headers.get("server-timing"), "upstream-")
         response.raise_for_status()
-        data = response.json()
-        if "error" in data:
-            # Bubble up as an exception so our API can return cleanly
-            raise RuntimeError(data["error"]) 
-        return data.get("result", {})
+    data = response.json()
+    if "error" in data:
+        # Bubble up as an exception so our API can return cleanly
+        raise RuntimeError(data["error"]) 
+    return data.get("result", {})
 
 
 @router.post("/mcp_call")
-def mcp_call(request: MCPRequest) -> dict[str, Any]:
+async def mcp_call(request: MCPRequest, http_request: Request) -> dict[str, Any]:
     """Proxy endpoint that triggers MCP tools/call hello on the server (always with auth)."""
-    print(f"[MCP-CLIENT-3] MCP call name={request.name}")
+    logger.info("mcp_call request", extra={"route": "/api/v1/mcp_call", "request_name": request.name})
     try:
-        result = call_mcp_server(request.name)
+        timing = http_request.state.timing
+        result = await coalesced(
+            call_key("tools/call", "hello", {"name": request.name}),
+            is_idempotent("tools/call", "hello"),
+            lambda: call_mcp_server(request.name, timing),
+            timing,
+        )
         return {"mcp_result": result, "proxy_info": "MCP client proxy"}
     except httpx.HTTPError as e:
-        print(f"HTTP error occurred: {e}")
+        logger.error("mcp_call http error", extra={"route": "/api/v1/mcp_call", "error": str(e)})
         return {"error": str(e), "status": "error"}
     except Exception as e:
-        print(f"Error occurred: {e}")
+        logger.error("mcp_call failed", extra={"route": "/api/v1/mcp_call", "error": str(e)})
         return {"error": str(e), "status": "error"}
 
+@router.get("/tools")
+async def list_tools() -> dict[str, Any]:
+    """The server's MCP tools, from the session cache (tools/list runs once per session, not per request)."""
+    tools = sessions.tools()
+    if tools is None:
+        headers = {"Content-Type": "application/json"}
+        try:
+            headers["Authorization"] = f"Bearer {await get_auth_token()}"
+        except Exception as e:
+            logger.warning("failed to get auth token", extra={"audience": AUTH_AUDIENCE, "error": str(e)})
+        endpoint = balancer.pick()
+        started = time.monotonic()
+        try:
+            session, failed = await sessions.asession(endpoint.url, headers, upstream.attempt_timeout)
+        except httpx.HTTPError as e:
+            balancer.done(endpoint, started, False)
+            logger.error("list_tools http error", extra={"route": "/api/v1/tools", "error": str(e)})
+            return {"error": str(e), "status": "error"}
+        balancer.done(endpoint, started, failed is None or failed.status_code < 500)
+        if session is None:
+            return {"error": f"MCP initialize failed with HTTP {failed.status_code}", "status": "error"}
+        tools = session.tools or []
+    return {"tools": tools, "proxy_info": "MCP client proxy"}
+
 # Include the router in the main app
 app.include_router(router, prefix="/api/v1")
 
+
+def render_metrics() -> str:
+    """This worker's metrics in Prometheus text format."""
+    return (
+        upstream.render()
+        + balancer.render()
+        + hedger.render()
+        + single_flight.render()
+        + sessions.render()
+        + render_caches([shared_tokens])
+    )
+
+
+# Every gunicorn worker's metrics, labelled worker="<pid>", from whichever worker is scraped
+worker_metrics = WorkerMetrics.from_env(render_metrics)
+
+
+@app.get("/metrics")
+def metrics_endpoint() -> Response:
+    """Prometheus scrape endpoint: upstream breaker, retries, balancer, hedging, coalescing, sessions and token cache."""
+    return Response(content=worker_metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 import uvicorn
 
 if __name__ == "__main__":
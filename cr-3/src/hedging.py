@@ -0,0 +1,242 @@
+"""Hedged requests: a second copy of a slow idempotent call, first success wins.
+
+`Hedger.acall(key, send, idempotent)` (or `call` from sync code) runs
+`send()`. If it has not answered within the hedge delay, `send()` runs a
+second time (the balancer usually picks another endpoint, otherwise it is
+another connection). The first successful response is returned and the
+other call is cancelled; if both fail, the first failure is returned.
+
+- The delay is HEDGE_DELAY_MS if set, otherwise the HEDGE_PERCENTILE-th
+  percentile of the last HEDGE_WINDOW latencies seen for `key` (with 95,
+  only calls slower than the usual p95 are hedged), but at least
+  HEDGE_MIN_DELAY_MS. No hedging happens until 20 latencies are known.
+- Hedges are limited to HEDGE_BUDGET of eligible calls over the last 10
+  seconds (a `RetryBudget`), so when the upstream is slow for everyone,
+  hedging adds at most that much load.
+- Only idempotent calls are hedged (`resilience.is_idempotent`: tools listed
+  in MCP_IDEMPOTENT_TOOLS). Everything else runs `send()` once, as before.
+
+Hedging is off unless HEDGE_PERCENTILE or HEDGE_DELAY_MS is set.
+
+A sync request cannot be interrupted, so in `call` the losing copy runs to
+completion on the hedge thread pool (HEDGE_MAX_WORKERS threads) and its
+response is discarded.
+"""
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+import httpx
+
+from resilience import RETRY_STATUSES, RetryBudget
+
+# Latencies needed for a key before its percentile is trusted
+MIN_SAMPLES = 20
+
+# Recompute a key's percentile after this many new latencies
+RECOMPUTE_EVERY = 50
+
+
+def _succeeded(response: httpx.Response) -> bool:
+    return response.status_code < 500 and response.status_code not in RETRY_STATUSES
+
+
+class Hedger:
+    """Percentile-delayed duplicate requests for idempotent calls, capped by a budget."""
+
+    def __init__(
+        self,
+        name: str,
+        percentile: float = 0.0,
+        fixed_delay: float = 0.0,
+        min_delay: float = 0.005,
+        window: int = 1000,
+        budget: Optional[RetryBudget] = None,
+        max_workers: int = 64,
+    ):
+        self.name = name
+        self.percentile = percentile
+        self.fixed_delay = fixed_delay
+        self.min_delay = min_delay
+        self.window = window
+        self.budget = budget or RetryBudget(ratio=0.05, min_per_second=0.0)
+        self.max_workers = max_workers
+        self.counts: Dict[str, int] = {"eligible": 0, "hedged": 0, "won": 0, "denied": 0}
+        # key -> recent latencies, and the cached delay computed from them
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._delays: Dict[str, float] = {}
+        self._since_recompute: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+    @classmethod
+    def from_env(cls, name: str) -> "Hedger":
+        return cls(
+            name,
+            percentile=float(os.getenv("HEDGE_PERCENTILE", "0")),
+            fixed_delay=float(os.getenv("HEDGE_DELAY_MS", "0")) / 1000,
+            min_delay=float(os.getenv("HEDGE_MIN_DELAY_MS", "5")) / 1000,
+            window=int(os.getenv("HEDGE_WINDOW", "1000")),
+            budget=RetryBudget(ratio=float(os.getenv("HEDGE_BUDGET", "0.05")), min_per_second=0.0),
+            max_workers=int(os.getenv("HEDGE_MAX_WORKERS", "64")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.percentile > 0 or self.fixed_delay > 0
+
+    def delay(self, key: str) -> Optional[float]:
+        """Seconds to wait before hedging a call for `key`; None if it should not be hedged yet."""
+        if self.fixed_delay > 0:
+            return self.fixed_delay
+        return self._delays.get(key)
+
+    def observe(self, key: str, seconds: float) -> None:
+        if self.fixed_delay > 0:
+            return
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if latencies is None:
+                latencies = self._latencies[key] = deque(maxlen=self.window)
+            latencies.append(seconds)
+            since = self._since_recompute.get(key, RECOMPUTE_EVERY) + 1
+            if since < RECOMPUTE_EVERY and key in self._delays:
+                self._since_recompute[key] = since
+                return
+            if len(latencies) < MIN_SAMPLES:
+                return
+            ordered = sorted(latencies)
+            index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+            self._delays[key] = max(self.min_delay, ordered[index])
+            self._since_recompute[key] = 0
+
+    def _hedge_allowed(self) -> bool:
+        if self.budget.try_retry():
+            self.counts["hedged"] += 1
+            return True
+        self.counts["denied"] += 1
+        return False
+
+    async def acall(self, key: str, send: Callable[[], Awaitable[httpx.Response]], idempotent: bool) -> httpx.Response:
+        """Run `send()`, hedged with a second `send()` if it is slow and the call is idempotent."""
+        if not self.enabled or not idempotent:
+            return await send()
+        self.counts["eligible"] += 1
+        self.budget.request()
+        started = time.perf_counter()
+        delay = self.delay(key)
+        tasks: List["asyncio.Task[httpx.Response]"] = [asyncio.ensure_future(send())]
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self._hedge_allowed():
+                    tasks.append(asyncio.ensure_future(send()))
+            pending = set(tasks)
+            first: Optional["asyncio.Task[httpx.Response]"] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=tasks.index):
+                    if task.exception() is None and _succeeded(task.result()):
+                        if task is not tasks[0]:
+                            self.counts["won"] += 1
+                        self.observe(key, time.perf_counter() - started)
+                        await _aclose_others(tasks, task)
+                        return task.result()
+                    first = first or task
+            # Both copies failed: report the first failure
+            assert first is not None
+            await _aclose_others(tasks, first)
+            return first.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def call(self, key: str, send: Callable[[], httpx.Response], idempotent: bool) -> httpx.Response:
+        """Sync version of `acall`; both copies run on the hedge thread pool."""
+        if not self.enabled or not idempotent:
+            return send()
+        self.counts["eligible"] += 1
+        self.budget.request()
+        started = time.perf_counter()
+        delay = self.delay(key)
+        if delay is None:
+            response = send()
+            if _succeeded(response):
+                self.observe(key, time.perf_counter() - started)
+            return response
+        executor = self._get_executor()
+        futures = [executor.submit(send)]
+        done, _ = concurrent.futures.wait(futures, timeout=delay)
+        if not done and self._hedge_allowed():
+            futures.append(executor.submit(send))
+        first: Optional["concurrent.futures.Future[httpx.Response]"] = None
+        for future in concurrent.futures.as_completed(futures):
+            if future.exception() is None and _succeeded(future.result()):
+                if future is not futures[0]:
+                    self.counts["won"] += 1
+                self.observe(key, time.perf_counter() - started)
+                _close_others(futures, future)
+                return future.result()
+            first = first or future
+        assert first is not None
+        _close_others(futures, first)
+        return first.result()
+
+    def _get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix="hedge")
+        return self._executor
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def render(self) -> str:
+        """Prometheus text for hedge counts and the current hedge delay per key."""
+        label = f'upstream="{self.name}"'
+        lines = [
+            "# HELP mcp_upstream_hedge_calls_total Idempotent calls by hedging outcome.",
+            "# TYPE mcp_upstream_hedge_calls_total counter",
+        ]
+        lines += [f'mcp_upstream_hedge_calls_total{{{label},outcome="{k}"}} {n}' for k, n in self.counts.items()]
+        lines += [
+            "# HELP mcp_upstream_hedge_delay_seconds Wait before a call is hedged.",
+            "# TYPE mcp_upstream_hedge_delay_seconds gauge",
+        ]
+        lines += [
+            f'mcp_upstream_hedge_delay_seconds{{{label},call="{key}"}} {delay}'
+            for key, delay in sorted(self._delays.items())
+        ]
+        return "\n".join(lines) + "\n"
+
+
+async def _aclose_others(tasks: List["asyncio.Task[httpx.Response]"], keep: "asyncio.Task[httpx.Response]") -> None:
+    """Cancel copies still running and close responses that already arrived, except `keep`."""
+    for task in tasks:
+        if task is keep:
+            continue
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled() and task.exception() is None:
+            await task.result().aclose()
+
+
+def _close_others(
+    futures: List["concurrent.futures.Future[httpx.Response]"], keep: "concurrent.futures.Future[httpx.Response]"
+) -> None:
+    """Close the other copy's response whenever it arrives (a sync request cannot be interrupted)."""
+
+    def discard(future: "concurrent.futures.Future[httpx.Response]") -> None:
+        if not future.cancelled() and future.exception() is None:
+            future.result().close()
+
+    for future in futures:
+        if future is not keep:
+            future.add_done_callback(discard)
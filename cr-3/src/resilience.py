@@ -0,0 +1,318 @@
+"""Retries, a retry budget and a circuit breaker for the proxies' upstream calls.
+
+`Upstream.call(send, idempotent)` (or `acall` for async clients) runs
+`send(timeout)` once per attempt, each with its own timeout:
+
+- Retries happen on connection errors, timeouts and HTTP 502/503/504/429,
+  up to UPSTREAM_ATTEMPTS attempts in total. A request that is not
+  idempotent is retried only when it never reached the server (connect
+  errors), so it is not run twice.
+- Waits between attempts use decorrelated jitter:
+  `sleep = min(cap, uniform(base, 3 * previous sleep))`. A Retry-After from
+  the server is honoured if it is within the cap; longer than that, the
+  response is returned as is.
+- The retry budget limits retries to UPSTREAM_RETRY_BUDGET of requests over
+  the last 10 seconds, plus UPSTREAM_RETRY_MIN_PER_SEC per second. During
+  an outage, retries therefore add at most that share of load, instead of
+  multiplying it.
+- The circuit breaker opens after UPSTREAM_BREAKER_FAILURES consecutive
+  failures (transport errors and 5xx). While it is open, calls fail
+  immediately with `CircuitOpenError`. After UPSTREAM_BREAKER_RESET seconds,
+  up to UPSTREAM_BREAKER_PROBES calls are let through: a success closes the
+  breaker again and a failure reopens it.
+
+Breaker state and the retry budget live in the process: under gunicorn each
+worker counts its own failures and opens its own breaker, so an upstream
+outage is detected by each worker separately.
+
+`render()` exposes breaker state, attempts, retries and rejections in the
+Prometheus text format.
+"""
+import asyncio
+import math
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Statuses that mean "try again" rather than "this request is wrong"
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+# JSON-RPC methods that are safe to send twice; tools/call only for MCP_IDEMPOTENT_TOOLS
+IDEMPOTENT_METHODS = frozenset({"initialize", "ping", "tools/list"})
+
+# Tools whose calls are safe to repeat (read-only, no side effects)
+IDEMPOTENT_TOOLS = frozenset(t.strip() for t in os.getenv("MCP_IDEMPOTENT_TOOLS", "hello").split(",") if t.strip())
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def is_idempotent(method: str, tool: Optional[str] = None) -> bool:
+    """Whether a JSON-RPC call may be sent more than once."""
+    if method == "tools/call":
+        return tool in IDEMPOTENT_TOOLS
+    return method in IDEMPOTENT_METHODS
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"circuit breaker open for {upstream}; retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a half-open probe phase."""
+
+    def __init__(self, failures: int = 5, reset: float = 10.0, probes: int = 1):
+        self.failures = failures
+        self.reset = reset
+        self.probes = probes
+        self.state = CLOSED
+        self.opened = 0
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = 0
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> Optional[float]:
+        """None if a call may go ahead; otherwise seconds until the breaker lets a probe through."""
+        with self._lock:
+            if self.state == CLOSED:
+                return None
+            now = time.monotonic()
+            if self.state == OPEN:
+                remaining = self._opened_at + self.reset - now
+                if remaining > 0:
+                    return remaining
+                self.state, self._probing = HALF_OPEN, 0
+            if self._probing >= self.probes:
+                # Probes that never report back (cancelled calls) expire after `reset`
+                remaining = self._probe_at + self.reset - now
+                if remaining > 0:
+                    return remaining
+                self._probing = 0
+            self._probing += 1
+            self._probe_at = now
+            return None
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                self._consecutive = 0
+                self.state = CLOSED
+                return
+            self._consecutive += 1
+            if self.state == HALF_OPEN or self._consecutive >= self.failures:
+                if self.state != OPEN:
+                    self.opened += 1
+                self.state, self._opened_at = OPEN, time.monotonic()
+
+
+class RetryBudget:
+    """Allows retries up to `ratio` of requests over the last `window` seconds, plus `min_per_second`."""
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1.0, window: int = 10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        # Per-second ring of [second, requests, retries]
+        self._slots: List[List[int]] = [[-1, 0, 0] for _ in range(window)]
+        self._lock = threading.Lock()
+
+    def _slot(self, now: int) -> List[int]:
+        slot = self._slots[now % self.window]
+        if slot[0] != now:
+            slot[0], slot[1], slot[2] = now, 0, 0
+        return slot
+
+    def request(self) -> None:
+        with self._lock:
+            self._slot(int(time.monotonic()))[1] += 1
+
+    def try_retry(self) -> bool:
+        """Spend one retry from the budget; False if it is exhausted."""
+        now = int(time.monotonic())
+        with self._lock:
+            requests = retries = 0
+            for second, n_requests, n_retries in self._slots:
+                if now - second < self.window:
+                    requests += n_requests
+                    retries += n_retries
+            if retries >= self.ratio * requests + self.min_per_second * self.window:
+                return False
+            self._slot(now)[2] += 1
+            return True
+
+
+class Upstream:
+    """Per-attempt timeouts, budgeted jittered retries and a circuit breaker for one upstream service."""
+
+    def __init__(
+        self,
+        name: str,
+        attempts: int = 3,
+        attempt_timeout: float = 10.0,
+        backoff_base: float = 0.05,
+        backoff_cap: float = 2.0,
+        budget: Optional[RetryBudget] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.name = name
+        self.attempts = attempts
+        self.attempt_timeout = attempt_timeout
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.budget = budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self.counts: Dict[str, int] = {"requests": 0, "attempts": 0, "rejected": 0}
+        self.retries: Dict[str, int] = {}
+        self.retries_denied: Dict[str, int] = {"budget": 0, "attempts": 0, "not_idempotent": 0}
+
+    @classmethod
+    def from_env(cls, name: str) -> "Upstream":
+        return cls(
+            name,
+            attempts=max(1, int(os.getenv("UPSTREAM_ATTEMPTS", "3"))),
+            attempt_timeout=float(os.getenv("UPSTREAM_ATTEMPT_TIMEOUT", "10")),
+            backoff_base=float(os.getenv("UPSTREAM_BACKOFF_BASE_MS", "50")) / 1000,
+            backoff_cap=float(os.getenv("UPSTREAM_BACKOFF_CAP_MS", "2000")) / 1000,
+            budget=RetryBudget(
+                ratio=float(os.getenv("UPSTREAM_RETRY_BUDGET", "0.1")),
+                min_per_second=float(os.getenv("UPSTREAM_RETRY_MIN_PER_SEC", "1")),
+            ),
+            breaker=CircuitBreaker(
+                failures=int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5")),
+                reset=float(os.getenv("UPSTREAM_BREAKER_RESET", "10")),
+                probes=int(os.getenv("UPSTREAM_BREAKER_PROBES", "1")),
+            ),
+        )
+
+    def call(self, send: Callable[[float], httpx.Response], idempotent: bool) -> httpx.Response:
+        """Run `send(timeout)` with retries; returns the last response or raises the last error."""
+        self._begin()
+        sleep = 0.0
+        attempt = 1
+        while True:
+            self._before_attempt()
+            try:
+                response = send(self.attempt_timeout)
+            except httpx.TransportError as e:
+                sleep = self._after_error(e, attempt, idempotent, sleep)
+                if sleep < 0:
+                    raise
+            else:
+                sleep = self._after_response(response, attempt, idempotent, sleep)
+                if sleep < 0:
+                    return response
+                response.close()
+            time.sleep(sleep)
+            attempt += 1
+
+    async def acall(self, send: Callable[[float], Awaitable[httpx.Response]], idempotent: bool) -> httpx.Response:
+        """Async version of `call`."""
+        self._begin()
+        sleep = 0.0
+        attempt = 1
+        while True:
+            self._before_attempt()
+            try:
+                response = await send(self.attempt_timeout)
+            except httpx.TransportError as e:
+                sleep = self._after_error(e, attempt, idempotent, sleep)
+                if sleep < 0:
+                    raise
+            else:
+                sleep = self._after_response(response, attempt, idempotent, sleep)
+                if sleep < 0:
+                    return response
+                await response.aclose()
+            await asyncio.sleep(sleep)
+            attempt += 1
+
+    def _begin(self) -> None:
+        self.counts["requests"] += 1
+        self.budget.request()
+
+    def _before_attempt(self) -> None:
+        wait = self.breaker.allow()
+        if wait is not None:
+            self.counts["rejected"] += 1
+            raise CircuitOpenError(self.name, wait)
+        self.counts["attempts"] += 1
+
+    def _after_error(self, error: httpx.TransportError, attempt: int, idempotent: bool, sleep: float) -> float:
+        """Seconds to wait before the next attempt, or -1 to give up."""
+        self.breaker.record(False)
+        # A connect failure means the request never left, so even non-idempotent calls can go again
+        unsent = isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+        return self._retry(type(error).__name__, attempt, idempotent or unsent, sleep, None)
+
+    def _after_response(self, response: httpx.Response, attempt: int, idempotent: bool, sleep: float) -> float:
+        status = response.status_code
+        # A 429 is the caller's own limit; upstream answered, so it counts as healthy
+        self.breaker.record(status < 500)
+        if status not in RETRY_STATUSES:
+            return -1
+        return self._retry(str(status), attempt, idempotent, sleep, response.headers.get("retry-after"))
+
+    def _retry(self, reason: str, attempt: int, idempotent: bool, sleep: float, retry_after: Optional[str]) -> float:
+        if not idempotent:
+            self.retries_denied["not_idempotent"] += 1
+            return -1
+        if attempt >= self.attempts:
+            self.retries_denied["attempts"] += 1
+            return -1
+        # Decorrelated jitter (AWS Architecture Blog, "Exponential Backoff And Jitter")
+        delay = min(self.backoff_cap, random.uniform(self.backoff_base, max(self.backoff_base, sleep * 3)))
+        if retry_after is not None:
+            try:
+                wanted = float(retry_after)
+            except ValueError:
+                wanted = math.inf
+            if wanted > self.backoff_cap:
+                return -1
+            delay = max(delay, wanted)
+        if not self.budget.try_retry():
+            self.retries_denied["budget"] += 1
+            return -1
+        self.retries[reason] = self.retries.get(reason, 0) + 1
+        return delay
+
+    def render(self) -> str:
+        """Prometheus text for this upstream's breaker, attempts and retries."""
+        label = f'upstream="{self.name}"'
+        lines = [
+            "# HELP mcp_upstream_breaker_state Circuit breaker state (0 closed, 1 half-open, 2 open).",
+            "# TYPE mcp_upstream_breaker_state gauge",
+            f"mcp_upstream_breaker_state{{{label}}} {_STATE_VALUES[self.breaker.state]}",
+            "# HELP mcp_upstream_breaker_opened_total Times the circuit breaker opened.",
+            "# TYPE mcp_upstream_breaker_opened_total counter",
+            f"mcp_upstream_breaker_opened_total{{{label}}} {self.breaker.opened}",
+            "# HELP mcp_upstream_requests_total Proxied calls, before retries.",
+            "# TYPE mcp_upstream_requests_total counter",
+            f"mcp_upstream_requests_total{{{label}}} {self.counts['requests']}",
+            "# HELP mcp_upstream_attempts_total Attempts sent upstream, including retries.",
+            "# TYPE mcp_upstream_attempts_total counter",
+            f"mcp_upstream_attempts_total{{{label}}} {self.counts['attempts']}",
+            "# HELP mcp_upstream_rejected_total Calls failed fast by the open circuit breaker.",
+            "# TYPE mcp_upstream_rejected_total counter",
+            f"mcp_upstream_rejected_total{{{label}}} {self.counts['rejected']}",
+            "# HELP mcp_upstream_retries_total Retries by the error or status that caused them.",
+            "# TYPE mcp_upstream_retries_total counter",
+        ]
+        lines += [f'mcp_upstream_retries_total{{{label},reason="{r}"}} {n}' for r, n in sorted(self.retries.items())]
+        lines += [
+            "# HELP mcp_upstream_retries_denied_total Retryable failures not retried, by reason.",
+            "# TYPE mcp_upstream_retries_denied_total counter",
+        ]
+        lines += [f'mcp_upstream_retries_denied_total{{{label},reason="{r}"}} {n}' for r, n in self.retries_denied.items()]
+        return "\n".join(lines) + "\n"
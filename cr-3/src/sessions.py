@@ -0,0 +1,295 @@
+"""MCP sessions with the upstream server: one handshake per endpoint, results cached.
+
+Before the first request to an endpoint, `SessionManager` runs the MCP
+handshake there: `initialize`, then one JSON-RPC batch with the
+`notifications/initialized` notification and `tools/list` (only if the server
+offers tools). The negotiated protocolVersion, the server's capabilities and
+info, the tool list and the `Mcp-Session-Id` response header are kept per
+endpoint. Later requests to that endpoint skip the handshake and carry the
+`Mcp-Session-Id` and `MCP-Protocol-Version` headers.
+
+The handshake is repeated only when the session has expired. That happens
+when the server answers a request that carried a session id with 404 (the
+request is then sent again in a new session), or after MCP_SESSION_MAX_AGE
+seconds if that is set. If the server advertises `tools.listChanged` and a
+response contains a `notifications/tools/list_changed` message, the tool list
+is fetched again on the next request, without a new handshake.
+
+Concurrent first requests to an endpoint share one handshake. If the
+handshake fails, its HTTP response is returned as the request's response, so
+retries, the circuit breaker and the balancer treat it like any other
+failure.
+
+`tools()` returns the cached tool list (the proxies serve it at
+GET /api/v1/tools without a round trip).
+
+`post(base_url, body, headers, timeout)` sends a JSON-RPC body to the
+endpoint's /mcp with authentication. It is async for `arequest` and sync for
+`request`.
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+import httpx
+
+SESSION_HEADER = "Mcp-Session-Id"
+PROTOCOL_HEADER = "MCP-Protocol-Version"
+
+# Protocol version offered in initialize (the one the servers in this repo speak)
+PROTOCOL_VERSION = "2024-11-05"
+
+LIST_CHANGED = "notifications/tools/list_changed"
+
+Post = Callable[[str, Any, Dict[str, str], float], Union[httpx.Response, Awaitable[httpx.Response]]]
+
+
+class Session:
+    """What the handshake with one endpoint negotiated."""
+
+    __slots__ = ("id", "protocol_version", "capabilities", "server_info", "tools", "opened")
+
+    def __init__(self, result: Dict[str, Any], session_id: Optional[str]):
+        self.id = session_id
+        self.protocol_version: str = result.get("protocolVersion") or PROTOCOL_VERSION
+        self.capabilities: Dict[str, Any] = result.get("capabilities") or {}
+        self.server_info: Dict[str, Any] = result.get("serverInfo") or {}
+        self.tools: Optional[List[Dict[str, Any]]] = None
+        self.opened = time.monotonic()
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = {PROTOCOL_HEADER: self.protocol_version}
+        if self.id:
+            headers[SESSION_HEADER] = self.id
+        return headers
+
+    @property
+    def has_tools(self) -> bool:
+        return "tools" in self.capabilities
+
+    @property
+    def watches_tools(self) -> bool:
+        tools = self.capabilities.get("tools")
+        return isinstance(tools, dict) and bool(tools.get("listChanged"))
+
+
+class SessionManager:
+    """One MCP session per upstream endpoint, opened on first use and reused."""
+
+    def __init__(self, name: str, post: Post, client_name: str, max_age: float = 0.0):
+        self.name = name
+        self.post = post
+        self.client_name = client_name
+        self.max_age = max_age
+        self.sessions: Dict[str, Session] = {}
+        self.counts: Dict[str, int] = {"opened": 0, "expired": 0, "tools_refreshed": 0, "failed": 0}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._alocks: Dict[str, asyncio.Lock] = {}
+        self._guard = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name: str, post: Post, client_name: str) -> "SessionManager":
+        return cls(name, post, client_name, max_age=float(os.getenv("MCP_SESSION_MAX_AGE", "0")))
+
+    def _initialize_body(self) -> Dict[str, Any]:
+        return {
+            "jsonrpc": "2.0",
+            "id": "initialize",
+            "method": "initialize",
+            "params": {
+                "protocolVersion": PROTOCOL_VERSION,
+                "capabilities": {},
+                "clientInfo": {"name": self.client_name, "version": "1.0.0"},
+            },
+        }
+
+    @staticmethod
+    def _followup_body(session: Session, initialized: bool) -> List[Dict[str, Any]]:
+        body: List[Dict[str, Any]] = []
+        if not initialized:
+            body.append({"jsonrpc": "2.0", "method": "notifications/initialized"})
+        if session.has_tools:
+            body.append({"jsonrpc": "2.0", "id": "tools/list", "method": "tools/list"})
+        return body
+
+    def _usable(self, base_url: str) -> Optional[Session]:
+        session = self.sessions.get(base_url)
+        if session is None:
+            return None
+        if self.max_age > 0 and time.monotonic() - session.opened > self.max_age:
+            self._expire(base_url, session)
+            return None
+        if session.tools is None and session.has_tools:
+            return None
+        return session
+
+    def _expire(self, base_url: str, session: Session) -> None:
+        if self.sessions.get(base_url) is session:
+            del self.sessions[base_url]
+            self.counts["expired"] += 1
+
+    def _opened(self, response: httpx.Response) -> Optional[Session]:
+        """Session from an initialize response, or None if the handshake failed."""
+        try:
+            result = response.json().get("result") if response.status_code < 400 else None
+        except ValueError:
+            result = None
+        if not isinstance(result, dict):
+            self.counts["failed"] += 1
+            return None
+        self.counts["opened"] += 1
+        return Session(result, response.headers.get(SESSION_HEADER))
+
+    def _finish(self, base_url: str, session: Session, response: Optional[httpx.Response]) -> bool:
+        """Store the session after the follow-up batch; False if that batch failed."""
+        if response is not None:
+            if response.status_code >= 400:
+                self.counts["failed"] += 1
+                return False
+            session.tools = self._tools_from(response)
+            if session.tools is None:
+                session.tools = []
+        self.sessions[base_url] = session
+        return True
+
+    def _tools_from(self, response: httpx.Response) -> Optional[List[Dict[str, Any]]]:
+        try:
+            data = response.json()
+        except ValueError:
+            return None
+        for message in data if isinstance(data, list) else [data]:
+            if isinstance(message, dict) and message.get("id") == "tools/list":
+                result = message.get("result")
+                if isinstance(result, dict):
+                    return list(result.get("tools") or [])
+        return None
+
+    def _watch(self, base_url: str, session: Session, response: httpx.Response) -> None:
+        """Mark the tool list stale if the server says it changed."""
+        if not session.watches_tools or not response.headers.get("content-type", "").startswith("application/json"):
+            return
+        try:
+            data = response.json()
+        except ValueError:
+            return
+        if isinstance(data, list) and any(isinstance(m, dict) and m.get("method") == LIST_CHANGED for m in data):
+            session.tools = None
+
+    async def asession(
+        self, base_url: str, headers: Dict[str, str], timeout: float
+    ) -> Tuple[Optional[Session], Optional[httpx.Response]]:
+        """The endpoint's session, opened (or its tool list refreshed) if needed; or the failed handshake response."""
+        session = self._usable(base_url)
+        if session is not None:
+            return session, None
+        lock = self._alocks.get(base_url)
+        if lock is None:
+            lock = self._alocks.setdefault(base_url, asyncio.Lock())
+        async with lock:
+            session = self._usable(base_url)
+            if session is not None:
+                return session, None
+            session = self.sessions.get(base_url)
+            initialized = session is not None
+            if session is None:
+                response = await self.post(base_url, self._initialize_body(), headers, timeout)  # type: ignore[misc]
+                session = self._opened(response)
+                if session is None:
+                    return None, response
+            else:
+                self.counts["tools_refreshed"] += 1
+            body = self._followup_body(session, initialized)
+            followup = None
+            if body:
+                followup = await self.post(base_url, body, {**headers, **session.headers}, timeout)  # type: ignore[misc]
+            if not self._finish(base_url, session, followup):
+                return None, followup
+            return session, None
+
+    def session(
+        self, base_url: str, headers: Dict[str, str], timeout: float
+    ) -> Tuple[Optional[Session], Optional[httpx.Response]]:
+        """Sync version of `asession`."""
+        session = self._usable(base_url)
+        if session is not None:
+            return session, None
+        lock = self._locks.get(base_url)
+        if lock is None:
+            with self._guard:
+                lock = self._locks.setdefault(base_url, threading.Lock())
+        with lock:
+            session = self._usable(base_url)
+            if session is not None:
+                return session, None
+            session = self.sessions.get(base_url)
+            initialized = session is not None
+            if session is None:
+                response = self.post(base_url, self._initialize_body(), headers, timeout)
+                session = self._opened(response)  # type: ignore[arg-type]
+                if session is None:
+                    return None, response  # type: ignore[return-value]
+            else:
+                self.counts["tools_refreshed"] += 1
+            body = self._followup_body(session, initialized)
+            followup = None
+            if body:
+                followup = self.post(base_url, body, {**headers, **session.headers}, timeout)
+            if not self._finish(base_url, session, followup):  # type: ignore[arg-type]
+                return None, followup  # type: ignore[return-value]
+            return session, None
+
+    async def arequest(self, base_url: str, body: Any, headers: Dict[str, str], timeout: float) -> httpx.Response:
+        """POST `body` to the endpoint inside its session, opening or renewing the session as needed."""
+        for _attempt in range(2):
+            session, failed = await self.asession(base_url, headers, timeout)
+            if session is None:
+                assert failed is not None
+                return failed
+            response = await self.post(base_url, body, {**headers, **session.headers}, timeout)  # type: ignore[misc]
+            if response.status_code == 404 and session.id:
+                # Session expired on the server: start a new one and send again
+                self._expire(base_url, session)
+                await response.aclose()
+                continue
+            self._watch(base_url, session, response)
+            return response
+        return response
+
+    def request(self, base_url: str, body: Any, headers: Dict[str, str], timeout: float) -> httpx.Response:
+        """Sync version of `arequest`."""
+        for _attempt in range(2):
+            session, failed = self.session(base_url, headers, timeout)
+            if session is None:
+                assert failed is not None
+                return failed
+            response: httpx.Response = self.post(base_url, body, {**headers, **session.headers}, timeout)  # type: ignore[assignment]
+            if response.status_code == 404 and session.id:
+                self._expire(base_url, session)
+                response.close()
+                continue
+            self._watch(base_url, session, response)
+            return response
+        return response
+
+    def tools(self) -> Optional[List[Dict[str, Any]]]:
+        """The cached tool list of any endpoint with an open session, or None if there is none yet."""
+        for session in list(self.sessions.values()):
+            if session.tools is not None:
+                return session.tools
+        return None
+
+    def render(self) -> str:
+        """Prometheus text for open sessions, handshakes, expiries, failures and tool list refreshes."""
+        label = f'upstream="{self.name}"'
+        lines = [
+            "# HELP mcp_upstream_sessions Endpoints with an open MCP session.",
+            "# TYPE mcp_upstream_sessions gauge",
+            f"mcp_upstream_sessions{{{label}}} {len(self.sessions)}",
+            "# HELP mcp_upstream_session_events_total MCP session handshakes and renewals, by event.",
+            "# TYPE mcp_upstream_session_events_total counter",
+        ]
+        lines += [f'mcp_upstream_session_events_total{{{label},event="{k}"}} {n}' for k, n in self.counts.items()]
+        return "\n".join(lines) + "\n"
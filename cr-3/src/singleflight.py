@@ -0,0 +1,134 @@
+"""Single-flight: identical upstream calls in flight at the same time share one call.
+
+`SingleFlight.ado(key, fn)` (or `do` from sync code) runs `fn()` unless a
+call with the same key is already running, in which case it waits for that
+call's result instead. It returns `(result, shared)`, where `shared` says
+whether the result came from another caller's call. Exceptions are shared
+the same way. Build keys with `call_key(method, tool, arguments)`: arguments
+are canonicalized (sorted keys, compact JSON), so {"a": 1, "b": 2} and
+{"b": 2, "a": 1} coalesce.
+
+Only calls that are safe to share should go through here. The proxies skip
+it for tools that `resilience.is_idempotent` does not list, so two identical
+non-idempotent calls still reach the server twice. SINGLE_FLIGHT=false turns
+coalescing off.
+
+Cancellation (async only): the shared call runs in its own task. A waiter
+that is cancelled (its client went away) stops waiting without affecting the
+others, and the upstream call is cancelled only when no waiter is left. Sync
+callers cannot be cancelled; the call finishes and the last waiter returns.
+"""
+import asyncio
+import json
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def call_key(method: str, tool: Optional[str], arguments: Any) -> Tuple[str, Optional[str], str]:
+    """Coalescing key for a call: method, tool and canonical JSON of the arguments."""
+    return method, tool, json.dumps(arguments, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class _AsyncCall:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[Any]"):
+        self.task = task
+        self.waiters = 0
+
+
+class _SyncCall:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Per-key deduplication of concurrent calls."""
+
+    def __init__(self, name: str, enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self.counts: Dict[str, int] = {"calls": 0, "shared": 0}
+        self._async: Dict[Hashable, _AsyncCall] = {}
+        self._sync: Dict[Hashable, _SyncCall] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name: str) -> "SingleFlight":
+        return cls(name, enabled=os.getenv("SINGLE_FLIGHT", "true").lower() in {"1", "true", "yes"})
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """Await `fn()`, or the identical call already in flight; returns (result, shared)."""
+        if not self.enabled:
+            return await fn(), False
+        call = self._async.get(key)
+        shared = call is not None
+        if call is None:
+            call = _AsyncCall(asyncio.ensure_future(fn()))
+            self._async[key] = call
+            call.task.add_done_callback(lambda _task, key=key, call=call: self._forget(self._async, key, call))
+            self.counts["calls"] += 1
+        else:
+            self.counts["shared"] += 1
+        call.waiters += 1
+        try:
+            # shield: a cancelled waiter must not cancel the call the others are waiting for
+            return await asyncio.shield(call.task), shared
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # Last waiter gone: cancel, and let new callers start a fresh call
+                self._forget(self._async, key, call)
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> Tuple[T, bool]:
+        """Sync version of `ado`, for callers on different threads."""
+        if not self.enabled:
+            return fn(), False
+        with self._lock:
+            call = self._sync.get(key)
+            leader = call is None
+            if call is None:
+                call = self._sync[key] = _SyncCall()
+                self.counts["calls"] += 1
+            else:
+                self.counts["shared"] += 1
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    self._forget(self._sync, key, call)
+                call.done.set()
+        else:
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result, not leader
+
+    @staticmethod
+    def _forget(calls: Dict[Hashable, Any], key: Hashable, call: Any) -> None:
+        if calls.get(key) is call:
+            del calls[key]
+
+    def render(self) -> str:
+        """Prometheus text for calls made and calls answered by another caller's call."""
+        label = f'upstream="{self.name}"'
+        lines = [
+            "# HELP mcp_upstream_coalesced_total Calls by whether they went upstream or joined one in flight.",
+            "# TYPE mcp_upstream_coalesced_total counter",
+            f'mcp_upstream_coalesced_total{{{label},outcome="called"}} {self.counts["calls"]}',
+            f'mcp_upstream_coalesced_total{{{label},outcome="shared"}} {self.counts["shared"]}',
+        ]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,356 @@
+"""Endpoint balancing: p2c choice, peak-EWMA decay, outlier ejection and readmission, probes, and tail latency
+over in-process fast and slow stand-in upstreams.
+
+The stand-ins are httpx.MockTransport handlers, so nothing listens on a port;
+the tail-latency tests run in real time and take a couple of seconds.
+
+Usage:
+    python -m pytest tests
+"""
+import asyncio
+import math
+import os
+import random
+import sys
+import time
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import balancer as balancer_module  # noqa: E402
+from balancer import FAILURE_LATENCY, ROUND_ROBIN, Balancer, Endpoint  # noqa: E402
+
+PING = {"jsonrpc": "2.0", "id": "probe", "method": "ping"}
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(balancer_module.time, "monotonic", clock)
+    return clock
+
+
+class Upstream:
+    """Stand-in MCP server: answers after `delay` seconds with `status`.
+
+    A delay longer than the client's read timeout ends in httpx.ReadTimeout
+    after the timeout, as a real stalled server would.
+    """
+
+    def __init__(self, delay: float = 0.0, status: int = 200):
+        self.delay = delay
+        self.status = status
+        self.requests = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        timeout = request.extensions["timeout"]["read"]
+        if timeout is not None and self.delay > timeout:
+            await asyncio.sleep(timeout)
+            raise httpx.ReadTimeout("timed out", request=request)
+        await asyncio.sleep(self.delay)
+        return httpx.Response(self.status, json={"jsonrpc": "2.0", "id": "probe", "result": {"status": "ok"}})
+
+
+def client_for(upstreams: dict) -> httpx.AsyncClient:
+    """One client routing each request to the stand-in named by its host."""
+
+    async def route(request: httpx.Request) -> httpx.Response:
+        upstream = upstreams.get(request.url.host)
+        if upstream is None:
+            raise httpx.ConnectError("connection refused", request=request)
+        return await upstream.handle(request)
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(route))
+
+
+def finish(b: Balancer, endpoint: Endpoint, clock: Clock, seconds: float, ok: bool = True) -> None:
+    started = clock.now
+    clock.now += seconds
+    b.done(endpoint, started, ok)
+
+
+def test_rejects_empty_url_list():
+    with pytest.raises(ValueError):
+        Balancer([])
+
+
+def test_p2c_picks_lower_cost(clock):
+    b = Balancer(["http://a", "http://b/"])
+    fast, slow = b.endpoints
+    assert slow.url == "http://b"
+    fast.ewma, slow.ewma = 0.01, 0.095
+    # With two endpoints both are always drawn, so the cheaper one always wins
+    assert all(b.pick() is fast for _ in range(5))
+    # Five in flight make the fast endpoint cost 0.06, still below 0.095
+    assert fast.in_flight == 5 and fast.cost() == pytest.approx(0.06)
+    assert b.pick() is fast
+    for _ in range(3):
+        b.pick()
+    # Nine in flight: 0.1 > 0.095, the slow endpoint takes the next request
+    assert b.pick() is slow
+    assert fast.counts["requests"] == 9 and slow.counts["requests"] == 1
+
+
+def test_round_robin_rotates(clock):
+    b = Balancer(["http://a", "http://b", "http://c"], policy=ROUND_ROBIN)
+    b.endpoints[0].ewma = 100.0
+    assert [b.pick().url for _ in range(6)] == ["http://a", "http://b", "http://c"] * 2
+
+
+def test_peak_ewma_jumps_up_and_decays(clock):
+    b = Balancer(["http://a", "http://b"], decay=5.0)
+    endpoint = b.endpoints[0]
+    endpoint.in_flight += 1
+    finish(b, endpoint, clock, 0.02)
+    assert endpoint.ewma == pytest.approx(0.02)
+    # A slower sample replaces the estimate at once
+    endpoint.in_flight += 1
+    finish(b, endpoint, clock, 0.5)
+    assert endpoint.ewma == pytest.approx(0.5)
+    # A faster sample one time constant later keeps 1/e of the peak
+    clock.now += 5.0 - 0.02
+    endpoint.in_flight += 1
+    finish(b, endpoint, clock, 0.02)
+    weight = math.exp(-1)
+    assert endpoint.ewma == pytest.approx(0.5 * weight + 0.02 * (1 - weight))
+    # ...and samples long after the peak all but forget it
+    clock.now += 100
+    endpoint.in_flight += 1
+    finish(b, endpoint, clock, 0.02)
+    assert endpoint.ewma == pytest.approx(0.02)
+
+
+def test_failures_count_as_slow(clock):
+    b = Balancer(["http://a", "http://b"])
+    endpoint = b.endpoints[0]
+    endpoint.in_flight += 1
+    finish(b, endpoint, clock, 0.001, ok=False)
+    assert endpoint.ewma == FAILURE_LATENCY
+    assert endpoint.counts["failures"] == 1 and endpoint.in_flight == 0
+
+
+def test_abandoned_attempt_not_recorded(clock):
+    b = Balancer(["http://a", "http://b"])
+    endpoint = b.endpoints[0]
+
+    async def send(url: str) -> httpx.Response:
+        raise asyncio.CancelledError
+
+    for _ in range(5):
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(b.acall(send))
+    assert all(e.in_flight == 0 and e.ewma == 0.0 and e.counts["failures"] == 0 for e in b.endpoints)
+    assert endpoint.ejected_until == 0.0
+
+
+def fail(b: Balancer, endpoint: Endpoint, clock: Clock, times: int) -> None:
+    for _ in range(times):
+        endpoint.in_flight += 1
+        finish(b, endpoint, clock, 0.01, ok=False)
+
+
+def test_ejection_and_readmission(clock):
+    b = Balancer(["http://a", "http://b", "http://c", "http://d"], eject_failures=3, eject_time=30.0)
+    bad = b.endpoints[0]
+    fail(b, bad, clock, 2)
+    # A success in between resets the consecutive failures
+    bad.in_flight += 1
+    finish(b, bad, clock, 0.01)
+    fail(b, bad, clock, 2)
+    assert bad.ejected_until == 0.0
+    fail(b, bad, clock, 1)
+    assert bad.ejected_until == pytest.approx(clock.now + 30.0)
+    assert bad.counts["ejections"] == 1
+    assert all(b.pick() is not bad for _ in range(50))
+    assert 'mcp_upstream_endpoint_ejected{upstream="server",endpoint="http://a"} 1' in b.render()
+
+    # Readmitted after the ejection time, then ejected again soon after: twice as long
+    clock.now += 30.0
+    assert 'endpoint="http://a"} 0' in b.render().split("mcp_upstream_endpoint_ejected{")[1]
+    fail(b, bad, clock, 3)
+    assert bad.ejections == 2
+    assert bad.ejected_until == pytest.approx(clock.now + 60.0)
+
+    # Healthy for a full ejection period after coming back: the multiplier starts over
+    clock.now += 60.0 + 31.0
+    bad.in_flight += 1
+    finish(b, bad, clock, 0.01)
+    assert bad.ejections == 0
+    fail(b, bad, clock, 3)
+    assert bad.ejected_until == pytest.approx(clock.now + 30.0)
+
+
+def test_ejection_capped_by_max_ejected(clock):
+    b = Balancer(["http://a", "http://b", "http://c", "http://d"], eject_failures=1, max_ejected=0.5)
+    for endpoint in b.endpoints:
+        fail(b, endpoint, clock, 1)
+    assert sum(e.ejected_until > clock.now for e in b.endpoints) == 2
+
+
+def test_all_ejected_falls_back_to_every_endpoint(clock):
+    b = Balancer(["http://a", "http://b"], eject_failures=1, max_ejected=1.0)
+    for endpoint in b.endpoints:
+        fail(b, endpoint, clock, 1)
+    assert all(e.ejected_until > clock.now for e in b.endpoints)
+    assert b.pick() in b.endpoints
+
+
+def test_aprobe_ejects_and_readmits(clock):
+    upstreams = {"fast": Upstream(), "broken": Upstream(status=503)}
+    b = Balancer(["http://fast", "http://broken", "http://gone"], eject_failures=2, eject_time=30.0, max_ejected=1.0)
+    fast, broken, gone = b.endpoints
+    client = client_for(upstreams)
+    sent = []
+
+    async def ping(base_url: str) -> httpx.Response:
+        sent.append(base_url)
+        return await client.post(f"{base_url}/mcp", json=PING)
+
+    asyncio.run(b.aprobe(ping))
+    asyncio.run(b.aprobe(ping))
+    assert sent.count("http://fast") == 2 and sent.count("http://broken") == 2 and sent.count("http://gone") == 2
+    # Probes are recorded like requests but are not counted as requests
+    assert fast.failures == 0 and fast.counts == {"requests": 0, "failures": 0, "ejections": 0}
+    assert broken.counts["ejections"] == 1 and gone.counts["ejections"] == 1
+    assert all(b.pick() is fast for _ in range(20))
+
+    # The broken server recovers: the next probe after its ejection readmits it
+    upstreams["broken"].status = 200
+    clock.now += 30.0
+    asyncio.run(b.aprobe(ping))
+    assert broken.failures == 0 and gone.failures == 1
+    # Both are pick() candidates again (ejected_until is not in the future)
+    assert broken.ejected_until <= clock.now and gone.ejected_until <= clock.now
+    # gone fails again and is ejected for twice as long
+    asyncio.run(b.aprobe(ping))
+    assert gone.ejections == 2 and gone.ejected_until == pytest.approx(clock.now + 60.0)
+
+
+def test_probe_errors_not_the_endpoints_fault(clock):
+    b = Balancer(["http://a", "http://b"], eject_failures=1, max_ejected=1.0)
+
+    async def no_token(base_url: str) -> httpx.Response:
+        raise RuntimeError("no credentials")
+
+    asyncio.run(b.aprobe(no_token))
+    assert all(e.failures == 0 and e.ejected_until == 0.0 for e in b.endpoints)
+
+
+def test_sync_probe(clock):
+    def route(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "down":
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(200, json={"jsonrpc": "2.0", "id": "probe", "result": {}})
+
+    b = Balancer(["http://up", "http://down"], eject_failures=1)
+    with httpx.Client(transport=httpx.MockTransport(route)) as client:
+        b.probe(lambda base_url: client.post(f"{base_url}/mcp", json=PING))
+    up, down = b.endpoints
+    assert up.failures == 0 and down.counts["failures"] == 1
+    assert down.ejected_until > clock.now
+
+
+def test_astart_probes_in_background():
+    upstreams = {"a": Upstream(), "b": Upstream()}
+    b = Balancer(["http://a", "http://b"], probe_interval=0.01)
+
+    async def run():
+        async with client_for(upstreams) as client:
+            b.astart(lambda base_url: client.post(f"{base_url}/mcp", json=PING))
+            await asyncio.sleep(0.1)
+            await b.astop()
+
+    asyncio.run(run())
+    assert upstreams["a"].requests >= 2 and upstreams["b"].requests >= 2
+    assert b._task is None
+
+
+def test_single_endpoint_not_probed():
+    b = Balancer(["http://a"], probe_interval=0.01)
+
+    async def run():
+        b.astart(lambda base_url: None)
+        return b._task
+
+    assert asyncio.run(run()) is None
+
+
+def drive(b: Balancer, upstreams: dict, callers: int, requests: int, timeout: float = 5.0) -> list:
+    """Send `requests` requests from `callers` concurrent callers through `b.acall`; return each latency."""
+    latencies = []
+
+    async def run():
+        async with client_for(upstreams) as client:
+
+            async def send(base_url: str) -> httpx.Response:
+                return await client.post(f"{base_url}/mcp", json=PING, timeout=timeout)
+
+            # Warm up the latency estimates, as the probes do after start-up
+            await b.aprobe(send)
+            remaining = iter(range(requests))
+
+            async def caller():
+                for _ in remaining:
+                    started = time.monotonic()
+                    try:
+                        await b.acall(send)
+                    except httpx.TransportError:
+                        pass
+                    latencies.append(time.monotonic() - started)
+
+            await asyncio.gather(*(caller() for _ in range(callers)))
+
+    asyncio.run(run())
+    return latencies
+
+
+def p99(latencies: list) -> float:
+    return sorted(latencies)[int(len(latencies) * 0.99) - 1]
+
+
+SLOW = 0.1
+
+
+def slow_and_fast(policy: str) -> tuple:
+    random.seed(1)
+    upstreams = {"fast-1": Upstream(0.002), "fast-2": Upstream(0.002), "slow": Upstream(SLOW)}
+    return Balancer(["http://fast-1", "http://fast-2", "http://slow"], policy=policy), upstreams
+
+
+def test_p2c_avoids_slow_endpoint():
+    b, upstreams = slow_and_fast("p2c")
+    latencies = drive(b, upstreams, callers=2, requests=300)
+    # It only wins a draw if a fast endpoint's estimate spikes to a third of its latency
+    assert b.endpoints[2].counts["requests"] / 300 < 0.01
+    assert p99(latencies) < SLOW
+
+
+def test_round_robin_waits_for_slow_endpoint():
+    b, upstreams = slow_and_fast(ROUND_ROBIN)
+    latencies = drive(b, upstreams, callers=2, requests=90)
+    # Every third request waits for the slow server, and so does the p99
+    assert b.endpoints[2].counts["requests"] == 30
+    assert p99(latencies) >= SLOW
+
+
+def test_stalled_endpoint_ejected_and_p99_bounded():
+    random.seed(1)
+    upstreams = {"fast-1": Upstream(0.002), "fast-2": Upstream(0.002), "stalled": Upstream(10.0)}
+    b = Balancer(["http://fast-1", "http://fast-2", "http://stalled"], eject_failures=1, eject_time=60.0)
+    latencies = drive(b, upstreams, callers=4, requests=300, timeout=SLOW)
+    stalled = b.endpoints[2]
+    # The warm-up probe timed out and ejected it before any request was sent there
+    assert stalled.counts == {"requests": 0, "failures": 1, "ejections": 1}
+    assert stalled.ejected_until > time.monotonic()
+    assert len(latencies) == 300 and max(latencies) < SLOW
@@ -0,0 +1,207 @@
+"""Hedged calls: when the second copy is sent, which response wins, and that the loser is cancelled or closed.
+
+The copies are stand-ins that answer after a few milliseconds, so these tests
+run in real time.
+
+Usage:
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from hedging import MIN_SAMPLES, RECOMPUTE_EVERY, Hedger  # noqa: E402
+from resilience import RetryBudget  # noqa: E402
+
+DELAY = 0.02
+
+
+def hedger(**kwargs) -> Hedger:
+    kwargs.setdefault("fixed_delay", DELAY)
+    kwargs.setdefault("budget", RetryBudget(ratio=1.0, min_per_second=0.0))
+    return Hedger("server", **kwargs)
+
+
+class Response(httpx.Response):
+    """Records whether the hedger closed it (an in-memory response reports is_closed from the start)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Reading the in-memory body closed it once already
+        self.discarded = False
+
+    def close(self) -> None:
+        self.discarded = True
+        super().close()
+
+    async def aclose(self) -> None:
+        self.discarded = True
+        await super().aclose()
+
+
+class Copies:
+    """`send()` stand-in: copy n answers `statuses[n]` after `delays[n]` seconds (a status of None raises)."""
+
+    def __init__(self, delays, statuses=(200, 200)):
+        self.delays = delays
+        self.statuses = statuses
+        self.sent = 0
+        self.cancelled = []
+        self.responses = []
+
+    def _respond(self, copy: int) -> httpx.Response:
+        request = httpx.Request("POST", "http://server/mcp")
+        if self.statuses[copy] is None:
+            raise httpx.ConnectError("connection refused", request=request)
+        response = Response(self.statuses[copy], json={"copy": copy}, request=request)
+        self.responses.append(response)
+        return response
+
+    async def asend(self) -> httpx.Response:
+        copy = self.sent
+        self.sent += 1
+        try:
+            await asyncio.sleep(self.delays[copy])
+        except asyncio.CancelledError:
+            self.cancelled.append(copy)
+            raise
+        return self._respond(copy)
+
+    def send(self) -> httpx.Response:
+        copy = self.sent
+        self.sent += 1
+        time.sleep(self.delays[copy])
+        return self._respond(copy)
+
+
+def test_disabled_or_not_idempotent_sends_once():
+    for h, idempotent in ((Hedger("server"), True), (hedger(), False)):
+        copies = Copies([DELAY * 3])
+        assert asyncio.run(h.acall("hello", copies.asend, idempotent=idempotent)).json() == {"copy": 0}
+        assert copies.sent == 1 and h.counts["eligible"] == 0
+
+
+def test_fast_call_not_hedged():
+    h = hedger()
+    copies = Copies([0.0])
+    assert asyncio.run(h.acall("hello", copies.asend, idempotent=True)).json() == {"copy": 0}
+    assert copies.sent == 1
+    assert h.counts == {"eligible": 1, "hedged": 0, "won": 0, "denied": 0}
+
+
+def test_hedge_wins_and_cancels_first_copy():
+    h = hedger()
+    copies = Copies([1.0, 0.0])
+    started = time.perf_counter()
+    response = asyncio.run(h.acall("hello", copies.asend, idempotent=True))
+    assert response.json() == {"copy": 1}
+    assert time.perf_counter() - started < 0.5
+    assert copies.cancelled == [0]
+    assert h.counts == {"eligible": 1, "hedged": 1, "won": 1, "denied": 0}
+
+
+def test_first_copy_wins_and_hedge_is_cancelled():
+    h = hedger()
+    copies = Copies([DELAY * 2, 1.0])
+    response = asyncio.run(h.acall("hello", copies.asend, idempotent=True))
+    assert response.json() == {"copy": 0}
+    assert copies.sent == 2 and copies.cancelled == [1]
+    assert h.counts["won"] == 0
+
+
+def test_failed_copy_loses_to_the_other():
+    h = hedger()
+    copies = Copies([DELAY * 2, DELAY * 3], statuses=(503, 200))
+    assert asyncio.run(h.acall("hello", copies.asend, idempotent=True)).json() == {"copy": 1}
+    # The first copy's 503 was closed, not leaked
+    assert copies.responses[0].discarded and not copies.responses[1].discarded
+
+
+def test_both_fail_returns_first_failure():
+    h = hedger()
+    copies = Copies([DELAY * 2, DELAY * 2], statuses=(None, 503))
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(h.acall("hello", copies.asend, idempotent=True))
+    assert copies.responses[0].discarded
+
+    copies = Copies([DELAY * 2, DELAY * 2], statuses=(502, None))
+    assert asyncio.run(h.acall("hello", copies.asend, idempotent=True)).status_code == 502
+
+
+def test_budget_denies_hedge():
+    h = hedger(budget=RetryBudget(ratio=0.0, min_per_second=0.0))
+    copies = Copies([DELAY * 2])
+    assert asyncio.run(h.acall("hello", copies.asend, idempotent=True)).json() == {"copy": 0}
+    assert copies.sent == 1 and h.counts["denied"] == 1
+
+
+def test_caller_cancellation_cancels_both_copies():
+    h = hedger()
+    copies = Copies([1.0, 1.0])
+
+    async def run():
+        call = asyncio.ensure_future(h.acall("hello", copies.asend, idempotent=True))
+        await asyncio.sleep(DELAY * 2)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert sorted(copies.cancelled) == [0, 1]
+
+
+def test_percentile_delay():
+    h = Hedger("server", percentile=90, min_delay=0.005, window=MIN_SAMPLES)
+    for i in range(MIN_SAMPLES - 1):
+        h.observe("hello", (i + 1) / 1000)
+    # Not enough latencies yet
+    assert h.delay("hello") is None
+    h.observe("hello", 0.020)
+    assert h.delay("hello") == pytest.approx(0.019)
+    assert h.delay("other") is None
+    # Cached until RECOMPUTE_EVERY more latencies arrive, then floored at min_delay
+    for _ in range(RECOMPUTE_EVERY - 1):
+        h.observe("hello", 0.001)
+    assert h.delay("hello") == pytest.approx(0.019)
+    h.observe("hello", 0.001)
+    assert h.delay("hello") == 0.005
+    assert 'mcp_upstream_hedge_delay_seconds{upstream="server",call="hello"} 0.005' in h.render()
+
+
+def test_sync_hedge_closes_late_loser():
+    h = hedger()
+    copies = Copies([DELAY * 5, 0.0])
+    try:
+        assert h.call("hello", copies.send, idempotent=True).json() == {"copy": 1}
+        assert h.counts["won"] == 1
+        # The first copy cannot be interrupted; its response is closed when it arrives
+        deadline = time.monotonic() + 1.0
+        while len(copies.responses) < 2 and time.monotonic() < deadline:
+            time.sleep(0.005)
+        time.sleep(0.01)
+        loser = next(r for r in copies.responses if r.json() == {"copy": 0})
+        assert loser.discarded
+    finally:
+        h.shutdown()
+
+
+def test_sync_without_delay_runs_inline():
+    h = Hedger("server", percentile=95)
+    copies = Copies([0.0])
+    threads = []
+
+    def send() -> httpx.Response:
+        threads.append(threading.current_thread())
+        return copies.send()
+
+    h.call("hello", send, idempotent=True)
+    assert threads == [threading.current_thread()]
+    assert h._executor is None
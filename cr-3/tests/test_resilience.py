@@ -0,0 +1,219 @@
+"""Circuit breaker transitions, the retry budget, and which failures `Upstream` retries.
+
+Usage:
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import resilience  # noqa: E402
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, RetryBudget, Upstream  # noqa: E402
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failures=3, reset=10.0)
+    for ok in (False, False, True, False, False):
+        assert breaker.allow() is None
+        breaker.record(ok)
+    # The success in between reset the count
+    assert breaker.state == CLOSED
+    breaker.record(False)
+    assert breaker.state == OPEN and breaker.opened == 1
+    clock.now += 4
+    assert breaker.allow() == pytest.approx(6.0)
+
+
+def test_breaker_half_open_probe_closes(clock):
+    breaker = CircuitBreaker(failures=1, reset=10.0, probes=1)
+    breaker.record(False)
+    clock.now += 10
+    assert breaker.allow() is None
+    assert breaker.state == HALF_OPEN
+    # Only `probes` calls go through while the probe is out
+    assert breaker.allow() == pytest.approx(10.0)
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    assert breaker.allow() is None and breaker.allow() is None
+
+
+def test_breaker_half_open_probe_failure_reopens(clock):
+    breaker = CircuitBreaker(failures=3, reset=10.0, probes=2)
+    for _ in range(3):
+        breaker.record(False)
+    clock.now += 10
+    assert breaker.allow() is None and breaker.allow() is None
+    assert breaker.allow() is not None
+    # One failed probe is enough, whatever the failure threshold
+    breaker.record(False)
+    assert breaker.state == OPEN and breaker.opened == 2
+    assert breaker.allow() == pytest.approx(10.0)
+
+
+def test_breaker_lost_probe_expires(clock):
+    breaker = CircuitBreaker(failures=1, reset=10.0)
+    breaker.record(False)
+    clock.now += 10
+    assert breaker.allow() is None
+    # The probe was cancelled and never recorded: another one goes after `reset`
+    clock.now += 9
+    assert breaker.allow() == pytest.approx(1.0)
+    clock.now += 1
+    assert breaker.allow() is None
+
+
+def test_budget_floor_and_ratio(clock):
+    budget = RetryBudget(ratio=0.1, min_per_second=0.5, window=10)
+    # 0.5/s over 10 s: five retries with no traffic at all
+    assert [budget.try_retry() for _ in range(6)] == [True] * 5 + [False]
+    for _ in range(20):
+        budget.request()
+    # 10% of 20 requests adds two more
+    assert [budget.try_retry() for _ in range(3)] == [True, True, False]
+
+
+def test_budget_window_slides(clock):
+    budget = RetryBudget(ratio=0.0, min_per_second=0.1, window=10)
+    assert budget.try_retry() and not budget.try_retry()
+    clock.now += 9
+    assert not budget.try_retry()
+    clock.now += 1
+    assert budget.try_retry()
+
+
+class Script:
+    """`send(timeout)` stand-in answering with each of `outcomes` in turn: a status code or an exception."""
+
+    def __init__(self, *outcomes, headers=None):
+        self.outcomes = list(outcomes)
+        self.headers = headers or {}
+        self.sent = 0
+
+    def _next(self) -> httpx.Response:
+        outcome = self.outcomes[min(self.sent, len(self.outcomes) - 1)]
+        self.sent += 1
+        request = httpx.Request("POST", "http://server/mcp")
+        if isinstance(outcome, type):
+            raise outcome("failed", request=request)
+        return httpx.Response(outcome, headers=self.headers, request=request)
+
+    def __call__(self, timeout: float) -> httpx.Response:
+        return self._next()
+
+    async def asend(self, timeout: float) -> httpx.Response:
+        return self._next()
+
+
+def upstream(**kwargs) -> Upstream:
+    kwargs.setdefault("backoff_base", 0.0)
+    kwargs.setdefault("backoff_cap", 0.0)
+    return Upstream("server", **kwargs)
+
+
+def test_idempotent_retried_until_attempts(clock):
+    up = upstream(attempts=3)
+    send = Script(503, 502, 200)
+    assert up.call(send, idempotent=True).status_code == 200
+    assert send.sent == 3 and up.retries == {"503": 1, "502": 1}
+    send = Script(503)
+    assert up.call(send, idempotent=True).status_code == 503
+    assert send.sent == 3 and up.retries_denied["attempts"] == 1
+
+
+def test_non_idempotent_retried_only_when_unsent(clock):
+    up = upstream(breaker=CircuitBreaker(failures=100))
+    send = Script(503, 200)
+    assert up.call(send, idempotent=False).status_code == 503
+    assert send.sent == 1 and up.retries_denied["not_idempotent"] == 1
+    with pytest.raises(httpx.ReadTimeout):
+        up.call(Script(httpx.ReadTimeout, 200), idempotent=False)
+    # A refused connection never reached the server
+    send = Script(httpx.ConnectError, 200)
+    assert up.call(send, idempotent=False).status_code == 200
+    assert up.retries["ConnectError"] == 1
+
+
+def test_client_errors_not_retried(clock):
+    up = upstream()
+    send = Script(400, 200)
+    assert up.call(send, idempotent=True).status_code == 400
+    assert send.sent == 1 and up.breaker.state == CLOSED
+
+
+def test_retry_after_beyond_cap_returned(clock):
+    up = upstream(backoff_cap=2.0)
+    send = Script(429, 200, headers={"Retry-After": "30"})
+    assert up.call(send, idempotent=True).status_code == 429
+    assert send.sent == 1
+
+
+def test_retry_after_within_cap_waited(clock, monkeypatch):
+    slept = []
+    monkeypatch.setattr(resilience.time, "sleep", slept.append)
+    up = upstream(backoff_cap=2.0)
+    send = Script(503, 200, headers={"Retry-After": "1.5"})
+    assert up.call(send, idempotent=True).status_code == 200
+    assert slept == [1.5]
+
+
+def test_budget_denies_retries(clock):
+    up = upstream(attempts=5, budget=RetryBudget(ratio=0.0, min_per_second=0.1, window=10))
+    send = Script(503)
+    up.call(send, idempotent=True)
+    assert send.sent == 2 and up.retries_denied["budget"] == 1
+
+
+def test_open_breaker_fails_fast(clock):
+    up = upstream(attempts=1, breaker=CircuitBreaker(failures=2, reset=10.0))
+    for _ in range(2):
+        with pytest.raises(httpx.ConnectError):
+            up.call(Script(httpx.ConnectError), idempotent=True)
+    send = Script(200)
+    with pytest.raises(CircuitOpenError) as raised:
+        up.call(send, idempotent=True)
+    assert send.sent == 0 and raised.value.retry_after == pytest.approx(10.0)
+    assert up.counts == {"requests": 3, "attempts": 2, "rejected": 1}
+    assert 'mcp_upstream_breaker_state{upstream="server"} 2' in up.render()
+
+    # After the reset time the probe goes through and closes it
+    clock.now += 10
+    assert up.call(send, idempotent=True).status_code == 200
+    assert up.breaker.state == CLOSED
+    assert 'mcp_upstream_breaker_state{upstream="server"} 0' in up.render()
+
+
+def test_429_keeps_breaker_closed(clock):
+    up = upstream(attempts=1, breaker=CircuitBreaker(failures=1))
+    up.call(Script(429), idempotent=True)
+    assert up.breaker.state == CLOSED
+
+
+def test_acall_retries_and_opens_breaker(clock):
+    up = upstream(attempts=2, breaker=CircuitBreaker(failures=2, reset=10.0))
+    send = Script(httpx.ConnectTimeout, 503)
+    response = asyncio.run(up.acall(send.asend, idempotent=False))
+    assert response.status_code == 503 and send.sent == 2
+    assert up.retries == {"ConnectTimeout": 1}
+    assert up.breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(up.acall(Script(200).asend, idempotent=True))
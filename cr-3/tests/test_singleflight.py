@@ -0,0 +1,219 @@
+"""Single-flight: sharing one call among identical callers, error fan-out, and cancellation of the leader and waiters.
+
+Usage:
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from singleflight import SingleFlight, call_key  # noqa: E402
+
+
+class Upstream:
+    """Stand-in upstream call that blocks until released, counting calls and cancellations."""
+
+    def __init__(self, result="ok", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_call_key_canonical():
+    assert call_key("tools/call", "hello", {"a": 1, "b": 2}) == call_key("tools/call", "hello", {"b": 2, "a": 1})
+    assert call_key("tools/call", "hello", {"a": 1}) != call_key("tools/call", "hello", {"a": 2})
+    assert call_key("tools/call", "hello", {}) != call_key("tools/call", "other", {})
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight("server")
+
+    async def run():
+        upstream = Upstream()
+        waiters = [asyncio.ensure_future(flight.ado("k", upstream)) for _ in range(3)]
+        other = Upstream(result="other")
+        other.release.set()
+        waiters.append(asyncio.ensure_future(flight.ado("other", other)))
+        await asyncio.sleep(0)
+        upstream.release.set()
+        results = await asyncio.gather(*waiters)
+        return upstream.calls, results
+
+    calls, results = asyncio.run(run())
+    assert calls == 1
+    assert results == [("ok", False), ("ok", True), ("ok", True), ("other", False)]
+    assert flight.counts == {"calls": 2, "shared": 2}
+    assert flight._async == {}
+
+
+def test_finished_call_not_reused():
+    flight = SingleFlight("server")
+
+    async def run():
+        results = []
+        for _ in range(2):
+            upstream = Upstream()
+            upstream.release.set()
+            results.append(await flight.ado("k", upstream))
+        return results
+
+    assert asyncio.run(run()) == [("ok", False), ("ok", False)]
+
+
+def test_error_fans_out_and_is_forgotten():
+    flight = SingleFlight("server")
+
+    async def run():
+        failing = Upstream(error=ConnectionError("refused"))
+        waiters = [asyncio.ensure_future(flight.ado("k", failing)) for _ in range(3)]
+        await asyncio.sleep(0)
+        failing.release.set()
+        outcomes = await asyncio.gather(*waiters, return_exceptions=True)
+        # The failure is not cached: the next caller tries again
+        retry = Upstream()
+        retry.release.set()
+        return outcomes, await flight.ado("k", retry)
+
+    outcomes, retried = asyncio.run(run())
+    assert all(isinstance(e, ConnectionError) for e in outcomes)
+    assert len({id(e) for e in outcomes}) == 1
+    assert retried == ("ok", False)
+
+
+def test_cancelled_leader_does_not_cancel_the_call():
+    flight = SingleFlight("server")
+
+    async def run():
+        upstream = Upstream()
+        leader = asyncio.ensure_future(flight.ado("k", upstream))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.ado("k", upstream))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return leader, await follower, upstream
+
+    leader, result, upstream = asyncio.run(run())
+    assert leader.cancelled()
+    assert result == ("ok", True)
+    assert upstream.calls == 1 and upstream.cancelled == 0
+
+
+def test_last_waiter_cancelled_cancels_the_call():
+    flight = SingleFlight("server")
+
+    async def run():
+        upstream = Upstream()
+        waiters = [asyncio.ensure_future(flight.ado("k", upstream)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        # Forgotten at once: a new caller starts a fresh call rather than joining the cancelled one
+        fresh = Upstream()
+        fresh.release.set()
+        return upstream, await flight.ado("k", fresh)
+
+    upstream, result = asyncio.run(run())
+    assert upstream.calls == 1 and upstream.cancelled == 1
+    assert result == ("ok", False)
+
+
+def test_disabled_runs_every_call():
+    flight = SingleFlight("server", enabled=False)
+
+    async def run():
+        upstream = Upstream()
+        upstream.release.set()
+        return await asyncio.gather(flight.ado("k", upstream), flight.ado("k", upstream)), upstream.calls
+
+    results, calls = asyncio.run(run())
+    assert results == [("ok", False), ("ok", False)] and calls == 2
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.setenv("SINGLE_FLIGHT", "false")
+    assert not SingleFlight.from_env("server").enabled
+    monkeypatch.setenv("SINGLE_FLIGHT", "yes")
+    assert SingleFlight.from_env("server").enabled
+
+
+def run_threads(flight: SingleFlight, fn, callers: int) -> list:
+    """`flight.do("k", fn)` from several threads; returns each (result, shared), or (error, None)."""
+    outcomes = [None] * callers
+
+    def caller(i: int) -> None:
+        try:
+            outcomes[i] = flight.do("k", fn)
+        except Exception as e:
+            outcomes[i] = (e, None)
+
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    return outcomes
+
+
+def held_until_joined(flight: SingleFlight, callers: int, result=None, error=None):
+    """An upstream call that answers only once every other caller has joined it."""
+    calls = []
+
+    def fn():
+        calls.append(1)
+        while flight.counts["shared"] < callers - 1:
+            time.sleep(0.001)
+        if error is not None:
+            raise error
+        return result
+
+    return fn, calls
+
+
+def test_sync_threads_share_one_call():
+    flight = SingleFlight("server")
+    fn, calls = held_until_joined(flight, 3, result="ok")
+    outcomes = run_threads(flight, fn, 3)
+    assert calls == [1]
+    assert sorted(outcomes) == [("ok", False), ("ok", True), ("ok", True)]
+    assert flight._sync == {}
+
+
+def test_sync_error_fans_out():
+    flight = SingleFlight("server")
+    fn, calls = held_until_joined(flight, 3, error=ConnectionError("refused"))
+    errors = [error for error, _ in run_threads(flight, fn, 3)]
+    assert calls == [1]
+    assert all(isinstance(e, ConnectionError) for e in errors)
+    assert len({id(e) for e in errors}) == 1
+    assert flight._sync == {}
+    # Not cached: the next call runs
+    assert flight.do("k", lambda: "ok") == ("ok", False)
+
+
+@pytest.mark.parametrize("outcome", ["called", "shared"])
+def test_render(outcome):
+    flight = SingleFlight("server")
+    assert f'mcp_upstream_coalesced_total{{upstream="server",outcome="{outcome}"}} 0' in flight.render()
@@ -1,12 +1,43 @@
+import contextvars
+import hmac
 import json
 import os
-from typing import Any, Dict
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 
 from flask import Request, Response
 
+from metrics import PROMETHEUS_CONTENT_TYPE, Metrics, OtlpExporter, call_labels
+from registry import Registry, RpcError, encode_batch, encode_error, encode_result, tool_call_args
+from serializer import DecodeError, dumps, loads
+from timing import HEADER as SERVER_TIMING_HEADER, ServerTiming
+from tracing import SERVER, TRACEPARENT, BatchSpanExporter, Tracer
+
 # Optional: enable ID token verification by setting REQUIRE_AUTH=true
 REQUIRE_AUTH = os.getenv("REQUIRE_AUTH", "false").lower() in {"1", "true", "yes"}
 
+# Optional: a static bearer token for GET /metrics, for scrapers that cannot present an ID token
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# JSON-RPC batches: size limit and the worker threads that run entries concurrently
+MAX_BATCH_SIZE = int(os.getenv("MCP_MAX_BATCH_SIZE", "50"))
+_batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("MCP_BATCH_WORKERS", "8")), thread_name_prefix="mcp-batch"
+)
+
+# Per-method/per-tool latency histograms, served on GET /metrics (and pushed over OTLP if configured)
+metrics = Metrics()
+metrics_exporter = OtlpExporter.from_env(metrics, "mcp-hello-func")
+if metrics_exporter is not None:
+    metrics_exporter.start()
+
+# Continues the caller's W3C traceparent; spans are batch-exported if OTLP or TRACE_EXPORT_FILE is set
+span_exporter = BatchSpanExporter.from_env("mcp-hello-func")
+if span_exporter is not None:
+    span_exporter.start()
+tracer = Tracer(span_exporter, float(os.getenv("OTEL_TRACES_SAMPLER_ARG", "1.0")))
+
 # Basic server info/capabilities for MCP initialize
 SERVER_INFO = {"name": "mcp-hello-func", "version": "1.0.0"}
 CAPABILITIES = {
@@ -16,12 +47,14 @@ CAPABILITIES = {
 
 
 def _json_response(payload: Dict[str, Any], status: int = 200) -> Response:
-    return Response(
-        json.dumps(payload), status=status, mimetype="application/json; charset=utf-8"
-    )
+    return Response(dumps(payload), status=status, mimetype="application/json; charset=utf-8")
+
 
+def _raw_response(body: bytes, status: int = 200) -> Response:
+    return Response(body, status=status, mimetype="application/json; charset=utf-8")
 
-def _verify_auth(request: Request) -> None:
+
+def _verify_auth(request: Request, timing: ServerTiming) -> None:
     """Optionally verify Google ID token in Authorization header.
 
     Expects: Authorization: Bearer <token>
@@ -39,6 +72,7 @@ def _verify_auth(request: Request) -> None:
     # Audience: if you front this function behind a Cloud Run custom domain, set to that URL.
     audience = os.getenv("AUTH_AUDIENCE")
 
+    started = time.perf_counter()
     try:
         from google.oauth2 import id_token
         from google.auth.transport import requests as ga_requests
@@ -47,35 +81,77 @@ def _verify_auth(request: Request) -> None:
         # If audience is None, library will accept any Google-issued token; better to set it.
         id_token.verify_oauth2_token(token, req, audience=audience)
     except Exception as e:
+        metrics.observe_auth(started, False)
         raise ValueError(f"token verification failed: {e}")
+    timing.since("auth", started)
+    metrics.observe_auth(started, True)
 
 
-def _rpc_error(id_val: Any, code: int, message: str, data: Any | None = None) -> Dict[str, Any]:
-    err: Dict[str, Any] = {"jsonrpc": "2.0", "id": id_val, "error": {"code": code, "message": message}}
-    if data is not None:
-        err["error"]["data"] = data
-    return err
+def _verify_metrics_auth(request: Request, timing: ServerTiming) -> None:
+    """Authorize GET /metrics: METRICS_TOKEN as the bearer token, or the same ID token check as /mcp.
 
+    With METRICS_TOKEN set and REQUIRE_AUTH off, only METRICS_TOKEN is accepted.
+    Raises: ValueError if the request is not authorized.
+    """
+    if METRICS_TOKEN:
+        presented = request.headers.get("Authorization", "").encode()
+        if hmac.compare_digest(presented, f"Bearer {METRICS_TOKEN}".encode()):
+            return
+        if not REQUIRE_AUTH:
+            raise ValueError("invalid metrics token")
+    _verify_auth(request, timing)
 
-def _rpc_result(id_val: Any, result: Any) -> Dict[str, Any]:
-    return {"jsonrpc": "2.0", "id": id_val, "result": result}
 
+# HTTP status returned alongside each JSON-RPC error code (single requests only)
+_ERROR_STATUS = {-32600: 400, -32601: 404, -32602: 400, -32000: 500}
 
-# Our single demo tool
-TOOLS = [
-    {
-        "name": "hello",
-        "description": "Greets a name with a friendly message.",
-        "inputSchema": {
-            "type": "object",
-            "properties": {"name": {"type": "string", "default": "World"}},
-            "required": [],
-            "additionalProperties": False,
-        },
+registry = Registry()
+
+
+@registry.cached("initialize")
+def _initialize() -> Dict[str, Any]:
+    return {
+        "protocolVersion": "2024-11-05",
+        "capabilities": CAPABILITIES,
+        "serverInfo": SERVER_INFO,
     }
-]
 
 
+# list tools (optional convenience)
+@registry.cached("tools/list", "tools.list")
+def _tools_list() -> Dict[str, Any]:
+    return {"tools": registry.tool_descriptors()}
+
+
+@registry.method("tools/call", "tools.call")
+def _tools_call(params: Dict[str, Any]) -> Any:
+    # Accept both MCP spec shape and older client from cr-2
+    # Spec: { name: "hello", arguments: { name: "World" } }
+    # Legacy: { tool: "hello", name: "World" }
+    tool_name, arguments = tool_call_args(params)
+    tool = registry.get_tool(tool_name)
+    if tool is None:
+        raise RpcError(-32601, f"Unknown tool: {tool_name}")
+    try:
+        return registry.call_tool(tool, arguments)
+    except RpcError:
+        # Invalid arguments (-32602) keep their code and paths
+        raise
+    except Exception as e:
+        raise RpcError(-32000, "Tool execution failed", {"error": str(e)})
+
+
+# Our single demo tool
+@registry.tool(
+    "hello",
+    "Greets a name with a friendly message.",
+    {
+        "type": "object",
+        "properties": {"name": {"type": "string", "default": "World"}},
+        "required": [],
+        "additionalProperties": False,
+    },
+)
 def _call_hello(arguments: Dict[str, Any]) -> Dict[str, Any]:
     name = str(arguments.get("name", "World"))
     # MCP "text" content form; clients in cr-2/cr-3 parse this
@@ -90,6 +166,90 @@ def _call_hello(arguments: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
+# Serialize initialize/tools/list once per instance, not per request
+registry.freeze()
+
+
+def _handle_rpc(body: Any, timing: Optional[ServerTiming] = None) -> Tuple[Optional[bytes], int]:
+    """Handle one JSON-RPC message.
+
+    Returns (serialized response, http_status); response is None for notifications.
+    `timing` gets the dispatch/serialize stages (single requests only).
+    """
+    if not isinstance(body, dict):
+        return encode_error(None, -32600, "Invalid Request: JSON-RPC object required"), 400
+
+    jsonrpc = body.get("jsonrpc")
+    method = body.get("method")
+    id_val = body.get("id")
+    params = body.get("params", {}) or {}
+
+    response, status = _dispatch(jsonrpc, method, id_val, params, timing)
+    # Requests without an id are notifications: run them, but never reply
+    if "id" not in body:
+        return None, 202
+    return response, status
+
+
+def _dispatch(
+    jsonrpc: Any, method: Any, id_val: Any, params: Dict[str, Any], timing: Optional[ServerTiming]
+) -> Tuple[bytes, int]:
+    if jsonrpc != "2.0":
+        return encode_error(id_val, -32600, "Invalid Request: jsonrpc must be '2.0'"), 400
+
+    entry = registry.get(method)
+    label, tool = call_labels(registry, entry, params)
+    series = metrics.begin(label, tool)
+    # Named by the metric labels, so span names stay bounded too
+    span = tracer.start(
+        f"{label} {tool}" if tool else label,
+        attributes={"rpc.system": "jsonrpc", "rpc.method": label, "rpc.jsonrpc.request_id": str(id_val)},
+    )
+    if tool:
+        span.set("mcp.tool", tool)
+    started = time.perf_counter()
+    code = 0
+    error = None
+    try:
+        if entry is None:
+            code, error = -32601, "Method not found"
+            return encode_error(id_val, -32601, f"Method not found: {method}"), 404
+        return encode_result(id_val, registry.call(entry, params, timing)), 200
+    except RpcError as e:
+        code, error = e.code, e.message
+        return encode_error(id_val, e.code, e.message, e.data), _ERROR_STATUS.get(e.code, 500)
+    except Exception as e:
+        code, error = -32603, str(e)
+        raise
+    finally:
+        metrics.end(series, started, code)
+        if code:
+            span.set("rpc.jsonrpc.error_code", code)
+        span.end(error)
+
+
+def _handle_batch(batch: List[Any], timing: ServerTiming) -> Response:
+    """Run a JSON-RPC batch; entries execute concurrently and keep their ids."""
+    if not batch or len(batch) > MAX_BATCH_SIZE:
+        return _raw_response(
+            encode_error(None, -32600, f"Invalid Request: batch must contain between 1 and {MAX_BATCH_SIZE} entries"),
+            status=400,
+        )
+
+    # Per-entry HTTP statuses don't apply inside a batch; errors live in each entry
+    started = time.perf_counter()
+    # Each entry runs in a copy of this context, so its span is a child of the request span
+    futures = [_batch_executor.submit(contextvars.copy_context().run, _handle_rpc, entry) for entry in batch]
+    outcomes = (future.result() for future in futures)
+    responses = [response for response, _status in outcomes if response is not None]
+    started = timing.since("dispatch", started)
+    if not responses:
+        return Response(status=202)
+    content = encode_batch(responses)
+    timing.since("serialize", started)
+    return _raw_response(content)
+
+
 def mcp_function(request: Request) -> Response:
     """Google Cloud Function HTTP entrypoint implementing minimal MCP over HTTP.
 
@@ -97,10 +257,43 @@ def mcp_function(request: Request) -> Response:
       - initialize
       - tools/list
       - tools/call  (accepts either {name, arguments} or legacy {tool, name})
+
+    A JSON array body is treated as a JSON-RPC batch (up to MCP_MAX_BATCH_SIZE
+    entries); notifications (no "id") are executed but produce no response.
+
+    GET /metrics returns this instance's Prometheus metrics, behind the same
+    auth as /mcp (or METRICS_TOKEN, if set).
+
+    Every response carries a Server-Timing header with the auth, parse,
+    dispatch and serialize stages of the request. The request is a server
+    span continuing the caller's traceparent, with one child span per call.
     """
+    if request.method == "GET" and request.path == "/metrics":
+        try:
+            _verify_metrics_auth(request, ServerTiming())
+        except ValueError as e:
+            return _json_response({"error": str(e)}, status=401)
+        return Response(metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+    timing = ServerTiming()
+    with tracer.span(
+        f"{request.method} {request.path}",
+        SERVER,
+        request.headers.get(TRACEPARENT),
+        {"http.method": request.method, "http.target": request.path},
+    ) as span:
+        response = _mcp_request(request, timing)
+        span.set("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.end(error=f"HTTP {response.status_code}")
+    response.headers[SERVER_TIMING_HEADER] = timing.header()
+    return response
+
+
+def _mcp_request(request: Request, timing: ServerTiming) -> Response:
     # Optional auth
     try:
-        _verify_auth(request)
+        _verify_auth(request, timing)
     except ValueError as e:
         return _json_response({"error": str(e)}, status=401)
 
@@ -108,54 +301,21 @@ def mcp_function(request: Request) -> Response:
     if request.method != "POST":
         return _json_response({"error": "POST required"}, status=405)
 
+    raw = request.get_data()
+    started = time.perf_counter()
     try:
-        body = request.get_json(force=True, silent=False)
-    except Exception:
+        body = loads(raw)
+    except DecodeError:
         return _json_response({"error": "invalid JSON"}, status=400)
+    timing.since("parse", started)
+
+    if isinstance(body, list):
+        return _handle_batch(body, timing)
 
     if not isinstance(body, dict):
         return _json_response({"error": "JSON-RPC object required"}, status=400)
 
-    jsonrpc = body.get("jsonrpc")
-    method = body.get("method")
-    id_val = body.get("id")
-    params = body.get("params", {}) or {}
-
-    if jsonrpc != "2.0":
-        return _json_response(_rpc_error(id_val, -32600, "Invalid Request: jsonrpc must be '2.0'"), status=400)
-
-    # initialize handshake
-    if method == "initialize":
-        result = {
-            "protocolVersion": "2024-11-05",
-            "capabilities": CAPABILITIES,
-            "serverInfo": SERVER_INFO,
-        }
-        return _json_response(_rpc_result(id_val, result))
-
-    # list tools (optional convenience)
-    if method in {"tools/list", "tools.list"}:
-        return _json_response(_rpc_result(id_val, {"tools": TOOLS}))
-
-    # tools/call
-    if method in {"tools/call", "tools.call"}:
-        # Accept both MCP spec shape and older client from cr-2
-        # Spec: { name: "hello", arguments: { name: "World" } }
-        # Legacy: { tool: "hello", name: "World" }
-        tool_name = params.get("name") or params.get("tool")
-        if tool_name != "hello":
-            return _json_response(_rpc_error(id_val, -32601, f"Unknown tool: {tool_name}"), status=404)
-
-        arguments: Dict[str, Any] = params.get("arguments") or {}
-        if not arguments and "name" in params and "tool" in params:
-            # legacy form from cr-2
-            arguments = {"name": params.get("name")}
-
-        try:
-            result = _call_hello(arguments)
-            return _json_response(_rpc_result(id_val, result))
-        except Exception as e:
-            return _json_response(_rpc_error(id_val, -32000, "Tool execution failed", {"error": str(e)}), status=500)
-
-    # Unknown method
-    return _json_response(_rpc_error(id_val, -32601, f"Method not found: {method}"), status=404)
+    response, status = _handle_rpc(body, timing)
+    if response is None:
+        return Response(status=status)
+    return _raw_response(response, status=status)
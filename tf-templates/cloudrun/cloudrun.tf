@@ -53,6 +53,20 @@ resource "google_cloud_run_v2_service" "default" {
           cpu    = var.cpu
           memory = var.memory
         }
+        # Extra CPU while the instance starts: imports and warmup finish sooner
+        startup_cpu_boost = var.startup_cpu_boost
+      }
+
+      # Traffic is sent once the port accepts connections, i.e. after the
+      # app's startup (including warmup.py) has finished
+      startup_probe {
+        initial_delay_seconds = 0
+        period_seconds        = 1
+        timeout_seconds       = 1
+        failure_threshold     = var.startup_probe_failures
+        tcp_socket {
+          port = var.container_port
+        }
       }
     }
 
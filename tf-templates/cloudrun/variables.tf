@@ -63,6 +63,18 @@ variable "memory" {
   default     = "512Mi"
 }
 
+variable "startup_cpu_boost" {
+  description = "Allocate extra CPU while an instance starts (shortens cold starts)"
+  type        = bool
+  default     = true
+}
+
+variable "startup_probe_failures" {
+  description = "Startup probe attempts, one per second, before the instance is considered failed"
+  type        = number
+  default     = 30
+}
+
 variable "domain_name" {
   description = "Domain name for the load balancer SSL certificate"
   type        = string